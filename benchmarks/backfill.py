@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+"""
+    Offline Backfill
+    ----------------
+
+    Runs the backfill runner (`lambdas/local.py`) against moto and a fake GitHub organization instead of AWS and
+    GitHub, to exercise a full organization sync without credentials
+
+    Usage: python -m benchmarks.backfill [--size 500] [--functions pullRequestsSync,versionsSync] [--payloads FILE]
+        [--concurrency 16]
+
+"""
+
+import argparse
+import contextlib
+import os
+import sys
+from benchmarks.fake_github import FakeGitHub
+from lambdas import local
+from typing import List, Optional
+
+
+@contextlib.contextmanager
+def offline(size: int):
+    """
+    Run within moto and a fake GitHub organization of `size` repositories.
+        Note: has to be entered before handler modules are imported, as they read their environment on import
+
+    :param size: number of repositories in organization
+    :returns: context manager
+    """
+    import moto
+    from lambdas.tests.conftest import create_resources
+
+    org, metadata_repo = os.environ['GITHUB_ORGANIZATION'], os.environ['GITHUB_METADATA_REPO']
+    github = FakeGitHub.from_config(org=org, metadata_repo=metadata_repo).start()
+    os.environ['GITHUB_API_URL'] = github.url
+    os.environ.setdefault('README_COALESCE_WINDOW', '0')
+    try:
+        with moto.mock_aws():
+            create_resources()
+            github.seed(size=size)
+            yield
+    finally:
+        github.stop()
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog='python -m benchmarks.backfill', description=__doc__.split('\n\n')[1].strip(), add_help=False
+    )
+    parser.add_argument('--size', type=int, default=500, help='repositories in fake GitHub organization (default 500)')
+    args, rest = parser.parse_known_args(argv)
+    #: Remaining arguments (and `--help`) are those of the backfill runner
+    with offline(size=args.size):
+        return local.main(argv=rest)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
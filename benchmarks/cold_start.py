@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+"""
+    Cold Start Benchmark
+    --------------------
+
+    Measures init (import) duration of every lambda handler declared in `serverless.yml`, each in a fresh
+    interpreter, and reports which heavy dependencies were pulled in at import time
+
+    Usage: python -m benchmarks.cold_start [--repeat 5] [--json]
+
+"""
+
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+from typing import Dict, List
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+#: Dependencies that should only be imported once they are actually used
+HEAVY_MODULES = ('boto3', 'github', 'yaml', 'requests')
+
+#: Executed in a fresh interpreter per handler and repetition
+PROBE = '''
+import importlib, json, sys, time
+start = time.perf_counter()
+module = importlib.import_module(sys.argv[1])
+getattr(module, sys.argv[2])
+elapsed = (time.perf_counter() - start) * 1000
+heavy = [m for m in sys.argv[3].split(',') if m in sys.modules]
+print(json.dumps({'init_ms': elapsed, 'modules': len(sys.modules), 'heavy': heavy}))
+'''
+
+
+def _handlers() -> List[str]:
+    """Handlers declared in `serverless.yml`, i.e. - `lambdas/hub.receive`"""
+    with open(os.path.join(ROOT, 'serverless.yml'), 'r') as f:
+        return sorted(set(re.findall(r'^\s+handler:\s+(\S+)\s*$', f.read(), flags=re.MULTILINE)))
+
+
+def _probe(handler: str) -> Dict:
+    """Import `handler` in a fresh interpreter and collect its init duration"""
+    module, function = handler.replace('/', '.').rsplit('.', 1)
+    env = {**os.environ, 'PYTHONPATH': ROOT, 'AWS_DEFAULT_REGION': os.environ.get('AWS_DEFAULT_REGION', 'us-east-1')}
+    result = subprocess.run(
+        [sys.executable, '-c', PROBE, module, function, ','.join(HEAVY_MODULES)],
+        cwd=ROOT,
+        env=env,
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode:
+        raise RuntimeError(f'Unable to import {handler}: {result.stderr.strip().splitlines()[-1]}')
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=5, help='number of fresh interpreters per handler')
+    parser.add_argument('--json', action='store_true', help='emit results as JSON for tracking over time')
+    args = parser.parse_args()
+
+    results = {}
+    for handler in _handlers():
+        runs = [_probe(handler) for _ in range(args.repeat)]
+        best = min(runs, key=lambda r: r['init_ms'])
+        results[handler] = {**best, 'median_ms': sorted(r['init_ms'] for r in runs)[len(runs) // 2]}
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f'{"handler":<40} {"best (ms)":>10} {"median (ms)":>12} {"modules":>8}  heavy imports')
+    for handler, result in results.items():
+        heavy = ', '.join(result['heavy']) or '-'
+        print(
+            f'{handler:<40} {result["init_ms"]:>10.1f} {result["median_ms"]:>12.1f} {result["modules"]:>8}  {heavy}'
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+"""
+    Config Index Benchmark
+    ----------------------
+
+    Compares resolving the configuration of every repository in a large organization using the config index
+    against the former `repository._load_config` (file parsed with `FullLoader` once per distinct repository)
+
+    Usage: python -m benchmarks.config_index [--repos 5000] [--overrides 500] [--patterns 20]
+
+"""
+
+import yaml
+
+import argparse
+import os
+import tempfile
+import time
+import tracemalloc
+from lambdas import config
+from typing import Callable, Dict, List
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+
+def _legacy_load_config(path: str, repo: str) -> Dict:
+    """Former implementation of `repository._load_config` (uncached, as every distinct repo was a cache miss)"""
+    with open(path, 'r') as f:
+        parsed = yaml.load(f, Loader=yaml.FullLoader)
+    try:
+        parsed['default'].update(parsed[repo])
+    except KeyError:
+        pass
+    return parsed['default']
+
+
+def _write_config(overrides: int, patterns: int) -> str:
+    """Write `config.yml` with the repo default section plus exact and pattern overrides, returning its path"""
+    with open(os.path.join(ROOT, 'lambdas', 'config.yml'), 'r') as f:
+        parsed = yaml.safe_load(f)
+    sections = {'default': parsed['default']}
+    sections.update({f'terraform-{i}-*': {'has_wiki': True} for i in range(patterns)})
+    sections.update({f'repository-{i}': {'has_projects': True} for i in range(overrides)})
+
+    fd, path = tempfile.mkstemp(suffix='.yml')
+    with os.fdopen(fd, 'w') as f:
+        yaml.safe_dump(sections, f, allow_unicode=True, sort_keys=False)
+    return path
+
+
+def _resolve_all(index: config.ConfigIndex, repos: List[str]) -> List:
+    """Resolve configuration of every repository"""
+    return [index.get(repo) for repo in repos]
+
+
+def _measure(func: Callable[[], List]) -> Dict:
+    """Duration and peak memory of `func`, measured in separate runs as tracing skews timings"""
+    start = time.perf_counter()
+    func()
+    elapsed = time.perf_counter() - start
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {'ms': elapsed * 1000, 'peak_kb': peak / 1024}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repos', type=int, default=5000, help='number of repositories in the organization')
+    parser.add_argument('--overrides', type=int, default=500, help='number of exact repository overrides')
+    parser.add_argument('--patterns', type=int, default=20, help='number of glob repository overrides')
+    parser.add_argument('--legacy-repos', type=int, default=50, help='repositories resolved with the former loader')
+    args = parser.parse_args()
+
+    path = _write_config(overrides=args.overrides, patterns=args.patterns)
+    repos = [f'repository-{i}' if i % 2 else f'terraform-{i % args.patterns}-{i}' for i in range(args.repos)]
+    try:
+        index = config.load(path)
+        _resolve_all(index, repos)
+        cases = {
+            f'legacy _load_config ({args.legacy_repos} repos)': lambda: [
+                _legacy_load_config(path, repo) for repo in repos[: args.legacy_repos]
+            ],
+            'index load (parse + validate + precompute)': lambda: config.load(path),
+            f'index load + lookups ({args.repos} repos)': lambda: _resolve_all(config.load(path), repos),
+            f'index lookups, warm ({args.repos} repos)': lambda: _resolve_all(index, repos),
+        }
+        for name, func in cases.items():
+            result = _measure(func)
+            print(f'{name:<52} {result["ms"]:>10.2f} ms  {result["peak_kb"]:>10.1f} KiB peak')
+
+        per_repo = _measure(lambda: _legacy_load_config(path, repos[0]))['ms']
+        print(f'\nlegacy extrapolated to {args.repos} repos: {per_repo * args.repos:>10.2f} ms')
+    finally:
+        os.remove(path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,240 @@
+# -*- coding: utf-8 -*-
+"""
+    Benchmark Fixtures
+    ------------------
+
+    Handlers are benchmarked against moto (DynamoDB, SNS, SSM) and a local fake GitHub server, seeded with an
+    organization of each size under test. Latency, peak memory, GitHub requests (served by the fake server) and the
+    handler metrics (DynamoDB capacity, SNS messages, README bytes, etc.) are recorded per handler (steady state,
+    after a warm up invocation) and compared against the stored baseline. Latency is compared relative to a fixed
+    calibration workload timed alongside each handler, so a baseline recorded on one machine holds on another.
+    Latency and peak memory regressions are reported only, counters exceeding the baseline fail the session.
+
+    Usage: python -m pytest benchmarks [--org-sizes 10,500,5000] [--update-baseline] [--regression-tolerance 0.5]
+
+"""
+
+import hashlib
+import json
+import moto
+import os
+import pytest
+import time
+import tracemalloc
+import uuid
+from benchmarks.fake_github import FakeGitHub
+from lambdas import metrics
+from lambdas.tests.conftest import REGION, ROOT, create_resources
+from typing import Any, Callable, Dict, Iterator
+
+BASELINE = os.path.join(ROOT, 'benchmarks', 'baseline.json')
+ORG_SIZES = '10,500,5000'
+#: Metrics that vary in between runs, reported (never failed) when they exceed the baseline by more than the tolerance
+NOISY_METRICS = frozenset({'relative_ms', 'peak_kib'})
+#: Metrics depending on the speed of the machine, reported but never compared against the baseline
+MACHINE_METRICS = frozenset({'mean_ms', 'calibration_ms'})
+#: Rounds of the calibration workload, the fastest round is taken as the speed of the machine
+CALIBRATION_ROUNDS = 5
+
+#: Handler metrics reported per invocation, by result name
+HANDLER_METRICS = {
+    'dynamodb_requests': 'DynamoDBRequests',
+    'dynamodb_capacity': 'DynamoDBConsumedCapacity',
+    'dynamodb_items_scanned': 'DynamoDBItemsScanned',
+    'sns_published': 'SNSMessagesPublished',
+    'readme_bytes': 'ReadmeBytesWritten',
+}
+#: Metrics of every handler benchmarked this session, by test name
+RESULTS: Dict[str, Dict[str, float]] = {}
+#: Handler metrics are captured in memory instead of printed as EMF records
+SINK = metrics.SINK = metrics.MemorySink()
+
+#: Fake GitHub has to be up before `lambdas.hub` reads `GITHUB_API_URL`
+GITHUB = FakeGitHub.from_config(
+    org=os.environ['GITHUB_ORGANIZATION'], metadata_repo=os.environ['GITHUB_METADATA_REPO']
+).start()
+os.environ['GITHUB_API_URL'] = GITHUB.url
+#: Coalescing window would only add idle time to README updates
+os.environ['README_COALESCE_WINDOW'] = '0'
+
+
+class LambdaContext:
+    """Lambda context object of a single invocation"""
+
+    function_name = 'watcher-benchmark'
+    memory_limit_in_mb = 1024
+    invoked_function_arn = f'arn:aws:lambda:{REGION}:123456789012:function:watcher-benchmark'
+
+    def __init__(self):
+        self.aws_request_id = str(uuid.uuid4())
+
+    @staticmethod
+    def get_remaining_time_in_millis() -> int:
+        return 15 * 60 * 1000
+
+
+def _calibration_workload() -> str:
+    """Fixed CPU bound workload - serialization, hashing and sorting as done by handlers"""
+    items = [{'repository': f'org/repo-{i:05d}', 'versions': [f'v{i % 7}.{j}' for j in range(10)]} for i in range(2000)]
+    serialized = json.dumps(sorted(items, key=lambda item: (item['versions'][0], item['repository'])))
+    return hashlib.sha1(json.dumps(json.loads(serialized)).encode('utf-8')).hexdigest()
+
+
+def calibration_ms() -> float:
+    """Milliseconds the calibration workload takes on this machine (under its current load)"""
+    timings = []
+    for _ in range(CALIBRATION_ROUNDS):
+        start = time.perf_counter()
+        _calibration_workload()
+        timings.append((time.perf_counter() - start) * 1000)
+    return min(timings)
+
+
+def pytest_addoption(parser):
+    group = parser.getgroup('watcher', 'watcher benchmarks')
+    group.addoption('--org-sizes', default=ORG_SIZES, help=f'comma separated organization sizes (default {ORG_SIZES})')
+    group.addoption('--baseline', default=BASELINE, help='path of baseline metrics file')
+    group.addoption('--update-baseline', action='store_true', help='store metrics of this run as the baseline')
+    group.addoption(
+        '--regression-tolerance',
+        type=float,
+        default=0.5,
+        help='fraction relative latency and peak memory may exceed the baseline by before being reported',
+    )
+
+
+def pytest_generate_tests(metafunc):
+    if 'org' in metafunc.fixturenames:
+        sizes = [int(size) for size in metafunc.config.getoption('org_sizes').split(',')]
+        metafunc.parametrize('org', sizes, ids=[f'{size}-repos' for size in sizes], indirect=True, scope='session')
+
+
+@pytest.fixture(scope='session')
+def org(request) -> Iterator[int]:
+    """Organization of `request.param` repositories, with fresh AWS resources and GitHub object caches"""
+    from lambdas import hub
+
+    with moto.mock_aws():
+        create_resources()
+        GITHUB.seed(size=request.param)
+        for cached in (hub.get_github_repo, hub.get_github_repos, hub.get_github_org):
+            cached.cache_clear()
+        yield request.param
+
+
+@pytest.fixture
+def measure(benchmark, org: int, request) -> Callable[[Callable[[Dict, Any], Any], Callable[[], Dict]], Any]:
+    """
+    Benchmark a handler invoked with fresh events (unique delivery/message ids) and record its metrics.
+
+    :returns: function receiving a handler and an event factory, returning the handler result of the last round
+    """
+
+    def run(handler: Callable[[Dict, Any], Any], event: Callable[[], Dict]) -> Any:
+        rounds = 0
+        counts = dict.fromkeys(['mean_ms', 'github_requests', *HANDLER_METRICS], 0.0)
+
+        def invoke(evt: Dict, context: LambdaContext) -> Any:
+            nonlocal rounds
+            github = GITHUB.requests
+            start = time.perf_counter()
+            try:
+                return handler(evt, context)
+            finally:
+                rounds += 1
+                counts['mean_ms'] += (time.perf_counter() - start) * 1000
+                counts['github_requests'] += GITHUB.requests - github
+                for key, name in HANDLER_METRICS.items():
+                    counts[key] += SINK.records[-1]['metrics'][name]
+
+        #: First invocation fills caches (ETags, GitHub objects, tables) and is not measured
+        handler(event(), LambdaContext())
+        calibration = calibration_ms()
+        result = benchmark.pedantic(
+            invoke, setup=lambda: ((event(), LambdaContext()), {}), rounds=max(1, min(5, 1000 // org)), iterations=1
+        )
+
+        #: Tracing skews timings, peak memory is measured in a separate invocation
+        tracemalloc.start()
+        try:
+            handler(event(), LambdaContext())
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+        recorded = {key: round(value / rounds, 2) for key, value in counts.items()}
+        recorded['calibration_ms'] = round(calibration, 2)
+        recorded['relative_ms'] = round(recorded['mean_ms'] / calibration, 3)
+        recorded['peak_kib'] = round(peak / 1024, 1)
+        benchmark.extra_info.update(recorded)
+        RESULTS[request.node.name] = recorded
+        return result
+
+    return run
+
+
+def _load_baseline(path: str) -> Dict[str, Dict[str, float]]:
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def _regressions(config) -> Dict[str, Dict[str, Dict[str, float]]]:
+    """Metrics of this run exceeding the baseline, by test name"""
+    baseline = _load_baseline(config.getoption('baseline'))
+    tolerance = config.getoption('regression_tolerance')
+    regressions = {}
+    for name, recorded in RESULTS.items():
+        for metric, value in recorded.items():
+            expected = baseline.get(name, {}).get(metric)
+            if expected is None or not value or metric in MACHINE_METRICS:
+                continue
+            limit = expected * (1 + tolerance) if metric in NOISY_METRICS else expected
+            if value > limit:
+                regressions.setdefault(name, {})[metric] = {'baseline': expected, 'current': value}
+    return regressions
+
+
+def pytest_sessionfinish(session, exitstatus):
+    config = session.config
+    if not RESULTS:
+        return
+    if config.getoption('update_baseline'):
+        path = config.getoption('baseline')
+        baseline = {**_load_baseline(path), **RESULTS}
+        with open(path, 'w') as f:
+            json.dump(dict(sorted(baseline.items())), f, indent=2)
+            f.write('\n')
+        return
+    config._watcher_regressions = _regressions(config)
+    if any(set(regressed) - NOISY_METRICS for regressed in config._watcher_regressions.values()):
+        session.exitstatus = pytest.ExitCode.TESTS_FAILED
+
+
+def pytest_terminal_summary(terminalreporter, exitstatus, config):
+    if not RESULTS:
+        return
+    columns = ('mean_ms', 'calibration_ms', 'relative_ms', 'peak_kib', 'github_requests', *HANDLER_METRICS)
+    width = max(len(name) for name in RESULTS)
+    terminalreporter.section('watcher handler metrics (per invocation)')
+    terminalreporter.write_line(f'{"handler":<{width}}' + ''.join(f'{column:>24}' for column in columns))
+    for name, result in sorted(RESULTS.items()):
+        terminalreporter.write_line(f'{name:<{width}}' + ''.join(f'{result[column]:>24}' for column in columns))
+
+    if config.getoption('update_baseline'):
+        terminalreporter.write_line(f'\nBaseline updated - {config.getoption("baseline")}')
+        return
+    regressions = getattr(config, '_watcher_regressions', {})
+    if regressions:
+        terminalreporter.section('watcher regressions', red=True)
+        for name, regressed in sorted(regressions.items()):
+            for metric, values in regressed.items():
+                noisy = metric in NOISY_METRICS
+                terminalreporter.write_line(
+                    f'{name} {metric}: {values["current"]} (baseline {values["baseline"]})'
+                    + (' - report only' if noisy else ''),
+                    red=not noisy,
+                    yellow=noisy,
+                )
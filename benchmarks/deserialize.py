@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+"""
+    Deserialize Benchmark
+    ---------------------
+
+    Micro-benchmark comparing bulk deserialization of scan pages against the former per-item
+    `TypeDeserializer` + `replace_decimals` implementation
+
+    Usage: python -m benchmarks.deserialize [--items 1000] [--repeat 5]
+
+"""
+
+from boto3.dynamodb.types import TypeDeserializer
+
+import argparse
+import timeit
+from lambdas import dynamodb
+from typing import Dict, List
+
+
+def _legacy_deserialize(serialized: Dict) -> Dict:
+    """Former implementation of `dynamodb.deserialize`"""
+    deserializer = TypeDeserializer()
+    return dynamodb.replace_decimals({key: deserializer.deserialize(val) for key, val in serialized.items()})
+
+
+def _page(size: int) -> List[Dict]:
+    """Generate a page of low-level pull request table items"""
+    return [
+        {
+            'repository': {'S': f'clowdhaus/repository-{i % 250}'},
+            'pull_request': {'N': str(i)},
+            'url': {'S': f'https://github.com/clowdhaus/repository-{i % 250}/pull/{i}'},
+            'user': {'S': 'octocat'},
+            'date': {'S': '2021-02-15'},
+            'branch': {'S': f'feature/{i}'},
+            'mergeable': {'BOOL': True},
+            'mergeable_state': {'S': 'clean'},
+            'age': {'N': str(i % 90)},
+            'row': {'S': f'|clowdhaus/repository-{i % 250}|[#{i}](https://github.com)|feature/{i}|octocat|{i % 90}|\n'},
+            'versions': {'L': [{'S': f'v1.{n}.0'} for n in range(10)]},
+        }
+        for i in range(size)
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--items', type=int, default=1000, help='number of items per scan page')
+    parser.add_argument('--repeat', type=int, default=5, help='number of timed repetitions')
+    args = parser.parse_args()
+
+    page = _page(args.items)
+    assert [_legacy_deserialize(item) for item in page] == dynamodb.deserialize_items(page)
+
+    cases = {
+        'legacy (TypeDeserializer + replace_decimals)': lambda: [_legacy_deserialize(item) for item in page],
+        'deserialize (per item)': lambda: [dynamodb.deserialize(item) for item in page],
+        'deserialize_items': lambda: dynamodb.deserialize_items(page),
+        'deserialize_items (allow-list)': lambda: dynamodb.deserialize_items(page, attributes=['repository', 'row']),
+    }
+    baseline = None
+    for name, func in cases.items():
+        best = min(timeit.repeat(func, number=1, repeat=args.repeat))
+        baseline = baseline or best
+        print(f'{name:<48} {best * 1000:>9.2f} ms  {baseline / best:>6.1f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,282 @@
+# -*- coding: utf-8 -*-
+"""
+    Fake GitHub
+    -----------
+
+    Local GitHub API server seeded with a synthetic organization, used to benchmark handlers offline
+
+    Serves the REST endpoints used by watcher (and PyGithub) with `ETag`/`304` revalidation, `Link` pagination and
+    rate limit headers. Writes are acknowledged without changing state so every benchmark round sees the same org.
+
+"""
+
+import yaml
+
+import base64
+import hashlib
+import json
+import os
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Optional, Pattern, Tuple
+from urllib.parse import parse_qs, urlencode, urlparse
+
+#: Pages served when the client does not ask for a page size, as GitHub does
+DEFAULT_PER_PAGE = 30
+UPDATED_AT = '2021-02-15T10:00:00Z'
+#: Label acknowledged for label writes
+LABEL = {'name': 'label', 'color': '000000', 'description': ''}
+
+
+class FakeGitHub:
+    """
+    Seeded organization served over HTTP, reseeded with `seed(size)` for every organization size benchmarked.
+
+    :param org: organization name
+    :param settings: repository settings (config defaults), every tenth repository has drifted from them
+    :param labels: repository labels (config labels), every tenth repository has a stray label
+    :param metadata_repo: full name of repository holding the README rendered by watcher
+    """
+
+    def __init__(self, org: str, settings: Dict, labels: List[Dict], metadata_repo: str):
+        self.org = org
+        self.settings = settings
+        self.labels = labels
+        self.metadata_repo = metadata_repo
+        self.repos: Dict[str, Dict] = {}
+        self.requests = 0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+        self._server.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+        self.routes = self._routes()
+        self.readme = '# Metadata\n\n<!-- PR Start -->\n<!-- PR End -->\n\n<!-- Tag Start -->\n<!-- Tag End -->\n'
+
+    @classmethod
+    def from_config(cls, org: str, metadata_repo: str, path: Optional[str] = None) -> 'FakeGitHub':
+        """
+        Fake GitHub serving repositories set up as the `default` section of watcher config.
+
+        :param org: organization name
+        :param metadata_repo: full name of repository holding the README rendered by watcher
+        :param path: path of config file, `lambdas/config.yml` when not provided
+        :returns: fake GitHub (not started)
+        """
+        path = path or os.path.join(os.path.dirname(__file__), '..', 'lambdas', 'config.yml')
+        with open(path, 'r') as f:
+            defaults = yaml.safe_load(f)['default']
+        settings = {key: value for key, value in defaults.items() if key != 'labels'}
+        return cls(org=org, settings=settings, labels=defaults.get('labels', []), metadata_repo=metadata_repo)
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def seed(self, size: int) -> 'FakeGitHub':
+        """
+        Replace organization with `size` repositories (plus the metadata repository), resetting the request count.
+
+        :param size: number of repositories
+        :returns: self
+        """
+        self.repos = {}
+        for i in range(size):
+            self._add(name=f'repository-{i:05d}', i=i)
+        self._add(name=self.metadata_repo.split('/')[-1], i=0)
+        self.requests = 0
+        return self
+
+    def _add(self, name: str, i: int):
+        """Seed repository `name`"""
+        full_name = f'{self.org}/{name}'
+        drifted = i % 10 == 9
+        self.repos[full_name] = {
+            'settings': {**self.settings, 'has_wiki': not self.settings.get('has_wiki')} if drifted else self.settings,
+            'labels': self.labels + ([{'name': 'stray', 'color': '000000', 'description': ''}] if drifted else []),
+            'pulls': [
+                {
+                    'number': n,
+                    'html_url': f'https://github.com/{full_name}/pull/{n}',
+                    'user': {'login': 'octocat'},
+                    'created_at': UPDATED_AT,
+                    'updated_at': UPDATED_AT,
+                    'head': {'ref': f'feature/{n}'},
+                    'mergeable': True,
+                    'mergeable_state': 'clean',
+                }
+                for n in range(1, 1 + i % 3)
+            ],
+            'tags': [{'name': f'v1.{n}.0'} for n in range(i % 5)],
+        }
+
+    def start(self) -> 'FakeGitHub':
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _repo_json(self, full_name: str) -> Dict:
+        repo = self.repos[full_name]
+        return {
+            'id': abs(hash(full_name)) % 10 ** 8,
+            'name': full_name.split('/')[-1],
+            'full_name': full_name,
+            'url': f'{self.url}/repos/{full_name}',
+            'owner': {'login': self.org},
+            'default_branch': repo['settings'].get('default_branch', {}).get('name', 'main'),
+            'updated_at': UPDATED_AT,
+            'fork': False,
+            **{k: v for k, v in repo['settings'].items() if k not in {'default_branch', 'labels'}},
+        }
+
+    def _routes(self) -> Dict[Tuple[str, Pattern[str]], Callable[..., Tuple[int, object]]]:
+        """
+        Route table of served endpoints, the first (method, path pattern) matching a request is served.
+            Note: named groups of the path pattern are passed to the handler as keyword arguments
+
+        :returns: handler of each method and path regular expression
+        """
+        repo = r'^/repos/(?P<full_name>[^/]+/[^/]+)'
+        org = f'^/orgs/{re.escape(self.org)}'
+        routes: Dict[Tuple[str, str], Callable[..., Tuple[int, object]]] = {
+            ('GET', f'{org}$'): lambda: (200, {'login': self.org, 'url': f'{self.url}/orgs/{self.org}'}),
+            ('GET', f'{org}/repos$'): lambda: (200, [self._repo_json(full_name) for full_name in self.repos]),
+            ('GET', f'{repo}$'): lambda full_name: (200, self._repo_json(full_name)),
+            ('GET', f'{repo}/pulls$'): self._get_pulls,
+            ('GET', rf'{repo}/pulls/(?P<number>\d+)$'): self._get_pull,
+            ('GET', f'{repo}/tags$'): lambda full_name: (200, self.repos[full_name]['tags']),
+            ('GET', f'{repo}/labels$'): lambda full_name: (200, self.repos[full_name]['labels']),
+            ('GET', f'{repo}/vulnerability-alerts$'): self._get_vulnerability_alerts,
+            ('GET', f'{repo}/automated-security-fixes$'): self._get_automated_security_fixes,
+            ('GET', f'{repo}/branches/[^/]+/protection$'): self._get_protection,
+            ('GET', f'{repo}/branches/(?P<branch>[^/]+)$'): self._get_branch,
+            ('GET', f'{repo}/git/refs?/'): lambda full_name: (
+                200,
+                {'ref': 'refs/tags/v1.0.0', 'object': {'sha': 'b' * 40, 'type': 'tag'}},
+            ),
+            ('GET', f'{repo}/git/tags/'): lambda full_name: (
+                200,
+                {'sha': 'b' * 40, 'tag': 'v1.0.0', 'message': '- Initial release', 'object': {}},
+            ),
+            ('GET', f'{repo}/contents/'): self._get_readme,
+            #: Writes are acknowledged without changing state
+            ('PATCH', f'{repo}$'): lambda full_name: (200, self._repo_json(full_name)),
+            ('PUT', f'{repo}/contents/README.md$'): lambda full_name: (
+                200,
+                {'content': {'path': 'README.md', 'sha': 'c' * 40}, 'commit': {'sha': 'd' * 40}},
+            ),
+            ('POST', f'{repo}/releases$'): lambda full_name: (201, {'id': 1, 'tag_name': 'v1.0.0'}),
+            ('PUT', f'{repo}/branches/[^/]+/protection$'): lambda full_name: (200, {}),
+            ('PUT', f'{repo}/(vulnerability-alerts|automated-security-fixes)$'): lambda full_name: (204, None),
+            ('DELETE', f'{repo}/'): lambda full_name: (204, None),
+            ('POST', f'{repo}/labels$'): lambda full_name: (201, LABEL),
+            ('PATCH', f'{repo}/labels/[^/]+$'): lambda full_name: (200, LABEL),
+        }
+        return {(method, re.compile(pattern)): handler for (method, pattern), handler in routes.items()}
+
+    def route(self, method: str, path: str, query: Dict[str, str]) -> Tuple[int, object]:
+        """
+        Resolve API request.
+
+        :param method: HTTP method
+        :param path: request path
+        :param query: query string parameters
+        :returns: status code and response JSON
+        """
+        for (route_method, pattern), handler in self.routes.items():
+            match = pattern.match(path) if route_method == method else None
+            if match is None:
+                continue
+            kwargs = match.groupdict()
+            if 'full_name' in kwargs and kwargs['full_name'] not in self.repos:
+                break
+            return handler(**kwargs)
+        return 404, {'message': 'Not Found'}
+
+    def _get_pulls(self, full_name: str) -> Tuple[int, object]:
+        pulls = self.repos[full_name]['pulls']
+        return 200, [{**pr, 'mergeable': None, 'mergeable_state': 'unknown'} for pr in pulls]
+
+    def _get_pull(self, full_name: str, number: str) -> Tuple[int, object]:
+        pull = next((pr for pr in self.repos[full_name]['pulls'] if pr['number'] == int(number)), None)
+        return (404, {'message': 'Not Found'}) if pull is None else (200, pull)
+
+    def _get_vulnerability_alerts(self, full_name: str) -> Tuple[int, object]:
+        return (204, None) if self.repos[full_name]['settings'].get('enable_vulnerability_alert') else (404, {})
+
+    def _get_automated_security_fixes(self, full_name: str) -> Tuple[int, object]:
+        enabled = bool(self.repos[full_name]['settings'].get('enable_automated_security_fixes'))
+        return 200, {'enabled': enabled, 'paused': False}
+
+    def _get_protection(self, full_name: str) -> Tuple[int, object]:
+        branch = self.repos[full_name]['settings'].get('default_branch', {})
+        reviews = {k: v for k, v in branch.items() if k != 'name'}
+        return 200, {'required_pull_request_reviews': {'required_approving_review_count': 1, **reviews}}
+
+    def _get_branch(self, full_name: str, branch: str) -> Tuple[int, object]:
+        url = f'{self.url}/repos/{full_name}/branches/{branch}'
+        return 200, {'name': branch, 'commit': {'sha': 'a' * 40}, 'protection_url': f'{url}/protection'}
+
+    def _get_readme(self, full_name: str) -> Tuple[int, object]:
+        content = base64.b64encode(self.readme.encode('utf-8')).decode('ascii')
+        sha = hashlib.sha1(self.readme.encode('utf-8')).hexdigest()
+        return 200, {'type': 'file', 'encoding': 'base64', 'content': content, 'sha': sha, 'path': 'README.md'}
+
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def _respond(self):
+                with fake._lock:
+                    fake.requests += 1
+                length = int(self.headers.get('Content-Length') or 0)
+                if length:
+                    self.rfile.read(length)
+
+                url = urlparse(self.path)
+                query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+                status, data = fake.route(method=self.command, path=url.path, query=query)
+
+                headers = {
+                    'X-RateLimit-Limit': '5000',
+                    'X-RateLimit-Remaining': '4999',
+                    'X-RateLimit-Reset': '4102444800',
+                    'X-RateLimit-Resource': 'core',
+                }
+                if isinstance(data, list):
+                    #: Paginate listings with `Link` headers
+                    per_page = int(query.get('per_page', DEFAULT_PER_PAGE))
+                    page = int(query.get('page', 1))
+                    if page * per_page < len(data):
+                        next_query = urlencode({**query, 'page': page + 1})
+                        headers['Link'] = f'<{fake.url}{url.path}?{next_query}>; rel="next"'
+                    data = data[(page - 1) * per_page : page * per_page]
+
+                body = b'' if data is None else json.dumps(data).encode('utf-8')
+                etag = f'"{hashlib.md5(body).hexdigest()}"'
+                if self.command == 'GET' and status == 200 and self.headers.get('If-None-Match') == etag:
+                    status, body = 304, b''
+                self.send_response(status)
+                for key, value in headers.items():
+                    self.send_header(key, value)
+                if self.command == 'GET':
+                    self.send_header('ETag', etag)
+                if body:
+                    self.send_header('Content-Type', 'application/json; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            do_GET = do_POST = do_PUT = do_PATCH = do_DELETE = _respond
+
+        return Handler
@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+"""
+    Handler Benchmarks
+    ------------------
+
+    Benchmarks of every lambda handler against a seeded organization, see `conftest.py`
+
+"""
+
+import hashlib
+import hmac
+import json
+import os
+import uuid
+from lambdas import hub, pull_requests, repository, versions
+from lambdas.tests.conftest import PARAMETERS
+from typing import Dict, List
+
+ORGANIZATION = os.environ['GITHUB_ORGANIZATION']
+#: Repository whose settings and labels have drifted from config (every tenth repository in the fake org)
+DRIFTED_REPO = f'{ORGANIZATION}/repository-00009'
+#: Records per SQS batch, as configured for queue subscribed handlers
+BATCH_SIZE = 10
+UPDATED_AT = '2021-02-15T10:00:00Z'
+
+
+def _repo(i: int) -> Dict:
+    return {'full_name': f'{ORGANIZATION}/repository-{i % 10:05d}', 'updated_at': UPDATED_AT}
+
+
+def _pull_request_msg(i: int) -> Dict:
+    pr = {
+        'number': 1,
+        'html_url': f'https://github.com/{_repo(i)["full_name"]}/pull/1',
+        'user': {'login': 'octocat'},
+        'created_at': UPDATED_AT,
+        'updated_at': UPDATED_AT,
+        'head': {'ref': 'feature/1'},
+        'mergeable': True,
+        'mergeable_state': 'clean',
+    }
+    return {'action': 'synchronize', 'number': 1, 'pull_request': pr, 'repository': _repo(i)}
+
+
+def _tag_msg(i: int) -> Dict:
+    return {'ref': 'v1.0.0', 'ref_type': 'tag', 'repository': _repo(i), 'X-GitHub-Event': 'create'}
+
+
+def _sns_event(message: Dict) -> Dict:
+    return {'Records': [{'Sns': {'MessageId': str(uuid.uuid4()), 'Message': json.dumps(message)}}]}
+
+
+def _sqs_event(messages: List[Dict]) -> Dict:
+    return {'Records': [{'messageId': str(uuid.uuid4()), 'body': json.dumps(msg)} for msg in messages]}
+
+
+def _delivered(msg: Dict) -> Dict:
+    return {**msg, 'X-GitHub-Delivery': str(uuid.uuid4())}
+
+
+def _webhook_event() -> Dict:
+    body = json.dumps(_pull_request_msg(i=0)).encode('utf-8')
+    secret = PARAMETERS['/watcher/github_webhook_secret'].encode('utf-8')
+    signature = hmac.new(secret, body, hashlib.sha256).hexdigest()
+    headers = {
+        'X-GitHub-Event': 'pull_request',
+        'X-GitHub-Delivery': str(uuid.uuid4()),
+        'X-Hub-Signature-256': f'sha256={signature}',
+    }
+    return {'headers': headers, 'body': body.decode('utf-8'), 'isBase64Encoded': False}
+
+
+def test_hub_receive(measure):
+    assert measure(hub.receive, _webhook_event)['statusCode'] == 202
+
+
+def test_pull_requests_pull_request(measure):
+    def event() -> Dict:
+        return _sqs_event([{'pull_request': _delivered(_pull_request_msg(i))} for i in range(BATCH_SIZE)])
+
+    assert measure(pull_requests.pull_request, event) == {'batchItemFailures': []}
+
+
+def test_pull_requests_update_readme(measure):
+    data = pull_requests._get_pull_request_data(_pull_request_msg(i=0))
+
+    def event() -> Dict:
+        return _sns_event({'readme': {field: data[field] for field in pull_requests.ROW_FIELDS}})
+
+    assert measure(pull_requests.update_readme, event)['triggers'] == 1
+
+
+def test_pull_requests_sync(measure):
+    assert measure(pull_requests.sync, dict)['status'] == 'complete'
+
+
+def test_versions_new_tag(measure):
+    def event() -> Dict:
+        return _sqs_event([{'tag': _delivered(_tag_msg(i))} for i in range(BATCH_SIZE)])
+
+    assert measure(versions.new_tag, event) == {'batchItemFailures': []}
+
+
+def test_versions_create_release(measure):
+    measure(versions.create_release, lambda: _sns_event({'tag': _delivered(_tag_msg(i=0))}))
+
+
+def test_versions_update_readme(measure):
+    assert measure(versions.update_readme, lambda: _sns_event({}))['triggers'] == 1
+
+
+def test_versions_sync(measure):
+    assert measure(versions.sync, dict)['status'] == 'complete'
+
+
+def test_repository_update(measure):
+    msg = {'action': 'edited', 'repository': {'full_name': DRIFTED_REPO, 'updated_at': UPDATED_AT}}
+    measure(repository.update, lambda: _sns_event({'repository': _delivered(msg)}))
+
+
+def test_repository_sync(measure):
+    assert measure(repository.sync, dict)['status'] == 'complete'
+
+
+def test_repository_update_labels(measure):
+    measure(repository.update_labels, lambda: _sns_event({'label': {'full_name': DRIFTED_REPO}}))
+
+
+def test_repository_sync_labels(measure):
+    measure(repository.sync_labels, dict)
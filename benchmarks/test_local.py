@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+"""
+    Backfill Benchmarks
+    -------------------
+
+    Benchmark of a full organization sync and README render, run end to end in process (see `lambdas/local.py`)
+
+"""
+
+from lambdas import local
+
+
+def test_local_backfill(benchmark, org):
+    report = benchmark.pedantic(local.backfill, rounds=1, iterations=1)
+    benchmark.extra_info.update({'invocations': report['invocations'], 'errors': report['errors']})
+    assert report['errors'] == 0
+    #: Every repository is updated once by the settings sync and once by the labels sync
+    assert report['functions']['repositoryUpdate']['invocations'] == org + 1
+    assert report['functions']['repositoryUpdateLabels']['invocations'] == org + 1
+    assert {'pullRequestsUpdateReadme', 'versionsUpdateReadme'} <= set(report['functions'])
@@ -0,0 +1,345 @@
+# -*- coding: utf-8 -*-
+"""
+    Checkpoint
+    ----------
+
+    Module contains resumable org-wide syncs; repositories are processed in chunks of a deterministic order and a
+    cursor is persisted to the state table after each chunk. A sync running low on time re-invokes its own function
+    to continue from the cursor, so a full pass of a large organization is not bound to a single lambda timeout
+
+"""
+
+from aws_lambda_powertools.logging import Logger
+from botocore.exceptions import ClientError
+
+import json
+import os
+import time
+import uuid
+from collections import defaultdict
+from lambdas import clients, dynamodb, hub, sns
+from typing import TYPE_CHECKING, Any, Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+if TYPE_CHECKING:
+    from github.Repository import Repository
+
+#: DynamoDB table for watcher state, holds the cursor and completion marker of each sync
+STATE_TABLE = os.environ.get('STATE_TABLE')
+#: Repositories per chunk of the REST sync engine (GraphQL chunks are query pages)
+SYNC_CHUNK_SIZE = int(os.environ.get('SYNC_CHUNK_SIZE', '100'))
+#: Seconds kept in reserve to checkpoint and re-invoke, on top of the slowest chunk of the invocation
+SYNC_TIME_RESERVE = int(os.environ.get('SYNC_TIME_RESERVE', '15'))
+#: Seconds without progress after which a running sync is considered abandoned and resumed by the next trigger
+SYNC_LEASE = int(os.environ.get('SYNC_LEASE', '900'))
+
+logger = Logger()
+
+
+class Superseded(Exception):
+    """Another invocation has taken over (or restarted) the sync run"""
+
+
+def _key(name: str) -> Dict:
+    """State table key for sync `name`"""
+    return {'id': f'sync#{name}'}
+
+
+class Checkpoint:
+    """Progress of a sync run, persisted to the state table (held in memory only when no state table is set)"""
+
+    def __init__(self, name: str, state: Dict):
+        self.name = name
+        self.run: str = state['run']
+        self.source: str = state['source']
+        self.invocation: int = state['invocation']
+        self.started: int = state['started']
+        self.cursor: Optional[str] = state.get('cursor')
+        self.processed: int = state.get('processed', 0)
+        self.counts: Dict[str, int] = state.get('counts', {})
+
+    @classmethod
+    def claim(cls, name: str, source: str, resume: Optional[str]) -> Tuple[Optional['Checkpoint'], str]:
+        """
+        Claim sync `name` for this invocation - continuing run `resume`, resuming an abandoned run or starting anew.
+            Note: claims are conditional on the state read, so only one invocation makes progress on a run
+
+        :param name: sync name
+        :param source: order and cursor format of chunks, an unfinished run of another source is restarted
+        :param resume: run id carried by a continuation event, `None` for scheduled triggers
+        :returns: claimed checkpoint (`None` when not claimed) and how it was claimed, or why not
+        """
+        now = int(time.time())
+        fresh = {'run': str(uuid.uuid4()), 'source': source, 'invocation': 1, 'started': now}
+        if not STATE_TABLE:
+            return cls(name=name, state=fresh), 'started'
+
+        try:
+            state = dynamodb.replace_decimals(dynamodb.get_item(key=_key(name), table=STATE_TABLE, ConsistentRead=True))
+        except KeyError:
+            state = {}
+
+        #: Failed runs are resumed by the next trigger (i.e. - async retry) without waiting out the lease
+        resumable = state.get('status') in {'running', 'failed'} and state.get('source') == source
+        running = resumable and state.get('status') == 'running'
+        if resume is not None:
+            if not running or state.get('run') != resume:
+                return None, 'superseded'
+            how = 'continued'
+        elif running and state.get('updated', 0) > now - SYNC_LEASE:
+            return None, 'running'
+        else:
+            how = 'resumed' if resumable else 'started'
+
+        checkpoint = cls(name=name, state={**state, 'invocation': state['invocation'] + 1} if resumable else fresh)
+        try:
+            checkpoint._write(status='running', previous=state)
+        except Superseded:
+            return None, 'superseded'
+        return checkpoint, how
+
+    def _write(self, status: str, previous: Dict):
+        """
+        Persist checkpoint, conditional on the state table still holding `previous` state.
+
+        :param status: `running`, `failed` or `complete`
+        :param previous: state last read or written by this invocation
+        :returns: None
+        """
+        if not STATE_TABLE:
+            return
+        now = int(time.time())
+        item = {
+            **_key(self.name),
+            'run': self.run,
+            'source': self.source,
+            'invocation': self.invocation,
+            'status': status,
+            'cursor': self.cursor,
+            'processed': self.processed,
+            'counts': self.counts,
+            'started': self.started,
+            'updated': now,
+        }
+        if status == 'complete':
+            item['completed'] = now
+
+        condition = {'ConditionExpression': 'attribute_not_exists(id)'}
+        if previous.get('run'):
+            condition = {
+                'ConditionExpression': '#run = :run AND #invocation = :invocation',
+                'ExpressionAttributeNames': {'#run': 'run', '#invocation': 'invocation'},
+                'ExpressionAttributeValues': {':run': previous['run'], ':invocation': previous['invocation']},
+            }
+        try:
+            dynamodb.put_item(item=item, table=STATE_TABLE, **condition)
+        except ClientError as err:
+            if err.response['Error']['Code'] == 'ConditionalCheckFailedException':
+                raise Superseded(f'Sync `{self.name}` run {self.run} was claimed by another invocation')
+            raise
+
+    def _state(self) -> Dict:
+        """Claim condition values of the state written by this invocation"""
+        return {'run': self.run, 'invocation': self.invocation}
+
+    def _add(self, counts: Dict[str, int]):
+        """Add `counts` to the run totals"""
+        for name, value in counts.items():
+            self.counts[name] = self.counts.get(name, 0) + value
+
+    def advance(self, cursor: str, processed: int, counts: Dict[str, int]):
+        """
+        Persist progress of a processed chunk.
+
+        :param cursor: cursor of the last processed chunk
+        :param processed: number of repositories in chunk
+        :param counts: counts to add to the run totals
+        :returns: None
+        """
+        self.cursor = cursor
+        self.processed += processed
+        self._add(counts=counts)
+        self._write(status='running', previous=self._state())
+
+    def complete(self, counts: Dict[str, int]):
+        """
+        Mark the run complete, the completion marker stays in place until the next run starts.
+
+        :param counts: counts to add to the run totals
+        :returns: None
+        """
+        self._add(counts=counts)
+        self._write(status='complete', previous=self._state())
+
+    def fail(self):
+        """
+        Mark the run failed, it is resumed from its cursor by the next trigger.
+
+        :returns: None
+        """
+        self._write(status='failed', previous=self._state())
+
+    def report(self, status: str) -> Dict:
+        """
+        Report how far the run got.
+
+        :param status: `started`, `continued`, `resumed` (claimed), `continuing` (re-invoked) or `complete`
+        :returns: run progress and totals
+        """
+        return {
+            'sync': self.name,
+            'status': status,
+            'run': self.run,
+            'invocation': self.invocation,
+            'processed': self.processed,
+            'cursor': self.cursor,
+            **self.counts,
+        }
+
+
+def _remaining(context: Any) -> float:
+    """Seconds left in the invocation, unbounded outside of lambda"""
+    remaining = getattr(context, 'get_remaining_time_in_millis', None)
+    return remaining() / 1000 if remaining else float('inf')
+
+
+def _reinvoke(event: Dict, context: Any, run: str):
+    """
+    Asynchronously invoke the current function with a continuation of `event` for `run`.
+        Note: runs of the local backfill runner (`lambdas/local.py`) continue in process, through its transport
+
+    :param event: lambda event of the current invocation
+    :param context: lambda context object of the current invocation
+    :param run: run id to continue
+    :returns: None
+    """
+    payload = json.dumps({**event, 'checkpoint': run}, default=str)
+    invoke = getattr(sns.TRANSPORT, 'invoke', None)
+    if invoke is not None:
+        invoke(function=context.function_name, event=json.loads(payload))
+        return
+    clients.client('lambda').invoke(
+        FunctionName=context.invoked_function_arn,
+        InvocationType='Event',
+        Payload=payload.encode('utf-8'),
+    )
+
+
+def run(
+    name: str,
+    event: Dict,
+    context: Any,
+    source: str,
+    chunks: Callable[[Optional[str]], Iterator[Tuple[Any, str]]],
+    process: Callable[[Any], Dict[str, int]],
+    finish: Callable[[], Dict[str, int]],
+) -> Dict:
+    """
+    Run sync `name` chunk by chunk from its persisted cursor, re-invoking the function to continue when time runs low.
+
+    :param name: sync name, progress is kept per sync
+    :param event: lambda event, continuations carry the run id as `checkpoint`
+    :param context: lambda context object
+    :param source: order and cursor format of `chunks` (i.e. - sync engine), an unfinished run of another source
+        is restarted
+    :param chunks: function returning the chunks after a cursor (`None` to start) as `(chunk, cursor)` pairs
+    :param process: function processing a chunk, returning counts to add to the run totals
+    :param finish: function called once every chunk is processed, returning counts to add to the run totals
+    :returns: report of how far the run got (see `Checkpoint.report`), or why this invocation did not run
+    """
+    checkpoint, how = Checkpoint.claim(name=name, source=source, resume=event.get('checkpoint'))
+    if checkpoint is None:
+        logger.info({'operation': 'checkpoint', 'sync': name, 'status': how})
+        return {'sync': name, 'status': how}
+    logger.info({'operation': 'checkpoint', **checkpoint.report(status=how)})
+
+    try:
+        slowest = 0.0
+        start = time.monotonic()
+        for chunk, cursor in chunks(checkpoint.cursor):
+            checkpoint.advance(cursor=cursor, processed=len(chunk), counts=process(chunk))
+            slowest, start = max(slowest, time.monotonic() - start), time.monotonic()
+            if STATE_TABLE and _remaining(context) < SYNC_TIME_RESERVE + slowest:
+                _reinvoke(event=event, context=context, run=checkpoint.run)
+                report = checkpoint.report(status='continuing')
+                logger.info({'operation': 'checkpoint', **report})
+                return report
+        checkpoint.complete(counts=finish())
+    except Superseded as err:
+        logger.warning({'operation': 'checkpoint', 'sync': name, 'status': 'superseded', 'message': str(err)})
+        return {'sync': name, 'status': 'superseded'}
+    except Exception:
+        #: A run left `running` would only be resumed once its lease expires, retries in between would be skipped
+        try:
+            checkpoint.fail()
+        except Exception:
+            logger.exception({'operation': 'checkpoint', 'sync': name, 'message': 'Unable to mark run failed'})
+        raise
+
+    report = checkpoint.report(status='complete')
+    logger.info({'operation': 'checkpoint', **report})
+    return report
+
+
+def repository_chunks(org: str, cursor: Optional[str], size: int = SYNC_CHUNK_SIZE) -> Iterator[Tuple[List, str]]:
+    """
+    Chunks of `org` repositories ordered by full name, continuing after repository `cursor`.
+
+    :param org: name of GitHub organization
+    :param cursor: full name of the last processed repository, `None` to start from the first
+    :param size: repositories per chunk
+    :returns: iterator of `(repositories, cursor)` pairs
+    """
+    repos: List['Repository'] = sorted(hub.get_github_repos(org=org), key=lambda repo: repo.full_name)
+    if cursor is not None:
+        repos = [repo for repo in repos if repo.full_name > cursor]
+    for i in range(0, len(repos), size):
+        chunk = repos[i : i + size]
+        yield chunk, chunk[-1].full_name
+
+
+class RepositoryTable:
+    """
+    Table keyed by `repository` first, reconciled chunk by chunk against the existing items.
+        Note: existing items are scanned once per invocation, as key -> digest pairs grouped by repository
+    """
+
+    def __init__(self, table: str, key_ids: List[str]):
+        self.table = table
+        self.key_ids = key_ids
+        self._existing: Optional[Dict[str, Dict[Tuple, str]]] = None
+
+    @property
+    def existing(self) -> Dict[str, Dict[Tuple, str]]:
+        if self._existing is None:
+            self._existing = defaultdict(dict)
+            for key, digest in dynamodb.digests(table=self.table, key_ids=self.key_ids).items():
+                self._existing[key[0]][key] = digest
+        return self._existing
+
+    def reconcile(self, items: Iterable[Dict], repositories: Iterable[str]) -> Dict[str, int]:
+        """
+        Reconcile the items of `repositories` - vanished items of these repositories are deleted.
+
+        :param items: iterable of the complete, desired set of items of `repositories`
+        :param repositories: full names of the repositories in chunk
+        :returns: counts of `inserted`, `updated`, `deleted` and `unchanged` items
+        """
+        existing = {}
+        for repository in repositories:
+            existing.update(self.existing.pop(repository, {}))
+        return dynamodb.reconcile(items=items, key_ids=self.key_ids, table=self.table, existing=existing)
+
+    def prune(self, repositories: Set[str]) -> Dict[str, int]:
+        """
+        Delete the items of every repository no longer in the organization.
+
+        :param repositories: full names of all organization repositories
+        :returns: counts of `inserted`, `updated`, `deleted` and `unchanged` items
+        """
+        stale = {
+            key: digest
+            for repository, keys in self.existing.items()
+            if repository not in repositories
+            for key, digest in keys.items()
+        }
+        return dynamodb.reconcile(items=(), key_ids=self.key_ids, table=self.table, existing=stale)
@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+"""
+    Claim Check
+    -----------
+
+    Module contains the projection and offloading of messages published between functions; payloads are projected
+    to the fields their consumers read, messages still over `CLAIM_CHECK_THRESHOLD` are compressed and, when that is
+    not enough, stored in S3 (or a local directory stand-in) and passed by reference
+
+    Stored messages are not deleted by consumers (topics may have several subscribers), the bucket expires them.
+
+"""
+
+from aws_lambda_powertools.logging import Logger
+
+import base64
+import json
+import os
+import uuid
+import zlib
+from lambdas import clients, metrics, profiling
+from typing import Dict
+from urllib.parse import urlparse
+
+#: S3 bucket oversized messages are stored in
+CLAIM_CHECK_BUCKET = os.environ.get('CLAIM_CHECK_BUCKET')
+#: Directory oversized messages are stored in when no bucket is set, i.e. - local runs
+CLAIM_CHECK_DIR = os.environ.get('CLAIM_CHECK_DIR')
+#: Serialized message bytes above which a message is compressed, and stored when still above it once compressed
+CLAIM_CHECK_THRESHOLD = int(os.environ.get('CLAIM_CHECK_THRESHOLD', str(64 * 1024)))
+#: Key of the claim check replacing the contents of an offloaded message
+CLAIM_KEY = 'claim_check'
+
+logger = Logger()
+
+
+def project(payload: Dict, fields: Dict) -> Dict:
+    """
+    Project `payload` to `fields`, fields missing from payload are left out.
+
+    :param payload: JSON object, i.e. - GitHub webhook event payload
+    :param fields: fields to keep, `True` to keep a value as is or a nested mapping of the fields of an object to keep
+    :returns: projected payload
+    """
+    projected = {}
+    for key, nested in fields.items():
+        if key not in payload:
+            continue
+        value = payload[key]
+        if isinstance(nested, dict) and isinstance(value, dict):
+            value = project(payload=value, fields=nested)
+        projected[key] = value
+    return projected
+
+
+def _store(body: bytes) -> str:
+    """
+    Store compressed message `body` in the claim check bucket or directory.
+
+    :param body: compressed message
+    :returns: URI of stored message - `s3://bucket/key` or `file:///path`
+    """
+    name = f'{uuid.uuid4()}.json.zz'
+    if CLAIM_CHECK_BUCKET:
+        with profiling.span('claim_check_put'):
+            clients.client('s3').put_object(Bucket=CLAIM_CHECK_BUCKET, Key=f'claim-check/{name}', Body=body)
+        return f's3://{CLAIM_CHECK_BUCKET}/claim-check/{name}'
+
+    os.makedirs(CLAIM_CHECK_DIR, exist_ok=True)
+    path = os.path.abspath(os.path.join(CLAIM_CHECK_DIR, name))
+    with open(path, 'wb') as f:
+        f.write(body)
+    return f'file://{path}'
+
+
+def _fetch(uri: str) -> bytes:
+    """
+    Fetch compressed message stored at `uri`.
+        Note: messages are only fetched from the claim check bucket or directory, a crafted message cannot make the
+        handler read anything else
+
+    :param uri: URI of stored message - `s3://bucket/key` or `file:///path`
+    :returns: compressed message
+    """
+    location = urlparse(uri)
+    if location.scheme == 's3' and CLAIM_CHECK_BUCKET and location.netloc == CLAIM_CHECK_BUCKET:
+        with profiling.span('claim_check_get'):
+            response = clients.client('s3').get_object(Bucket=location.netloc, Key=location.path.lstrip('/'))
+        return response['Body'].read()
+    if location.scheme == 'file' and CLAIM_CHECK_DIR:
+        root = os.path.realpath(CLAIM_CHECK_DIR)
+        path = os.path.realpath(location.path)
+        if os.path.commonpath([root, path]) == root:
+            with open(path, 'rb') as f:
+                return f.read()
+    raise ValueError(f'Unsupported claim check `{uri}`')
+
+
+def check(message: Dict) -> str:
+    """
+    Serialize `message` for publishing, offloading it when over `CLAIM_CHECK_THRESHOLD`.
+        Note: without a bucket or directory to store in, oversized messages are sent compressed regardless
+
+    :param message: JSON serializable message
+    :returns: serialized message, or claim check (inline compressed message or reference to stored message)
+    """
+    serialized = json.dumps(message, separators=(',', ':'))
+    if len(serialized.encode('utf-8')) <= CLAIM_CHECK_THRESHOLD:
+        return serialized
+
+    body = zlib.compress(serialized.encode('utf-8'))
+    claim = {'encoding': 'zlib', 'data': base64.b64encode(body).decode('ascii')}
+    if len(claim['data']) > CLAIM_CHECK_THRESHOLD:
+        if CLAIM_CHECK_BUCKET or CLAIM_CHECK_DIR:
+            claim = {'encoding': 'zlib', 'uri': _store(body=body)}
+            metrics.add(name='ClaimChecksStored')
+        else:
+            logger.warning({'operation': 'claim_check', 'bytes': len(body), 'message': 'No claim check store set'})
+    logger.info(
+        {'operation': 'claim_check', 'bytes': len(serialized), 'compressed': len(body), 'uri': claim.get('uri')}
+    )
+    return json.dumps({CLAIM_KEY: claim})
+
+
+def resolve(message: Dict) -> Dict:
+    """
+    Resolve message received, returned as is unless it is a claim check.
+
+    :param message: deserialized message
+    :returns: original message
+    """
+    claim = message.get(CLAIM_KEY) if isinstance(message, dict) else None
+    if not claim:
+        return message
+    body = base64.b64decode(claim['data']) if 'data' in claim else _fetch(uri=claim['uri'])
+    return json.loads(zlib.decompress(body))
@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+"""
+    Clients
+    -------
+
+    Module contains lazily created AWS clients shared across modules (created on first use, once per container)
+
+"""
+
+import functools
+import os
+import threading
+from lambdas import metrics
+
+REGION = os.environ.get('REGION', 'us-east-1')
+
+#: Client creation on the default boto3 session is not thread safe
+_LOCK = threading.Lock()
+
+
+@functools.lru_cache()
+def client(service: str):
+    """
+    Get shared low-level client for AWS `service`.
+
+    :param service: AWS service name, i.e. - `dynamodb`, `sns`, `ssm`
+    :returns: boto3 client
+    """
+    import boto3
+
+    with _LOCK:
+        _client = boto3.client(service, region_name=REGION)
+    if service == 'dynamodb':
+        metrics.instrument_dynamodb(client=_client)
+    return _client
+
+
+@functools.lru_cache()
+def resource(service: str):
+    """
+    Get shared resource for AWS `service`.
+
+    :param service: AWS service name, i.e. - `dynamodb`
+    :returns: boto3 service resource
+    """
+    import boto3
+
+    with _LOCK:
+        _resource = boto3.resource(service, region_name=REGION)
+    if service == 'dynamodb':
+        metrics.instrument_dynamodb(client=_resource.meta.client)
+    return _resource
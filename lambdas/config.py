@@ -0,0 +1,260 @@
+# -*- coding: utf-8 -*-
+"""
+    Config
+    ------
+
+    Module contains the index of repository configuration loaded from `config.yml`; parsed and validated once per
+    container into immutable, precomputed views merged per repository
+
+    Override sections are keyed by exact repository name, glob (`terraform-aws-*`) or regex (`re:^infra-.+$`).
+    A repository's view is the `default` section, updated by the first matching pattern (in file order) and then
+    by its exact name section. Updates are shallow, a nested section such as `default_branch` is replaced whole.
+
+    Usage: python -m lambdas.config [path]  - validates the config file
+
+"""
+
+import fnmatch
+import functools
+import hashlib
+import json
+import os
+import re
+import sys
+import threading
+from types import MappingProxyType
+from typing import Any, Dict, List, Mapping, Optional, Pattern, Tuple
+
+CONFIG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'config.yml')
+#: Prefix of override keys that are regular expressions
+REGEX_PREFIX = 're:'
+#: Characters that make an override key a glob pattern
+GLOB_CHARS = frozenset('*?[')
+
+#: Supported settings and their types
+SETTINGS = {
+    'private': bool,
+    'has_issues': bool,
+    'has_projects': bool,
+    'has_wiki': bool,
+    'default_branch': dict,
+    'allow_squash_merge': bool,
+    'allow_merge_commit': bool,
+    'allow_rebase_merge': bool,
+    'delete_branch_on_merge': bool,
+    'enable_vulnerability_alert': bool,
+    'enable_automated_security_fixes': bool,
+    'labels': list,
+}
+#: Supported default branch settings and their types
+BRANCH_SETTINGS = {'name': str, 'require_code_owner_reviews': bool, 'required_approving_review_count': int}
+LABEL_COLOR = re.compile(r'^[0-9a-fA-F]{6}$')
+
+
+class ConfigError(ValueError):
+    """Invalid repository configuration"""
+
+
+def _freeze(value: Any) -> Any:
+    """Immutable copy of parsed YAML `value`"""
+    if isinstance(value, dict):
+        return MappingProxyType({key: _freeze(val) for key, val in value.items()})
+    if isinstance(value, list):
+        return tuple(_freeze(val) for val in value)
+    return value
+
+
+def _pattern(key: str) -> Optional[str]:
+    """Regular expression of override `key`, `None` for exact repository names"""
+    if key.startswith(REGEX_PREFIX):
+        return key[len(REGEX_PREFIX) :]
+    if GLOB_CHARS.intersection(key):
+        return fnmatch.translate(key)
+    return None
+
+
+def _validate_settings(name: str, settings: Dict, schema: Dict[str, type]) -> List[str]:
+    """Validation errors of `settings` against `schema` of setting names and types"""
+    errors = []
+    for key, value in settings.items():
+        expected = schema.get(key)
+        if expected is None:
+            errors.append(f'{name}.{key}: unknown setting')
+        elif not isinstance(value, expected) or (expected is int and isinstance(value, bool)):
+            errors.append(f'{name}.{key}: expected {expected.__name__}, got {type(value).__name__}')
+    return errors
+
+
+def _validate_labels(name: str, labels: List) -> List[str]:
+    """Validation errors of the `labels` of a config section"""
+    errors = []
+    names = set()
+    for i, label in enumerate(labels):
+        if not isinstance(label, dict) or not isinstance(label.get('name'), str):
+            errors.append(f'{name}.labels[{i}]: label must be a mapping with a `name`')
+            continue
+        if not LABEL_COLOR.match(str(label.get('color'))):
+            errors.append(f'{name}.labels[{i}]: color `{label.get("color")}` is not a 6 digit hex value')
+        if label['name'].casefold() in names:
+            errors.append(f'{name}.labels[{i}]: duplicate label `{label["name"]}`')
+        names.add(label['name'].casefold())
+    return errors
+
+
+def _validate_pattern(name: str) -> List[str]:
+    """Validation errors of the glob or regex of override `name`, none for exact repository names"""
+    pattern = _pattern(name)
+    if pattern is None:
+        return []
+    try:
+        re.compile(pattern)
+    except re.error as err:
+        return [f'{name}: invalid pattern - {err}']
+    return []
+
+
+def _validate_section(name: str, section: Any) -> List[str]:
+    """Validation errors of a single config section"""
+    if not isinstance(section, dict):
+        return [f'{name}: section must be a mapping']
+
+    errors = _validate_settings(name=name, settings=section, schema=SETTINGS)
+    #: Mistyped nested sections are reported above, their contents are not validated
+    branch = section.get('default_branch')
+    if isinstance(branch, dict):
+        errors.extend(_validate_settings(name=f'{name}.default_branch', settings=branch, schema=BRANCH_SETTINGS))
+    if isinstance(section.get('labels'), list):
+        errors.extend(_validate_labels(name=name, labels=section['labels']))
+    return errors
+
+
+def validate(config: Any) -> List[str]:
+    """
+    Validate parsed configuration.
+
+    :param config: parsed `config.yml` content
+    :returns: list of validation errors, empty when valid
+    """
+    if not isinstance(config, dict) or not isinstance(config.get('default'), dict):
+        return ['config must be a mapping with a `default` section']
+
+    errors = []
+    for name, section in config.items():
+        errors.extend(_validate_section(name=name, section=section))
+        errors.extend(_validate_pattern(name=name))
+    return errors
+
+
+class ConfigIndex:
+    """Immutable, precomputed views of repository configuration"""
+
+    def __init__(self, config: Dict):
+        errors = validate(config)
+        if errors:
+            raise ConfigError('Invalid config:\n  ' + '\n  '.join(errors))
+
+        self._default = config['default']
+        self._exact: Dict[str, Dict] = {}
+        #: Patterns are compiled on their own (not joined) so inline flags and backreferences keep their meaning
+        self._overrides: List[Tuple[Pattern, Dict]] = []
+        for key, section in config.items():
+            if key == 'default':
+                continue
+            pattern = _pattern(key)
+            if pattern is None:
+                self._exact[key] = section
+            else:
+                self._overrides.append((re.compile(pattern), section))
+
+        self._lock = threading.Lock()
+        self._views: Dict[str, Tuple[Mapping, str]] = {}
+        for repo in self._exact:
+            self._views[repo] = self._build(repo=repo)
+
+    def _build(self, repo: str) -> Tuple[Mapping, str]:
+        """Merged view of `repo` and the fingerprint of its settings"""
+        merged = dict(self._default)
+        override = next((section for pattern, section in self._overrides if pattern.fullmatch(repo)), {})
+        merged.update(override)
+        merged.update(self._exact.get(repo, {}))
+
+        settings = {key: value for key, value in merged.items() if key != 'labels'}
+        fingerprint = hashlib.sha1(json.dumps(settings, sort_keys=True).encode('utf-8')).hexdigest()
+        return _freeze(merged), fingerprint
+
+    def _view(self, repo: str) -> Tuple[Mapping, str]:
+        view = self._views.get(repo)
+        if view is None:
+            view = self._build(repo=repo)
+            with self._lock:
+                self._views[repo] = view
+        return view
+
+    def get(self, repo: str) -> Mapping:
+        """
+        Get configuration of `repo`.
+
+        :param repo: repository name (without owner)
+        :returns: immutable merged configuration
+        """
+        return self._view(repo=repo)[0]
+
+    def fingerprint(self, repo: str) -> str:
+        """
+        Get hash of the repository settings of `repo`, labels excluded as they are synced separately.
+
+        :param repo: repository name (without owner)
+        :returns: hex digest
+        """
+        return self._view(repo=repo)[1]
+
+
+def load(path: str = CONFIG_PATH) -> ConfigIndex:
+    """
+    Parse and validate configuration file, using the C YAML loader when available.
+
+    :param path: path of config file
+    :returns: configuration index
+    """
+    import yaml
+
+    with open(path, 'r') as f:
+        return ConfigIndex(config=yaml.load(f, Loader=getattr(yaml, 'CSafeLoader', yaml.SafeLoader)))
+
+
+@functools.lru_cache()
+def get_index() -> ConfigIndex:
+    """
+    Get configuration index of `config.yml`, loaded once per container.
+
+    :returns: configuration index
+    """
+    return load()
+
+
+def get_config(repo: str) -> Mapping:
+    """
+    Get configuration of `repo` from `config.yml`.
+
+    :param repo: repository name (without owner)
+    :returns: immutable merged configuration
+    """
+    return get_index().get(repo=repo)
+
+
+def get_fingerprint(repo: str) -> str:
+    """
+    Get hash of the repository settings of `repo` from `config.yml`.
+
+    :param repo: repository name (without owner)
+    :returns: hex digest
+    """
+    return get_index().fingerprint(repo=repo)
+
+
+if __name__ == '__main__':
+    try:
+        load(*sys.argv[1:2])
+    except ConfigError as err:
+        sys.exit(str(err))
+    print('Config is valid')
@@ -7,17 +7,20 @@
 
 """
 
-import boto3
-from boto3.dynamodb.types import TypeDeserializer
 from botocore.exceptions import ClientError
 
 import decimal
+import hashlib
+import json
 import os
-from typing import Any, Dict, List
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from lambdas import clients, profiling
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple, Union
 
-REGION = os.environ.get('REGION', 'us-east-1')
-RESOURCE = boto3.resource('dynamodb', region_name=REGION)
-CLIENT = boto3.client('dynamodb', region_name=REGION)
+#: Default number of parallel scan segments (`TotalSegments`)
+SCAN_SEGMENTS = int(os.environ.get('SCAN_SEGMENTS', '1'))
 
 
 def replace_decimals(obj: Any) -> Any:
@@ -46,6 +49,43 @@ def replace_decimals(obj: Any) -> Any:
         return obj
 
 
+def _number(value: str) -> Union[int, float]:
+    """
+    Convert DynamoDB number string to native numeric type.
+
+    :param value: DynamoDB number string
+    :returns: int when value is integral, otherwise float (same as `replace_decimals`)
+    """
+    #: Parsed exactly, so large or exponent form (`1E+2`) integers are not rounded through float
+    number = decimal.Decimal(value)
+    return int(number) if number == number.to_integral_value() else float(number)
+
+
+def _native(value: Dict) -> Any:
+    """
+    Convert DynamoDB typed attribute value to native python type in a single pass.
+
+    :param value: DynamoDB attribute value, i.e. - `{'S': 'foo'}`
+    :returns: native python object
+    """
+    for tag, val in value.items():
+        if tag == 'S' or tag == 'BOOL' or tag == 'B':
+            return val
+        if tag == 'N':
+            return _number(val)
+        if tag == 'M':
+            return {k: _native(v) for k, v in val.items()}
+        if tag == 'L':
+            return [_native(v) for v in val]
+        if tag == 'NULL':
+            return None
+        if tag == 'SS' or tag == 'BS':
+            return set(val)
+        if tag == 'NS':
+            return {_number(v) for v in val}
+        raise TypeError(f'Unsupported DynamoDB type: {tag}')
+
+
 def deserialize(serialized: Dict) -> Dict:
     """
     Deserialize DynamoDB object into standard python dictionary.
@@ -53,8 +93,139 @@ def deserialize(serialized: Dict) -> Dict:
     :param serialized: dicitonary object containing DynamoDB type markup
     :returns: standard python object sans DynamoDB type markup
     """
-    deserializer = TypeDeserializer()
-    return replace_decimals({key: deserializer.deserialize(val) for key, val in serialized.items()})
+    return {key: _native(val) for key, val in serialized.items()}
+
+
+def deserialize_items(items: List[Dict], attributes: Optional[Iterable[str]] = None) -> List[Dict]:
+    """
+    Deserialize a page of DynamoDB objects (i.e. - scan `Items`) into standard python dictionaries.
+
+    :param items: array of dictionary objects containing DynamoDB type markup
+    :param attributes: optional allow-list of attributes to materialize, all attributes when not provided
+    :returns: array of standard python objects sans DynamoDB type markup
+    """
+    if attributes is None:
+        return [{key: _native(val) for key, val in item.items()} for item in items]
+    wanted = frozenset(attributes)
+    return [{key: _native(val) for key, val in item.items() if key in wanted} for item in items]
+
+
+def _scan_segment(table: str, kwargs: Dict) -> Iterator[List[Dict]]:
+    """
+    Scan a single segment of `table`, following `LastEvaluatedKey` until exhausted.
+
+    :param table: table name
+    :param kwargs: additional low-level scan arguments
+    :returns: iterator of pages of low-level (DynamoDB JSON) items
+    """
+    while True:
+        with profiling.span('scan_page'):
+            response = clients.client('dynamodb').scan(TableName=table, **kwargs)
+        yield response.get('Items', [])
+        if 'LastEvaluatedKey' not in response:
+            return
+        kwargs = {**kwargs, 'ExclusiveStartKey': response['LastEvaluatedKey']}
+
+
+#: Sentinel put on the page queue by a parallel scan worker once its segment is exhausted
+_SEGMENT_DONE = object()
+
+
+def _put_page(pages: queue.Queue, stop: threading.Event, obj: Any):
+    """Put `obj` on `pages`, giving up once the consumer has stopped"""
+    while not stop.is_set():
+        try:
+            return pages.put(obj, timeout=0.1)
+        except queue.Full:
+            continue
+
+
+def _scan_worker(table: str, kwargs: Dict, pages: queue.Queue, stop: threading.Event):
+    """
+    Scan a single segment of a parallel scan onto the page queue.
+        Note: an error is put on the queue for the consumer to raise, `_SEGMENT_DONE` is always put last
+
+    :param table: table name
+    :param kwargs: low-level scan arguments, including `Segment` and `TotalSegments`
+    :param pages: bounded queue pages are handed over through
+    :param stop: event set by the consumer once it stops reading pages
+    :returns: None
+    """
+    try:
+        for page in _scan_segment(table=table, kwargs=kwargs):
+            if stop.is_set():
+                return
+            _put_page(pages=pages, stop=stop, obj=page)
+    except Exception as err:
+        _put_page(pages=pages, stop=stop, obj=err)
+    finally:
+        _put_page(pages=pages, stop=stop, obj=_SEGMENT_DONE)
+
+
+def _drain_pages(pages: queue.Queue, segments: int) -> Iterator[List[Dict]]:
+    """
+    Yield pages from the page queue until all `segments` workers are done, raising the first worker error.
+
+    :param pages: bounded queue pages are handed over through
+    :param segments: number of parallel scan segments
+    :returns: iterator of pages of low-level (DynamoDB JSON) items
+    """
+    remaining = segments
+    while remaining:
+        page = pages.get()
+        if page is _SEGMENT_DONE:
+            remaining -= 1
+        elif isinstance(page, Exception):
+            raise page
+        else:
+            yield page
+
+
+def scan_pages(
+    table: str, attributes: Optional[List[str]] = None, segments: int = SCAN_SEGMENTS, **kwargs
+) -> Iterator[List[Dict]]:
+    """
+    Scan all pages of `table`, optionally as a parallel scan across `segments` workers.
+        Note: pages are handed over through a bounded queue so memory stays flat regardless of table size
+
+    :param table: table name
+    :param attributes: attribute names to project, all attributes when not provided
+    :param segments: number of parallel scan segments
+    :returns: iterator of pages of low-level (DynamoDB JSON) items
+    """
+    if attributes:
+        names = {f'#p{i}': attribute for i, attribute in enumerate(attributes)}
+        kwargs['ProjectionExpression'] = ', '.join(names)
+        kwargs['ExpressionAttributeNames'] = {**kwargs.get('ExpressionAttributeNames', {}), **names}
+
+    if segments <= 1:
+        yield from _scan_segment(table=table, kwargs=kwargs)
+        return
+
+    pages: queue.Queue = queue.Queue(maxsize=segments * 2)
+    stop = threading.Event()
+    with ThreadPoolExecutor(max_workers=segments) as executor:
+        for segment in range(segments):
+            segment_kwargs = {**kwargs, 'Segment': segment, 'TotalSegments': segments}
+            executor.submit(_scan_worker, table=table, kwargs=segment_kwargs, pages=pages, stop=stop)
+        try:
+            yield from _drain_pages(pages=pages, segments=segments)
+        finally:
+            #: Unblock workers when consumer stops early or a segment failed
+            stop.set()
+
+
+def scan(table: str, attributes: Optional[List[str]] = None, segments: int = SCAN_SEGMENTS, **kwargs) -> Iterator[Dict]:
+    """
+    Scan all items of `table` as standard python dictionaries.
+
+    :param table: table name
+    :param attributes: attribute names to project, all attributes when not provided
+    :param segments: number of parallel scan segments
+    :returns: iterator of deserialized items
+    """
+    for page in scan_pages(table=table, attributes=attributes, segments=segments, **kwargs):
+        yield from deserialize_items(page)
 
 
 def get_item(key: Dict, table: str, **kwargs) -> Dict:
@@ -65,7 +236,7 @@ def get_item(key: Dict, table: str, **kwargs) -> Dict:
     :param table: table name
     :returns: object stored in `table` under `key`
     """
-    _table = RESOURCE.Table(table)
+    _table = clients.resource('dynamodb').Table(table)
     try:
         response = _table.get_item(Key=key, **kwargs)
         try:
@@ -84,7 +255,7 @@ def put_item(item: Dict, table: str, **kwargs) -> Dict:
     :param table: table name
     :returns: HTTPStatusCode of inserting `item`
     """
-    _table = RESOURCE.Table(table)
+    _table = clients.resource('dynamodb').Table(table)
     try:
         return _table.put_item(Item=item, **kwargs)
     except ClientError:
@@ -101,13 +272,13 @@ def update_item(key: Dict, expression: str, attr_values: Dict, table: str, **kwa
     :param table: table name
     :returns: HTTPStatusCode of inserting `item`
     """
-    _table = RESOURCE.Table(table)
+    _table = clients.resource('dynamodb').Table(table)
+    kwargs.setdefault('ReturnValues', 'ALL_NEW')
     try:
         return _table.update_item(
             Key=key,
             UpdateExpression=expression,
             ExpressionAttributeValues=attr_values,
-            ReturnValues='ALL_NEW',
             **kwargs,
         )
     except ClientError:
@@ -122,7 +293,7 @@ def delete_item(key: Dict, table: str, **kwargs) -> Dict:
     :param table: table name
     :returns: HTTPStatusCode response of deleting `key`
     """
-    _table = RESOURCE.Table(table)
+    _table = clients.resource('dynamodb').Table(table)
     try:
         return _table.delete_item(Key=key, **kwargs)
     except ClientError:
@@ -137,11 +308,68 @@ def delete_all_items(key_ids: List[str], table: str, **kwargs):
     :param table: table name
     :returns: none
     """
-    _table = RESOURCE.Table(table)
+    _table = clients.resource('dynamodb').Table(table)
     try:
-        scan = _table.scan()
         with _table.batch_writer() as batch:
-            for item in scan['Items']:
+            for item in scan(table=table, attributes=key_ids):
                 batch.delete_item(Key={k: item[k] for k in key_ids}, **kwargs)
     except ClientError:
         raise
+
+
+def _digest(item: Dict) -> str:
+    """
+    Compute a stable digest of `item` for change detection.
+
+    :param item: table item, with or without Decimals
+    :returns: hex digest of item content
+    """
+    content = json.dumps(replace_decimals(dict(item)), sort_keys=True, default=str)
+    return hashlib.sha1(content.encode('utf-8')).hexdigest()
+
+
+def digests(table: str, key_ids: List[str]) -> Dict[Tuple, str]:
+    """
+    Get key -> digest pairs of all items in `table`, used to detect changes without holding whole items.
+
+    :param table: table name
+    :param key_ids: list of composite key ids
+    :returns: digest of every item by key tuple (values ordered as `key_ids`)
+    """
+    return {tuple(item[k] for k in key_ids): _digest(item) for item in scan(table=table)}
+
+
+def reconcile(
+    items: Iterable[Dict], key_ids: List[str], table: str, existing: Optional[Dict[Tuple, str]] = None
+) -> Dict[str, int]:
+    """
+    Reconcile `table` with `items` - writing only new or changed items and deleting only vanished items.
+        Note: existing items are held as key -> digest pairs, not whole items
+
+    :param items: iterable of the complete, desired set of table items, consumed as a stream
+    :param key_ids: list of composite key ids
+    :param table: table name
+    :param existing: digests of the existing items `items` replace (see `digests`), whole table when not provided
+    :returns: counts of `inserted`, `updated`, `deleted` and `unchanged` items
+    """
+    _table = clients.resource('dynamodb').Table(table)
+    counts = {'inserted': 0, 'updated': 0, 'deleted': 0, 'unchanged': 0}
+    try:
+        existing = dict(digests(table=table, key_ids=key_ids) if existing is None else existing)
+
+        with _table.batch_writer(overwrite_by_pkeys=key_ids) as batch:
+            for item in items:
+                digest = existing.pop(tuple(item[k] for k in key_ids), None)
+                if digest == _digest(item):
+                    counts['unchanged'] += 1
+                    continue
+                batch.put_item(Item=item)
+                counts['inserted' if digest is None else 'updated'] += 1
+
+            #: Anything not seen in `items` no longer exists
+            for key in existing:
+                batch.delete_item(Key=dict(zip(key_ids, key)))
+                counts['deleted'] += 1
+        return counts
+    except ClientError:
+        raise
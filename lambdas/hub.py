@@ -7,28 +7,107 @@
 
 """
 
-import boto3
-import github
 from aws_lambda_powertools.logging import Logger
 from aws_lambda_powertools.tracing import Tracer
-from github import Github
-from github.Repository import Repository
 
+import base64
 import functools
 import hashlib
 import hmac
+import inspect
 import json
 import os
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from enum import Enum
-from lambdas import sns
-from typing import Dict, List
+from lambdas import claimcheck, clients, dynamodb, idempotency, metrics, profiling, ratelimit, sns
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Callable,
+    Dict,
+    Generic,
+    Hashable,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+    TypeVar,
+)
+
+if TYPE_CHECKING:
+    import requests
+    from github import Github
+    from github.Organization import Organization
+    from github.Repository import Repository
 
-REGION = os.environ.get('REGION', 'us-east-1')
-SSM_CLIENT = boto3.client('ssm', region_name=REGION)
 JSON_CONTENT = {'Content-Type': 'application/json; charset=utf-8'}
 
 #: Common SNS topic base (prefix)
 SNS_TOPIC_BASE = f'{os.environ.get("SNS_ARN_PREFIX")}:Watcher'
+#: GitHub webhook events watcher responds to, all others are rejected by `X-GitHub-Event` header alone
+HANDLED_EVENTS = frozenset({'create', 'delete', 'pull_request', 'repository'})
+#: Supported webhook signature headers, in order of preference, and their digest algorithm
+SIGNATURE_HEADERS = (('x-hub-signature-256', 'sha256'), ('x-hub-signature', 'sha1'))
+#: Maximum number of repositories fetched concurrently by org-wide sync jobs
+SYNC_CONCURRENCY = int(os.environ.get('SYNC_CONCURRENCY', '16'))
+#: GitHub REST API base url
+GITHUB_API_URL = os.environ.get('GITHUB_API_URL', 'https://api.github.com')
+#: DynamoDB table for watcher state, backs the conditional request cache when set
+STATE_TABLE = os.environ.get('STATE_TABLE')
+#: Seconds a cached GitHub response is retained without being revalidated
+RESPONSE_CACHE_TTL = int(os.environ.get('RESPONSE_CACHE_TTL', str(7 * 24 * 60 * 60)))
+#: Maximum number of GitHub responses held by the in memory conditional request cache, least recently used evicted
+RESPONSE_CACHE_SIZE = int(os.environ.get('RESPONSE_CACHE_SIZE', '4096'))
+#: Engine used by org-wide syncs to fetch data - `rest` (listings per repository) or `graphql` (bulk queries)
+SYNC_ENGINE = os.environ.get('SYNC_ENGINE', 'rest')
+#: Target rate limit cost (points) of a single bulk GraphQL query, used to size repository pages
+GRAPHQL_COST_TARGET = int(os.environ.get('GRAPHQL_COST_TARGET', '25'))
+#: Page size of pull request, tag and label connections nested under each repository
+GRAPHQL_INNER_PAGE = 50
+#: Maximum number of GitHub repository/organization objects cached per container
+GITHUB_CACHE_SIZE = int(os.environ.get('GITHUB_CACHE_SIZE', '256'))
+#: Seconds GitHub repository/organization objects are cached before being fetched again, which also bounds how long
+#: other containers serve objects made stale by a repository change (`invalidate_repo` only evicts its own)
+GITHUB_CACHE_TTL = int(os.environ.get('GITHUB_CACHE_TTL', '300'))
+
+#: Fields of each webhook event read by its consumers, nothing else of the payload is forwarded
+_DELIVERY_FIELDS = {'X-GitHub-Event': True, 'X-GitHub-Delivery': True}
+EVENT_FIELDS = {
+    'tag': {**_DELIVERY_FIELDS, 'ref': True, 'ref_type': True, 'repository': {'full_name': True, 'updated_at': True}},
+    'pull_request': {
+        **_DELIVERY_FIELDS,
+        'action': True,
+        'number': True,
+        'repository': {'full_name': True, 'updated_at': True},
+        'pull_request': {
+            'number': True,
+            'html_url': True,
+            'user': {'login': True},
+            'created_at': True,
+            'updated_at': True,
+            'head': {'ref': True},
+            'mergeable': True,
+            'mergeable_state': True,
+        },
+    },
+    'repository': {
+        **_DELIVERY_FIELDS,
+        'action': True,
+        'repository': {'full_name': True, 'updated_at': True},
+        'changes': {'repository': {'name': {'from': True}}},
+    },
+}
+
+T = TypeVar('T')
+_MISSING = object()
+
+#: Shared rate limit governor for GitHub API requests
+GOVERNOR = ratelimit.Governor(max_concurrency=SYNC_CONCURRENCY)
 
 #: Tracing via X-Ray
 tracer = Tracer()
@@ -48,6 +127,11 @@ class GithubEvent(Enum):
         topic = ''.join([x.title() for x in self.value.split('_')])
         return f'{SNS_TOPIC_BASE}-{topic}'
 
+    @property
+    def fields(self) -> Dict:
+        """Returns fields of event payload forwarded to consumers"""
+        return EVENT_FIELDS[self.value]
+
 
 @functools.lru_cache()
 def _get_github_secret() -> str:
@@ -56,7 +140,7 @@ def _get_github_secret() -> str:
 
     :returns: GitHub webhook secret value
     """
-    response = SSM_CLIENT.get_parameter(Name='/watcher/github_webhook_secret', WithDecryption=True)
+    response = clients.client('ssm').get_parameter(Name='/watcher/github_webhook_secret', WithDecryption=True)
     return response.get('Parameter', {}).get('Value', '')
 
 
@@ -67,25 +151,126 @@ def get_github_user_token() -> str:
 
     :returns: GitHub user access token value
     """
-    response = SSM_CLIENT.get_parameter(Name='/watcher/github_user_token', WithDecryption=True)
+    response = clients.client('ssm').get_parameter(Name='/watcher/github_user_token', WithDecryption=True)
     return response.get('Parameter', {}).get('Value', '')
 
 
+class TTLCache:
+    """Thread safe, size bounded (least recently used) mapping whose entries expire `ttl` seconds after being stored"""
+
+    def __init__(self, maxsize: int = GITHUB_CACHE_SIZE, ttl: int = GITHUB_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries: 'OrderedDict[Hashable, Tuple[float, Any]]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return default
+            if entry[0] <= time.monotonic():
+                del self._entries[key]
+                return default
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def put(self, key: Hashable, value: Any):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def pop(self, key: Hashable):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class TTLCached(Generic[T]):
+    """Function whose results are memoized in a `TTLCache`, see `ttl_cache`"""
+
+    def __init__(self, func: Callable[..., T], cache: TTLCache):
+        functools.update_wrapper(self, func)
+        self._func = func
+        self._cache = cache
+        self._signature = inspect.signature(func)
+
+    def _key(self, args: Tuple, kwargs: Dict) -> Hashable:
+        #: Positional and keyword calls share the same entry
+        bound = self._signature.bind(*args, **kwargs)
+        bound.apply_defaults()
+        return tuple(bound.arguments.items())
+
+    def __call__(self, *args: Any, **kwargs: Any) -> T:
+        key = self._key(args, kwargs)
+        value = self._cache.get(key, _MISSING)
+        if value is _MISSING:
+            value = self._func(*args, **kwargs)
+            self._cache.put(key, value)
+        return value
+
+    def invalidate(self, *args: Any, **kwargs: Any):
+        """Evict the result of calling with `args` and `kwargs`"""
+        self._cache.pop(self._key(args, kwargs))
+
+    def cache_clear(self):
+        """Evict all results"""
+        self._cache.clear()
+
+
+def ttl_cache(
+    maxsize: int = GITHUB_CACHE_SIZE, ttl: int = GITHUB_CACHE_TTL
+) -> Callable[[Callable[..., T]], TTLCached[T]]:
+    """
+    Memoize function results in a `TTLCache`.
+        Note: decorated function gains `invalidate(*args, **kwargs)` to evict a single result and `cache_clear()`
+
+    :param maxsize: maximum number of cached results
+    :param ttl: seconds a result is cached for
+    :returns: decorator
+    """
+
+    def decorator(func: Callable[..., T]) -> TTLCached[T]:
+        return TTLCached(func=func, cache=TTLCache(maxsize=maxsize, ttl=ttl))
+
+    return decorator
+
+
 @functools.lru_cache()
-def get_github_repo(repo: str) -> Repository:
+def _github() -> 'Github':
+    """
+    Get GitHub client shared by the container, its keep-alive connection pool is sized for concurrent syncs.
+
+    :returns: GitHub client
+    """
+    from github import Github
+
+    return Github(
+        get_github_user_token(), base_url=GITHUB_API_URL, retry=ratelimit.github_retry(), pool_size=SYNC_CONCURRENCY
+    )
+
+
+@ttl_cache()
+def get_github_repo(repo: str) -> 'Repository':
     """
     Get GitHub repository object.
 
     :param repo: full name of GitHub repository to retrieve
     :returns: GitHub repository object
     """
-    token = get_github_user_token()
-    git = Github(token)
-    return git.get_repo(repo)
+    return _github().get_repo(repo)
 
 
-@functools.lru_cache()
-def get_github_repos(org: str) -> List[Repository]:
+@ttl_cache()
+def get_github_repos(org: str) -> List['Repository']:
     """
     Get GitHub organization's repository objects.
         Note: we are only getting sources as these are the ones we can control
@@ -93,39 +278,493 @@ def get_github_repos(org: str) -> List[Repository]:
     :param repo: name of GitHub organization to retrieve repositories from
     :returns: array of GitHub repository objects
     """
-    org = get_github_org(org)
-    return org.get_repos(type='sources', sort='updated', direction='desc')
+    organization = get_github_org(org)
+    return list(organization.get_repos(type='sources', sort='updated', direction='desc'))
 
 
-@functools.lru_cache()
-def get_github_org(org: str) -> github.Organization:
+@ttl_cache()
+def get_github_org(org: str) -> 'Organization':
     """
     Get GitHub organization object.
 
     :param repo: name of GitHub organization to retrieve
     :returns: GitHub organization object
     """
-    token = get_github_user_token()
-    git = Github(token)
-    return git.get_organization(org)
+    return _github().get_organization(org)
 
 
-def _valid_signature(headers: Dict, body: str) -> bool:
+def invalidate_repo(full_name: str):
+    """
+    Evict cached GitHub objects made stale by a change to repository `full_name` (created, renamed, deleted, etc.).
+        Note: only this container's cache is evicted, other warm containers serve their cached objects for up to
+        `GITHUB_CACHE_TTL` seconds - handlers must treat cached objects as possibly stale for that long
+
+    :param full_name: full name of GitHub repository, i.e. - `owner/repo`
+    :returns: None
+    """
+    get_github_repo.invalidate(repo=full_name)
+    get_github_repos.invalidate(org=full_name.split('/')[0])
+
+
+class MemoryCache:
+    """Conditional request cache held in memory, scoped to the lambda container and bounded in size"""
+
+    def __init__(self, maxsize: int = RESPONSE_CACHE_SIZE, ttl: int = RESPONSE_CACHE_TTL):
+        self._entries = TTLCache(maxsize=maxsize, ttl=ttl)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, url: str) -> Optional[Dict]:
+        return self._entries.get(url)
+
+    def put(self, url: str, entry: Dict):
+        self._entries.put(url, entry)
+
+
+class DynamoDBCache:
+    """Conditional request cache persisted to the watcher state table, shared across containers"""
+
+    def __init__(self, table: str, ttl: int = RESPONSE_CACHE_TTL):
+        self.table = table
+        self.ttl = ttl
+
+    def get(self, url: str) -> Optional[Dict]:
+        try:
+            item = dynamodb.get_item(key={'id': f'etag#{url}'}, table=self.table)
+        except KeyError:
+            return None
+        body = item.get('body')
+        return {**item, 'data': json.loads(zlib.decompress(getattr(body, 'value', body)))}
+
+    def put(self, url: str, entry: Dict):
+        data = entry.get('data')
+        item = {k: v for k, v in entry.items() if k != 'data' and v is not None}
+        body = zlib.compress(json.dumps(data, separators=(',', ':')).encode('utf-8'))
+        dynamodb.put_item(
+            item={**item, 'id': f'etag#{url}', 'body': body, 'expires': int(time.time()) + self.ttl},
+            table=self.table,
+        )
+
+
+#: Pluggable conditional request cache, any object providing `get(url)` and `put(url, entry)`
+RESPONSE_CACHE: Any = DynamoDBCache(table=STATE_TABLE) if STATE_TABLE else MemoryCache()
+#: Conditional request cache hit/miss counts for the life of the container
+CACHE_STATS = {'hits': 0, 'misses': 0}
+_CACHE_STATS_LOCK = threading.Lock()
+
+
+def cache_stats() -> Dict[str, int]:
+    """
+    Get conditional request cache statistics.
+
+    :returns: number of cache `hits` (304 Not Modified) and `misses`
+    """
+    return dict(CACHE_STATS)
+
+
+@functools.lru_cache()
+def _get_session() -> 'requests.Session':
+    """
+    Get HTTP session authenticated to the GitHub API.
+
+    :returns: requests session
+    """
+    import requests
+
+    session = requests.Session()
+    #: Keep-alive connections for every concurrent sync worker
+    session.mount('https://', requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=SYNC_CONCURRENCY))
+    session.headers.update(
+        {'Authorization': f'token {get_github_user_token()}', 'Accept': 'application/vnd.github.v3+json'}
+    )
+    return session
+
+
+def _request(method: str, url: str, **kwargs) -> 'requests.Response':
+    """
+    Send GitHub API request through the shared rate limit governor.
+
+    :param method: HTTP method
+    :param url: full GitHub API url
+    :param kwargs: keyword arguments passed to `requests.Session.request`
+    :returns: response
+    """
+    resource = 'graphql' if url.endswith('/graphql') else 'core'
+
+    def send() -> 'requests.Response':
+        metrics.add(name='GitHubRequests')
+        with metrics.timed(name='GitHubLatency'):
+            return _get_session().request(method, url, **kwargs)
+
+    return GOVERNOR.request(send=send, resource=resource)
+
+
+def _conditional_get(url: str, transform: Callable[[Any], Any]) -> Tuple[Any, Optional[str]]:
+    """
+    Get GitHub API `url`, revalidating any cached response with `If-None-Match`/`If-Modified-Since`.
+        Note: GitHub does not count 304 Not Modified responses against the rate limit
+
+    :param url: full GitHub API url, including query string
+    :param transform: function applied to the response JSON before it is returned and cached
+    :returns: transformed response data and url of the next page, if any
+    """
+    entry = RESPONSE_CACHE.get(url)
+    headers = {}
+    if entry and entry.get('etag'):
+        headers['If-None-Match'] = entry['etag']
+    if entry and entry.get('last_modified'):
+        headers['If-Modified-Since'] = entry['last_modified']
+
+    response = _request('GET', url, headers=headers, timeout=30)
+    if response.status_code == 304 and entry:
+        with _CACHE_STATS_LOCK:
+            CACHE_STATS['hits'] += 1
+        return entry.get('data'), entry.get('next')
+
+    response.raise_for_status()
+    with _CACHE_STATS_LOCK:
+        CACHE_STATS['misses'] += 1
+    data = transform(response.json())
+    next_url = response.links.get('next', {}).get('url')
+    RESPONSE_CACHE.put(
+        url,
+        {
+            'etag': response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified'),
+            'next': next_url,
+            'data': data,
+        },
+    )
+    return data, next_url
+
+
+def _api_url(path: str, params: Optional[Dict] = None) -> str:
+    """Full GitHub API url for `path` with `params` encoded as a stable query string"""
+    from urllib.parse import urlencode
+
+    query = f'?{urlencode(sorted(params.items()))}' if params else ''
+    return f'{GITHUB_API_URL}/{path.lstrip("/")}{query}'
+
+
+def get_json(path: str, params: Optional[Dict] = None, transform: Callable[[Any], Any] = lambda x: x) -> Any:
+    """
+    Get a single GitHub API resource through the conditional request cache.
+
+    :param path: GitHub API path or full url, i.e. - `repos/{owner}/{repo}/pulls/1`
+    :param params: query string parameters
+    :param transform: function applied to the response JSON before it is returned and cached
+    :returns: transformed response data
+    """
+    url = path if path.startswith(GITHUB_API_URL) else _api_url(path=path, params=params)
+    data, _ = _conditional_get(url=url, transform=transform)
+    return data
+
+
+def get_all_json(path: str, params: Optional[Dict] = None, transform: Callable[[Any], Any] = lambda x: x) -> List:
+    """
+    Get every page of a GitHub API listing through the conditional request cache.
+        Note: pages are cached individually so an unchanged page costs a single 304 request
+
+    :param path: GitHub API path, i.e. - `repos/{owner}/{repo}/tags`
+    :param params: query string parameters
+    :param transform: function applied to each page of response JSON before it is returned and cached
+    :returns: concatenation of all transformed pages
+    """
+    results: List = []
+    url: Optional[str] = _api_url(path=path, params={'per_page': 100, **(params or {})})
+    while url:
+        data, url = _conditional_get(url=url, transform=transform)
+        results.extend(data)
+    return results
+
+
+def get_json_if_exists(path: str) -> Optional[Any]:
+    """
+    Get a GitHub API resource whose absence is signalled by 404 Not Found (not cached).
+
+    :param path: GitHub API path, i.e. - `repos/{owner}/{repo}/vulnerability-alerts`
+    :returns: response JSON (empty when response has no content), `None` when not found
+    """
+    response = _request('GET', _api_url(path=path), timeout=30)
+    if response.status_code == 404:
+        return None
+    response.raise_for_status()
+    return response.json() if response.content else {}
+
+
+def send_json(method: str, path: str, payload: Optional[Dict] = None) -> Any:
+    """
+    Send a GitHub API write request (not cached).
+
+    :param method: HTTP method, i.e. - `POST`, `PATCH`, `DELETE`
+    :param path: GitHub API path, i.e. - `repos/{owner}/{repo}/labels`
+    :param payload: JSON request body
+    :returns: response JSON, `None` when response has no content
+    """
+    response = _request(method, _api_url(path=path), json=payload, timeout=30)
+    response.raise_for_status()
+    return response.json() if response.content else None
+
+
+#: Nested repository connections fetched in bulk, with the fields selected for each node
+GRAPHQL_CONNECTIONS = {
+    'pullRequests': (
+        'pullRequests(states: OPEN, %s, orderBy: {field: CREATED_AT, direction: DESC})',
+        'number url createdAt mergeable mergeStateStatus headRefName author { login }',
+    ),
+    #: Same order as the REST tags listing, which sorts tag names in descending order
+    'refs': ('refs(refPrefix: "refs/tags/", %s, orderBy: {field: ALPHABETICAL, direction: DESC})', 'name'),
+    'labels': ('labels(%s)', 'name color description'),
+}
+#: GraphQL error types of queries too large or too slow to run, retried as smaller pages
+GRAPHQL_RESOURCE_ERRORS = frozenset({'MAX_NODE_LIMIT_EXCEEDED', 'RESOURCE_LIMITS_EXCEEDED'})
+#: HTTP status codes of GraphQL queries that timed out on GitHub's side, retried as smaller pages
+GRAPHQL_TIMEOUT_STATUS = frozenset({502, 504})
+
+
+class GraphQLError(RuntimeError):
+    """GitHub GraphQL query returned `errors`"""
+
+    def __init__(self, errors: List[Dict]):
+        super().__init__(f'GitHub GraphQL query failed: {errors}')
+        self.errors = errors
+
+
+def _graphql_connection(name: str, paged: bool) -> str:
+    """
+    GraphQL selection of nested repository connection `name`.
+
+    :param name: connection name, i.e. - `pullRequests`
+    :param paged: select a page using `$first`/`$after` variables, otherwise the first `$inner` nodes
+    :returns: GraphQL selection
+    """
+    connection, fields = GRAPHQL_CONNECTIONS[name]
+    arguments = 'first: $first, after: $after' if paged else 'first: $inner'
+    return f'{connection % arguments} {{ pageInfo {{ hasNextPage endCursor }} nodes {{ {fields} }} }}'
+
+
+ORG_QUERY = '''
+query($org: String!, $first: Int!, $after: String, $inner: Int!) {
+  rateLimit { cost remaining resetAt }
+  organization(login: $org) {
+    repositories(first: $first, after: $after, isFork: false, orderBy: {field: NAME, direction: ASC}) {
+      pageInfo { hasNextPage endCursor }
+      nodes { nameWithOwner %s }
+    }
+  }
+}
+'''
+
+REPO_CONNECTION_QUERY = '''
+query($owner: String!, $name: String!, $first: Int!, $after: String) {
+  repository(owner: $owner, name: $name) { %s }
+}
+'''
+
+
+def _graphql(query: str, variables: Dict) -> Dict:
+    """
+    Execute GitHub GraphQL query.
+
+    :param query: GraphQL query document
+    :param variables: query variables
+    :returns: query `data`
+    """
+    payload = {'query': query, 'variables': variables}
+    with profiling.span('graphql'):
+        response = _request('POST', f'{GITHUB_API_URL}/graphql', json=payload, timeout=60)
+    response.raise_for_status()
+    body = response.json()
+    if body.get('errors'):
+        raise GraphQLError(errors=body['errors'])
+    return body['data']
+
+
+def _graphql_remaining(full_name: str, name: str, connection: Dict) -> List[Dict]:
+    """
+    Get all nodes of a nested repository connection, following up on pages beyond the bulk query.
+
+    :param full_name: full name of repository
+    :param name: connection name, i.e. - `pullRequests`
+    :param connection: connection as returned by bulk query
+    :returns: all connection nodes
+    """
+    nodes = list(connection['nodes'])
+    page_info = connection['pageInfo']
+    owner, repo = full_name.split('/', 1)
+    while page_info['hasNextPage']:
+        query = REPO_CONNECTION_QUERY % _graphql_connection(name=name, paged=True)
+        variables = {'owner': owner, 'name': repo, 'first': 100, 'after': page_info['endCursor']}
+        connection = _graphql(query=query, variables=variables)['repository'][name]
+        nodes.extend(connection['nodes'])
+        page_info = connection['pageInfo']
+    return nodes
+
+
+def _graphql_repository(node: Dict, connections: Iterable[str]) -> Dict:
+    """
+    Convert bulk query repository node into the data shapes produced by the REST sync path.
+
+    :param node: repository node
+    :param connections: nested connections fetched (see `GRAPHQL_CONNECTIONS`)
+    :returns: repository data of each connection fetched - `pull_requests`, `versions` (tag data) and `labels`
+    """
+    full_name = node['nameWithOwner']
+    nodes = {name: _graphql_remaining(full_name=full_name, name=name, connection=node[name]) for name in connections}
+    data = {'repository': full_name}
+    if 'pullRequests' in nodes:
+        mergeable = {'MERGEABLE': True, 'CONFLICTING': False}
+        data['pull_requests'] = [
+            {
+                'repository': full_name,
+                'pull_request': pr['number'],
+                'url': pr['url'],
+                'user': (pr.get('author') or {}).get('login'),
+                'date': pr['createdAt'].split('T')[0],
+                'branch': pr['headRefName'],
+                'mergeable': mergeable.get(pr.get('mergeable')),
+                'mergeable_state': (pr.get('mergeStateStatus') or 'unknown').lower(),
+            }
+            for pr in nodes['pullRequests']
+        ]
+    if 'refs' in nodes:
+        data['versions'] = {'repository': full_name, 'versions': [tag['name'] for tag in nodes['refs']]}
+    if 'labels' in nodes:
+        data['labels'] = [
+            {'name': x['name'], 'color': x['color'], 'description': x['description']} for x in nodes['labels']
+        ]
+    return data
+
+
+def _retry_smaller(err: Exception) -> bool:
+    """
+    Determine if a failed bulk query may succeed as a smaller page - it timed out or exceeded GitHub's limits.
+        Note: other failures (i.e. - 401/403) are raised as is, smaller pages would fail the same way
+
+    :param err: error raised by the query
+    :returns: boolean depicting whether to retry the query with a smaller page
+    """
+    import requests
+
+    if isinstance(err, requests.Timeout):
+        return True
+    if isinstance(err, requests.HTTPError):
+        return err.response is not None and err.response.status_code in GRAPHQL_TIMEOUT_STATUS
+    if isinstance(err, GraphQLError):
+        return any(error.get('type') in GRAPHQL_RESOURCE_ERRORS for error in err.errors)
+    return False
+
+
+@functools.lru_cache()
+def _org_query(connections: Tuple[str, ...]) -> str:
+    """Bulk organization query selecting nested repository `connections`"""
+    return ORG_QUERY % ' '.join(_graphql_connection(name=name, paged=False) for name in connections)
+
+
+def get_org_pages(
+    org: str, connections: Iterable[str], after: Optional[str] = None
+) -> Iterator[Tuple[List[Dict], str]]:
+    """
+    Get nested connections (open pull requests, tags and/or labels) of every (source) repository in `org` using bulk
+    GraphQL queries.
+        Note: repository page size adapts so each query stays near `GRAPHQL_COST_TARGET` rate limit points
+
+    :param org: name of GitHub organization
+    :param connections: nested connections to fetch - `pullRequests`, `refs` and/or `labels`
+    :param after: cursor of the page to continue after, repositories are ordered by name
+    :returns: iterator of pages of repository data (`pull_requests`, `versions` and/or `labels` per repository),
+        paired with the cursor of the page
+    """
+    import requests
+
+    connections = tuple(connections)
+    query = _org_query(connections=connections)
+    #: Rate limit cost is roughly the number of requested nodes / 100
+    first = max(1, min(100, GRAPHQL_COST_TARGET * 100 // (1 + len(connections) * GRAPHQL_INNER_PAGE)))
+    while True:
+        variables = {'org': org, 'first': first, 'after': after, 'inner': GRAPHQL_INNER_PAGE}
+        try:
+            data = _graphql(query=query, variables=variables)
+        except (requests.RequestException, GraphQLError) as err:
+            #: Large pages can time out on GitHub's side, retry same page at half the size
+            if first == 1 or not _retry_smaller(err):
+                raise
+            first = max(1, first // 2)
+            continue
+
+        repositories = data['organization']['repositories']
+        cost = data['rateLimit']['cost']
+        logger.info({'operation': 'get_org_pages', 'first': first, 'cost': cost, **data['rateLimit']})
+        page = [_graphql_repository(node=node, connections=connections) for node in repositories['nodes']]
+        yield page, repositories['pageInfo']['endCursor']
+
+        if cost > GRAPHQL_COST_TARGET:
+            first = max(1, first * GRAPHQL_COST_TARGET // cost)
+        if not repositories['pageInfo']['hasNextPage']:
+            return
+        after = repositories['pageInfo']['endCursor']
+
+
+def map_repos(
+    func: Callable[['Repository'], T], repos: Iterable['Repository'], concurrency: int = SYNC_CONCURRENCY
+) -> Iterator[T]:
+    """
+    Apply `func` to each repository concurrently, yielding results as they complete.
+        Note: at most 2x `concurrency` repositories are in flight so results stream with flat memory
+
+    :param func: function to apply to each repository
+    :param repos: iterable of GitHub repository objects
+    :param concurrency: maximum number of concurrent workers
+    :returns: iterator of `func` results in completion order
+    """
+    #: Workers run at the priority of the caller
+    func = GOVERNOR.bind(func)
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        pending = set()
+        for repo in repos:
+            pending.add(executor.submit(func, repo))
+            if len(pending) >= concurrency * 2:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                yield from (future.result() for future in done)
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            yield from (future.result() for future in done)
+
+
+@functools.lru_cache()
+def _get_signing_key(digest: str) -> hmac.HMAC:
+    """
+    Get HMAC object precomputed with the GitHub webhook secret, copied per request to skip key setup.
+
+    :param digest: name of digest algorithm (`sha256`, `sha1`)
+    :returns: keyed HMAC object without any message content
+    """
+    return hmac.new(_get_github_secret().encode('utf-8'), digestmod=getattr(hashlib, digest))
+
+
+def _valid_signature(headers: Dict, body: bytes) -> bool:
     """
     Determine if request signature is valid.
+        Note: `X-Hub-Signature-256` is preferred, `X-Hub-Signature` (SHA1) is only used when it is absent
 
-    :param headers: dictionary of request headers
-    :param body: json encoded webhook body
+    :param headers: dictionary of request headers, lower cased names
+    :param body: raw webhook body
     :returns: boolean depicting validity of signature received
     """
-    signing_secret = _get_github_secret().encode('utf-8')
-    signature_parts = headers.get('X-Hub-Signature', '').split('=', 1)
-    computed_signature = hmac.new(signing_secret, body.encode('utf-8'), digestmod=hashlib.sha1).hexdigest()
+    for header, digest in SIGNATURE_HEADERS:
+        signature = headers.get(header)
+        if signature:
+            break
+    else:
+        logger.warning({'operation': '_valid_signature', 'error': 'Signature header missing'})
+        return False
 
-    if not hmac.compare_digest(signature_parts[1], computed_signature):
-        logger.exception(
-            {'operation': '_valid_signature', 'expected': signature_parts[1], 'computed': computed_signature}
-        )
+    prefix, _, received = signature.partition('=')
+    mac = _get_signing_key(digest).copy()
+    mac.update(body)
+    if prefix != digest or not hmac.compare_digest(received, mac.hexdigest()):
+        logger.warning({'operation': '_valid_signature', 'header': header, 'received': received})
         return False
     return True
 
@@ -148,28 +787,62 @@ def _distribute_payload(payload: Dict):
 
     if event:
         logger.info(f'Topic Arn: {event.topic_arn}')
-        sns.emit_sns_msg(message={event.value: payload}, topic_arn=event.topic_arn)
+        #: Payloads are projected to the fields consumers read, messages still oversized are passed by reference
+        message = {event.value: claimcheck.project(payload=payload, fields=event.fields)}
+        sns.emit_sns_msg(message=claimcheck.check(message=message), topic_arn=event.topic_arn)
 
 
 @tracer.capture_lambda_handler
-@logger.inject_lambda_context(log_event=True)
+@logger.inject_lambda_context
+@metrics.log_metrics
+@profiling.profile
 def receive(event: Dict, _c: Dict) -> Dict:
     """
     Lambda function to receive and validate GitHub webhooks before passing along payload.
+        Note: unhandled events are rejected by header and the body is only parsed once the signature is verified
 
     :param event: lambda expected event object
     :param _c: lambda expected context object (unused)
     :returns: none
     """
-    raw = event.get('body')
-    body = json.loads(raw)
-    logger.info('Webhook received')
+    headers = {k.lower(): v for k, v in (event.get('headers') or {}).items()}
+    github_event = headers.get('x-github-event')
+    logger.info({'operation': 'receive', 'event': github_event, 'delivery': headers.get('x-github-delivery')})
 
-    #: Add in webhook "name"
-    body.update({'X-GitHub-Event': event.get('headers', {}).get('X-GitHub-Event')})
+    if github_event not in HANDLED_EVENTS:
+        return {
+            'statusCode': 202,
+            'body': f'GitHub event `{github_event}` not handled',
+            'headers': {**JSON_CONTENT},
+        }
 
-    if _valid_signature(headers=event.get('headers'), body=raw):
-        _distribute_payload(payload=body)
+    raw = event.get('body') or ''
+    raw = base64.b64decode(raw) if event.get('isBase64Encoded') else raw.encode('utf-8')
+    if _valid_signature(headers=headers, body=raw):
+        body = json.loads(raw)
+        #: Add in webhook "name" and delivery id, used downstream to drop duplicate deliveries
+        body['X-GitHub-Event'] = github_event
+        body['X-GitHub-Delivery'] = headers.get('x-github-delivery')
+        try:
+            claimed = idempotency.claim(scope='receive', delivery_id=body['X-GitHub-Delivery'])
+        except idempotency.InProgress:
+            return {
+                'statusCode': 409,
+                'body': 'GitHub delivery is being received',
+                'headers': {**JSON_CONTENT},
+            }
+        if not claimed:
+            return {
+                'statusCode': 200,
+                'body': 'GitHub delivery already received',
+                'headers': {**JSON_CONTENT},
+            }
+        try:
+            _distribute_payload(payload=body)
+        except Exception:
+            idempotency.release(scope='receive', delivery_id=body['X-GitHub-Delivery'])
+            raise
+        idempotency.complete(scope='receive', delivery_id=body['X-GitHub-Delivery'])
         return {
             'statusCode': 202,
             'body': 'GitHub signature verified',
@@ -180,5 +853,5 @@ def receive(event: Dict, _c: Dict) -> Dict:
         'body': 'GitHub signature does not match',
         'headers': {**JSON_CONTENT},
     }
-    logger.exception(err)
+    logger.warning(err)
     return err
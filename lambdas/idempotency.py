@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+"""
+    Idempotency
+    -----------
+
+    Module contains the delivery store used to drop duplicate deliveries (GitHub webhook redeliveries, at least
+    once SNS/SQS delivery) before they are processed
+
+    A delivery is claimed `INPROGRESS` for about the function timeout and only marked `COMPLETED` (remembered for
+    `IDEMPOTENCY_TTL`) once processed; a failed delivery is released, and the claim of an invocation that crashed or
+    timed out expires, so redeliveries are processed rather than dropped.
+
+"""
+
+from aws_lambda_powertools.logging import Logger
+from botocore.exceptions import ClientError
+
+import os
+import threading
+import time
+from lambdas import dynamodb
+from typing import Dict, Optional
+
+#: DynamoDB table for watcher state, delivery claims expire through its `expires` TTL attribute
+STATE_TABLE = os.environ.get('STATE_TABLE')
+#: Seconds a delivery is remembered, GitHub allows redelivering webhooks of the past three days
+IDEMPOTENCY_TTL = int(os.environ.get('IDEMPOTENCY_TTL', str(3 * 24 * 60 * 60)))
+#: Seconds a delivery stays claimed while being processed, set to the function timeout
+IDEMPOTENCY_LEASE = int(os.environ.get('IDEMPOTENCY_LEASE', '900'))
+INPROGRESS = 'INPROGRESS'
+COMPLETED = 'COMPLETED'
+
+#: Claimed and duplicate delivery counts for the life of the container
+STATS = {'claimed': 0, 'duplicates': 0}
+_STATS_LOCK = threading.Lock()
+
+logger = Logger()
+
+
+class InProgress(Exception):
+    """Delivery is being processed by another invocation, it is to be retried rather than dropped"""
+
+
+def _key(scope: str, delivery_id: str) -> Dict:
+    """State table key for `delivery_id` processed by `scope`"""
+    return {'id': f'delivery#{scope}#{delivery_id}'}
+
+
+def _count(stat: str) -> float:
+    """Increment `stat` and return the resulting duplicate rate"""
+    with _STATS_LOCK:
+        STATS[stat] += 1
+        return STATS['duplicates'] / (STATS['claimed'] + STATS['duplicates'])
+
+
+def claim(scope: str, delivery_id: Optional[str]) -> bool:
+    """
+    Claim `delivery_id` for processing by `scope` using a conditional write, the claim is `INPROGRESS` until
+    `complete` (or `release`) is called and expires after `IDEMPOTENCY_LEASE` seconds otherwise.
+
+    :param scope: name of the consumer, each consumer processes a delivery once
+    :param delivery_id: unique delivery id, i.e. - `X-GitHub-Delivery` header or SNS message id
+    :returns: boolean depicting whether delivery should be processed, `False` for completed duplicates
+    :raises InProgress: when the delivery is claimed by another invocation still processing it
+    """
+    if not (STATE_TABLE and delivery_id):
+        return True
+    now = int(time.time())
+    key = _key(scope=scope, delivery_id=delivery_id)
+    try:
+        dynamodb.put_item(
+            item={**key, 'status': INPROGRESS, 'expires': now + IDEMPOTENCY_LEASE},
+            table=STATE_TABLE,
+            ConditionExpression='attribute_not_exists(id) OR expires < :now',
+            ExpressionAttributeValues={':now': now},
+        )
+    except ClientError as err:
+        if err.response['Error']['Code'] != 'ConditionalCheckFailedException':
+            raise
+        try:
+            status = dynamodb.get_item(key=key, table=STATE_TABLE, ConsistentRead=True).get('status', COMPLETED)
+        except KeyError:
+            #: Released in between both requests
+            status = None
+        if status != COMPLETED:
+            logger.info({'operation': 'claim', 'scope': scope, 'delivery': delivery_id, 'status': status})
+            raise InProgress(f'Delivery `{delivery_id}` of `{scope}` is being processed')
+        rate = _count('duplicates')
+        logger.info({'operation': 'claim', 'scope': scope, 'delivery': delivery_id, 'duplicate_rate': rate})
+        return False
+    _count('claimed')
+    return True
+
+
+def complete(scope: str, delivery_id: Optional[str]):
+    """
+    Mark claim on `delivery_id` completed once processed, redeliveries are dropped for `IDEMPOTENCY_TTL` seconds.
+
+    :param scope: name of the consumer
+    :param delivery_id: unique delivery id
+    :returns: None
+    """
+    if STATE_TABLE and delivery_id:
+        item = {**_key(scope=scope, delivery_id=delivery_id), 'status': COMPLETED}
+        dynamodb.put_item(item={**item, 'expires': int(time.time()) + IDEMPOTENCY_TTL}, table=STATE_TABLE)
+
+
+def release(scope: str, delivery_id: Optional[str]):
+    """
+    Release claim on `delivery_id` after processing failed, so a redelivery is processed.
+
+    :param scope: name of the consumer
+    :param delivery_id: unique delivery id
+    :returns: None
+    """
+    if STATE_TABLE and delivery_id:
+        dynamodb.delete_item(key=_key(scope=scope, delivery_id=delivery_id), table=STATE_TABLE)
+
+
+def stats() -> Dict:
+    """
+    Get delivery store statistics.
+
+    :returns: number of `claimed` and `duplicates` deliveries and the `duplicate_rate`
+    """
+    with _STATS_LOCK:
+        total = STATS['claimed'] + STATS['duplicates']
+        return {**STATS, 'duplicate_rate': STATS['duplicates'] / total if total else 0.0}
@@ -0,0 +1,293 @@
+# -*- coding: utf-8 -*-
+"""
+    Local
+    -----
+
+    Module contains the in-process event bus and CLI runner used for backfills and load tests; messages published
+    by handlers are routed straight to the handler functions subscribed to their topic (as wired in `serverless.yml`)
+    instead of going through SNS/SQS
+
+    Usage: python -m lambdas.local [--functions pullRequestsSync,versionsSync] [--payloads FILE] [--concurrency 16]
+
+    To run against moto and a fake GitHub organization instead, see `benchmarks/backfill.py`.
+
+"""
+
+from aws_lambda_powertools.logging import Logger
+
+import yaml
+
+import argparse
+import importlib
+import json
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+SERVERLESS = os.path.join(ROOT, 'serverless.yml')
+#: Functions run by a backfill - a full organization sync, README sections render once the syncs settle
+SYNC_FUNCTIONS = ('repositorySync', 'repositorySyncLabels', 'pullRequestsSync', 'versionsSync')
+#: Maximum number of handler invocations in flight
+LOCAL_CONCURRENCY = int(os.environ.get('LOCAL_CONCURRENCY', '16'))
+#: Milliseconds reported as remaining by every invocation, handlers have no deadline in process
+REMAINING_TIME = 15 * 60 * 1000
+
+logger = Logger()
+
+
+def _topic_name(arn: str) -> str:
+    """Topic name of a topic ARN, i.e. - `Watcher-Tag`"""
+    return arn.rsplit(':', 1)[-1]
+
+
+class Function:
+    """Lambda function as defined in `serverless.yml`, its handler is imported on first invocation"""
+
+    def __init__(self, name: str, handler: str, emit_topic: Optional[str] = None):
+        self.name = name
+        #: Handler path, i.e. - `lambdas/versions.sync`
+        self.path = handler
+        #: Topic name messages are published to when no topic is given (`EMIT_MESSAGE_TOPIC`)
+        self.emit_topic = emit_topic
+        self._handler: Optional[Callable[[Dict, Any], Any]] = None
+
+    @property
+    def handler(self) -> Callable[[Dict, Any], Any]:
+        if self._handler is None:
+            module, func = self.path.rsplit('.', 1)
+            self._handler = getattr(importlib.import_module(module.replace('/', '.')), func)
+        return self._handler
+
+
+def load_functions(path: str = SERVERLESS) -> Tuple[Dict[str, Function], Dict[str, List[Tuple[Function, str]]]]:
+    """
+    Load functions and their topic subscriptions from serverless config.
+
+    :param path: path of `serverless.yml`
+    :returns: functions by name and subscriptions by topic name - subscribed function and protocol (`sns`/`sqs`)
+    """
+    with open(path, 'r') as f:
+        config = yaml.safe_load(f)
+    resources = config.get('resources', {}).get('Resources', {})
+
+    #: Queues are subscribed to topics by subscription resources
+    queues = {}
+    for resource in resources.values():
+        props = resource.get('Properties', {})
+        if resource['Type'] != 'AWS::SNS::Subscription' or props.get('Protocol') != 'sqs':
+            continue
+        topic = props['TopicArn']
+        topic = resources[topic['Ref']]['Properties']['TopicName'] if isinstance(topic, dict) else _topic_name(topic)
+        queues[props['Endpoint']['Fn::GetAtt'][0]] = topic
+
+    functions: Dict[str, Function] = {}
+    subscriptions: Dict[str, List[Tuple[Function, str]]] = {}
+    for name, spec in config['functions'].items():
+        emit_topic = (spec.get('environment') or {}).get('EMIT_MESSAGE_TOPIC')
+        function = functions[name] = Function(
+            name=name, handler=spec['handler'], emit_topic=_topic_name(emit_topic) if emit_topic else None
+        )
+        for event in spec.get('events') or []:
+            if 'sns' in event:
+                subscriptions.setdefault(event['sns']['topicName'], []).append((function, 'sns'))
+            elif 'sqs' in event:
+                queue = queues[event['sqs']['arn']['Fn::GetAtt'][0]]
+                subscriptions.setdefault(queue, []).append((function, 'sqs'))
+    return functions, subscriptions
+
+
+class LocalContext:
+    """Lambda context object of an in-process invocation"""
+
+    memory_limit_in_mb = 1024
+
+    def __init__(self, function: Function):
+        self.function_name = function.name
+        self.invoked_function_arn = f'arn:aws:lambda:local:000000000000:function:{function.name}'
+        self.aws_request_id = str(uuid.uuid4())
+
+    @staticmethod
+    def get_remaining_time_in_millis() -> int:
+        return REMAINING_TIME
+
+
+class LocalTransport:
+    """
+    Message transport dispatching messages in process, to a pool of workers invoking the subscribed functions.
+        Note: deliveries are asynchronous as with SNS, `drain()` waits until no invocation is left in flight
+
+    :param functions: functions by name
+    :param subscriptions: subscribed functions and protocols by topic name
+    :param concurrency: maximum number of invocations in flight
+    """
+
+    def __init__(
+        self,
+        functions: Dict[str, Function],
+        subscriptions: Dict[str, List[Tuple[Function, str]]],
+        concurrency: int = LOCAL_CONCURRENCY,
+    ):
+        self.functions = functions
+        self.subscriptions = subscriptions
+        #: Invocations, errors and milliseconds spent per function
+        self.stats: Dict[str, Dict[str, float]] = {}
+        self._executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='local')
+        self._pending = 0
+        self._idle = threading.Condition()
+        self._current = threading.local()
+
+    def emit_topic(self) -> Optional[str]:
+        """Topic of the function invoked by the current worker, messages are routed by topic name"""
+        function = getattr(self._current, 'function', None)
+        return f'local:{function.emit_topic}' if function and function.emit_topic else None
+
+    def publish(self, message: str, topic_arn: str, **kwargs) -> str:
+        """Deliver `message` to every function subscribed to `topic_arn`, returning its message id"""
+        message_id = str(uuid.uuid4())
+        subscribed = self.subscriptions.get(_topic_name(topic_arn or ''), [])
+        if not subscribed:
+            logger.warning({'operation': 'publish', 'topic': topic_arn, 'message': 'No function subscribed to topic'})
+        for function, protocol in subscribed:
+            if protocol == 'sqs':
+                record = {'eventSource': 'aws:sqs', 'messageId': message_id, 'body': message}
+            else:
+                sns = {'MessageId': message_id, 'TopicArn': topic_arn, 'Message': message}
+                record = {'EventSource': 'aws:sns', 'Sns': sns}
+            self.invoke(function=function.name, event={'Records': [record]})
+        return message_id
+
+    def publish_batch(self, entries: List[Dict], topic_arn: str) -> Dict:
+        """Deliver `PublishBatch` request `entries`, all entries are successful"""
+        successful = [
+            {'Id': entry['Id'], 'MessageId': self.publish(message=entry['Message'], topic_arn=topic_arn)}
+            for entry in entries
+        ]
+        return {'Successful': successful, 'Failed': []}
+
+    def invoke(self, function: str, event: Dict):
+        """
+        Asynchronously invoke `function` with `event`.
+
+        :param function: function name, as defined in `serverless.yml`
+        :param event: lambda event
+        :returns: None
+        """
+        with self._idle:
+            self._pending += 1
+        self._executor.submit(self._run, self.functions[function], event)
+
+    def _run(self, function: Function, event: Dict):
+        """Invoke `function` on the current worker, recording its outcome"""
+        self._current.function = function
+        failed = False
+        start = time.perf_counter()
+        try:
+            result = function.handler(event, LocalContext(function=function))
+            #: Partial batch failures would be redelivered by SQS, they are reported instead
+            failed = bool(isinstance(result, dict) and result.get('batchItemFailures'))
+        except Exception:
+            logger.exception({'operation': 'invoke', 'function': function.name})
+            failed = True
+        finally:
+            self._current.function = None
+            with self._idle:
+                stats = self.stats.setdefault(function.name, {'invocations': 0, 'errors': 0, 'ms': 0.0})
+                stats['invocations'] += 1
+                stats['errors'] += int(failed)
+                stats['ms'] += (time.perf_counter() - start) * 1000
+                self._pending -= 1
+                if not self._pending:
+                    self._idle.notify_all()
+
+    def drain(self):
+        """Wait until every invocation, including the invocations they cascade into, has completed"""
+        with self._idle:
+            self._idle.wait_for(lambda: not self._pending)
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+
+
+def backfill(
+    functions: Iterable[str] = SYNC_FUNCTIONS,
+    payloads: Iterable[Dict] = (),
+    concurrency: int = LOCAL_CONCURRENCY,
+    config: str = SERVERLESS,
+) -> Dict:
+    """
+    Run `functions` and webhook `payloads` end to end in process - every invocation they cascade into (repository
+    updates, README renders, etc.) is dispatched to the local worker pool until all work has settled.
+
+    :param functions: names of functions to invoke with an empty (scheduled) event
+    :param payloads: GitHub webhook payloads, distributed to the event topics as received by the hub
+    :param concurrency: maximum number of invocations in flight
+    :param config: path of `serverless.yml`
+    :returns: report - `ms` elapsed, total `invocations` and `errors`, and stats per function
+    """
+    from lambdas import hub, sns
+
+    transport = LocalTransport(*load_functions(path=config), concurrency=concurrency)
+    previous, sns.TRANSPORT = sns.TRANSPORT, transport
+    start = time.perf_counter()
+    try:
+        for name in functions:
+            transport.invoke(function=name, event={})
+        for payload in payloads:
+            hub._distribute_payload(payload=payload)
+        transport.drain()
+    finally:
+        sns.TRANSPORT = previous
+        transport.close()
+
+    stats = dict(sorted(transport.stats.items()))
+    return {
+        'ms': round((time.perf_counter() - start) * 1000, 2),
+        'invocations': sum(stat['invocations'] for stat in stats.values()),
+        'errors': sum(stat['errors'] for stat in stats.values()),
+        'functions': {name: {**stat, 'ms': round(stat['ms'], 2)} for name, stat in stats.items()},
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog='python -m lambdas.local', description=__doc__.split('\n\n')[1].strip())
+    parser.add_argument(
+        '--functions',
+        default=','.join(SYNC_FUNCTIONS),
+        help=f'comma separated functions to invoke (default {",".join(SYNC_FUNCTIONS)})',
+    )
+    parser.add_argument('--payloads', help='file of GitHub webhook payloads (JSON lines) to distribute')
+    parser.add_argument('--concurrency', type=int, default=LOCAL_CONCURRENCY, help='invocations in flight')
+    parser.add_argument('--log-level', default='WARNING', help='handler log level (default WARNING)')
+    args = parser.parse_args(argv)
+
+    #: Handler modules share the logger of the service, it is set up at the level of `LOG_LEVEL` on first import
+    os.environ['LOG_LEVEL'] = args.log_level.upper()
+    logging.getLogger(logger.service).setLevel(args.log_level.upper())
+    #: Oversized payloads are claim checked to a local directory, unless a bucket is set
+    if not os.environ.get('CLAIM_CHECK_BUCKET'):
+        os.environ.setdefault('CLAIM_CHECK_DIR', os.path.join(tempfile.gettempdir(), 'watcher-claim-check'))
+    payloads: List[Dict] = []
+    if args.payloads:
+        with open(args.payloads, 'r') as f:
+            payloads = [json.loads(line) for line in f if line.strip()]
+
+    from lambdas import metrics
+
+    #: Standard output is kept for the report, metrics records are held in memory
+    metrics.SINK = metrics.MemorySink()
+    report = backfill(
+        functions=[name for name in args.functions.split(',') if name], payloads=payloads, concurrency=args.concurrency
+    )
+    print(json.dumps(report, indent=2))
+    return 1 if report['errors'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
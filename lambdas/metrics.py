@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+"""
+    Metrics
+    -------
+
+    Module contains the per invocation performance metrics of handlers; counters recorded across `hub`, `dynamodb`,
+    `sns` and `readme` are flushed once per invocation in CloudWatch Embedded Metric Format (EMF)
+
+"""
+
+from aws_lambda_powertools.logging import Logger
+from aws_lambda_powertools.metrics import Metrics, MetricUnit
+
+import contextlib
+import functools
+import json
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, Iterator, List, TypeVar
+
+#: CloudWatch namespace metrics are published under
+NAMESPACE = os.environ.get('POWERTOOLS_METRICS_NAMESPACE', 'Watcher')
+
+#: Metrics recorded per invocation and their units
+UNITS = {
+    'GitHubRequests': MetricUnit.Count,
+    'GitHubLatency': MetricUnit.Milliseconds,
+    'DynamoDBRequests': MetricUnit.Count,
+    'DynamoDBConsumedCapacity': MetricUnit.Count,
+    'DynamoDBItemsScanned': MetricUnit.Count,
+    'SNSMessagesPublished': MetricUnit.Count,
+    'ClaimChecksStored': MetricUnit.Count,
+    'ReadmeBytesWritten': MetricUnit.Bytes,
+}
+
+T = TypeVar('T')
+
+logger = Logger()
+
+#: Counters of the current invocation, a lambda container serves a single invocation at a time
+_COUNTERS: Dict[str, float] = {}
+_LOCK = threading.Lock()
+
+
+class EMFSink:
+    """Metrics sink printing CloudWatch Embedded Metric Format records, extracted from the lambda log stream"""
+
+    def __init__(self, namespace: str = NAMESPACE):
+        self._metrics = Metrics(namespace=namespace)
+
+    def emit(self, metrics: Dict[str, float], dimensions: Dict[str, str]):
+        for dimension, label in dimensions.items():
+            self._metrics.add_dimension(name=dimension, value=label)
+        for metric, value in metrics.items():
+            self._metrics.add_metric(name=metric, unit=UNITS[metric], value=value)
+        try:
+            print(json.dumps(self._metrics.serialize_metric_set(), separators=(',', ':')))
+        finally:
+            self._metrics.clear_metrics()
+
+
+class MemorySink:
+    """Metrics sink holding records in memory, used to capture metrics in tests and benchmarks"""
+
+    def __init__(self):
+        self.records: List[Dict] = []
+
+    def emit(self, metrics: Dict[str, float], dimensions: Dict[str, str]):
+        self.records.append({'metrics': dict(metrics), 'dimensions': dict(dimensions)})
+
+
+#: Pluggable metrics sink, any object providing `emit(metrics, dimensions)`
+SINK: Any = EMFSink()
+
+
+def add(name: str, value: float = 1):
+    """
+    Add `value` to metric `name` of the current invocation.
+        Note: unknown metrics are logged and dropped, a metric is never worth failing an invocation over
+
+    :param name: metric name, one of `UNITS`
+    :param value: amount to add
+    :returns: None
+    """
+    if name not in UNITS:
+        logger.warning({'operation': 'metrics', 'message': f'Unknown metric `{name}` dropped', 'value': value})
+        return
+    with _LOCK:
+        _COUNTERS[name] = _COUNTERS.get(name, 0) + value
+
+
+@contextlib.contextmanager
+def timed(name: str) -> Iterator[None]:
+    """
+    Add milliseconds spent in enclosed block to metric `name`.
+
+    :param name: metric name, one of `UNITS`
+    :returns: context manager
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        add(name=name, value=(time.perf_counter() - start) * 1000)
+
+
+def flush(dimensions: Dict[str, str]) -> Dict[str, float]:
+    """
+    Emit metrics of the current invocation to `SINK` and reset them, unrecorded metrics are emitted as zero.
+
+    :param dimensions: dimensions of all metrics, i.e. - `handler`
+    :returns: metrics emitted
+    """
+    with _LOCK:
+        metrics = {name: _COUNTERS.get(name, 0) for name in UNITS}
+        _COUNTERS.clear()
+    SINK.emit(metrics=metrics, dimensions=dimensions)
+    return metrics
+
+
+def log_metrics(handler: Callable[..., T]) -> Callable[..., T]:
+    """
+    Record metrics of every invocation of lambda `handler`, flushed once it returns or raises.
+
+    :param handler: lambda handler
+    :returns: decorated handler
+    """
+    name = f'{handler.__module__.rsplit(".", 1)[-1]}.{handler.__name__}'
+
+    @functools.wraps(handler)
+    def wrapper(event: Dict, context: Any) -> T:
+        #: Counters of an enclosing invocation (handler invoked in-process) are set aside until it resumes
+        with _LOCK:
+            outer = dict(_COUNTERS)
+            _COUNTERS.clear()
+        try:
+            return handler(event, context)
+        finally:
+            flush(dimensions={'handler': name})
+            with _LOCK:
+                _COUNTERS.update(outer)
+
+    return wrapper
+
+
+def _return_consumed_capacity(params: Dict, model, **kwargs):
+    """Ask DynamoDB to report consumed capacity on every operation that supports it"""
+    if 'ReturnConsumedCapacity' in model.input_shape.members:
+        params.setdefault('ReturnConsumedCapacity', 'TOTAL')
+
+
+def _record_dynamodb_call(parsed: Dict, model, **kwargs):
+    """Record DynamoDB request, its consumed capacity and items scanned"""
+    consumed = parsed.get('ConsumedCapacity') or []
+    add(name='DynamoDBRequests')
+    add(
+        name='DynamoDBConsumedCapacity',
+        value=sum(c.get('CapacityUnits', 0) for c in (consumed if isinstance(consumed, list) else [consumed])),
+    )
+    if model.name in {'Scan', 'Query'}:
+        add(name='DynamoDBItemsScanned', value=parsed.get('ScannedCount', 0))
+
+
+def instrument_dynamodb(client):
+    """
+    Record metrics of every request made by DynamoDB `client`.
+
+    :param client: boto3 DynamoDB client
+    :returns: None
+    """
+    client.meta.events.register('before-parameter-build.dynamodb', _return_consumed_capacity)
+    client.meta.events.register('after-call.dynamodb', _record_dynamodb_call)
@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+"""
+    Profiling
+    ---------
+
+    Module contains the opt-in profiling mode of handlers, enabled per function by environment variable so hot spots
+    of production-shaped runs can be found without deploying instrumented code
+
+    Modes (`PROFILE_MODE`):
+        - `cprofile`: deterministic, covers the handler thread only; pstats summary
+        - `sample`: statistical, covers all threads (sync workers, scan segments); collapsed stacks (flame graphs)
+
+    External calls are wrapped in spans, traced as X-Ray subsegments and timed per invocation while profiling.
+
+"""
+
+from aws_lambda_powertools.logging import Logger
+from aws_lambda_powertools.tracing import Tracer
+
+import cProfile
+import contextlib
+import functools
+import io
+import os
+import pstats
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Any, Callable, Dict, Iterator, Optional, TypeVar, Union
+
+#: Profiler wrapping handlers - `cprofile` or `sample`, profiling is disabled when unset
+PROFILE_MODE = os.environ.get('PROFILE_MODE', '').lower()
+#: Directory each profile is written to (`.pstats` or `.collapsed` per invocation, i.e. - under `/tmp`)
+PROFILE_DIR = os.environ.get('PROFILE_DIR')
+#: Seconds in between stack samples taken by the `sample` profiler
+PROFILE_INTERVAL = float(os.environ.get('PROFILE_INTERVAL', '0.005'))
+#: Number of functions (`cprofile`) or stacks (`sample`) in the logged summary
+PROFILE_TOP = int(os.environ.get('PROFILE_TOP', '30'))
+MODES = frozenset({'cprofile', 'sample'})
+
+T = TypeVar('T')
+
+#: Tracing via X-Ray
+tracer = Tracer()
+logger = Logger()
+
+#: Calls and milliseconds spent per span of the current invocation
+_SPANS: Dict[str, Dict[str, float]] = {}
+_LOCK = threading.Lock()
+
+
+class Sampler:
+    """Statistical profiler sampling the stacks of all other threads every `interval` seconds"""
+
+    def __init__(self, interval: float = PROFILE_INTERVAL):
+        self.interval = interval
+        #: Sample counts by collapsed stack - `module.function;module.function` from root to leaf
+        self.stacks: Counter = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='profiling-sampler', daemon=True)
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(f'{frame.f_globals.get("__name__")}.{frame.f_code.co_name}')
+                    frame = frame.f_back
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def __enter__(self) -> 'Sampler':
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+    def collapsed(self, top: Optional[int] = None) -> str:
+        """Collapsed stacks (`stack count` per line) of the `top` most sampled stacks, all when not provided"""
+        return ''.join(f'{stack} {count}\n' for stack, count in self.stacks.most_common(top))
+
+
+@contextlib.contextmanager
+def span(name: str) -> Iterator[None]:
+    """
+    Trace external call `name` as an X-Ray subsegment and record its duration while profiling, no-op otherwise.
+
+    :param name: name of external call, i.e. - `get_tags`, `scan_page`
+    :returns: context manager
+    """
+    if PROFILE_MODE not in MODES:
+        yield
+        return
+
+    start = time.perf_counter()
+    try:
+        with tracer.provider.in_subsegment(name=f'## {name}'):
+            yield
+    finally:
+        elapsed = (time.perf_counter() - start) * 1000
+        with _LOCK:
+            stats = _SPANS.setdefault(name, {'calls': 0, 'ms': 0.0})
+            stats['calls'] += 1
+            stats['ms'] += elapsed
+
+
+def _report(name: str, request_id: str, profiler: Union[cProfile.Profile, Sampler], elapsed: float):
+    """Log profile summary and spans of invocation, writing the full profile to `PROFILE_DIR` when set"""
+    with _LOCK:
+        spans = {key: {'calls': value['calls'], 'ms': round(value['ms'], 2)} for key, value in _SPANS.items()}
+        _SPANS.clear()
+
+    if isinstance(profiler, Sampler):
+        summary = profiler.collapsed(top=PROFILE_TOP)
+    else:
+        stream = io.StringIO()
+        pstats.Stats(profiler, stream=stream).sort_stats('cumulative').print_stats(PROFILE_TOP)
+        summary = stream.getvalue()
+
+    path = None
+    if PROFILE_DIR:
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        path = os.path.join(PROFILE_DIR, f'{name}-{request_id}')
+        if isinstance(profiler, Sampler):
+            path += '.collapsed'
+            with open(path, 'w') as f:
+                f.write(profiler.collapsed())
+        else:
+            path += '.pstats'
+            profiler.dump_stats(path)
+
+    logger.info(
+        {
+            'operation': 'profile',
+            'handler': name,
+            'mode': PROFILE_MODE,
+            'ms': round(elapsed, 2),
+            'spans': spans,
+            'path': path,
+            'profile': summary,
+        }
+    )
+
+
+def profile(handler: Callable[..., T]) -> Callable[..., T]:
+    """
+    Profile every invocation of lambda `handler` when `PROFILE_MODE` is set, handler is returned as is otherwise.
+
+    :param handler: lambda handler
+    :returns: decorated handler
+    """
+    if not PROFILE_MODE:
+        return handler
+    if PROFILE_MODE not in MODES:
+        logger.warning({'operation': 'profile', 'message': f'Unknown PROFILE_MODE `{PROFILE_MODE}`, not profiling'})
+        return handler
+    name = f'{handler.__module__.rsplit(".", 1)[-1]}.{handler.__name__}'
+
+    @functools.wraps(handler)
+    def wrapper(event: Dict, context: Any) -> T:
+        with _LOCK:
+            _SPANS.clear()
+        request_id = getattr(context, 'aws_request_id', None) or str(int(time.time() * 1000))
+        profiler = Sampler() if PROFILE_MODE == 'sample' else cProfile.Profile()
+        start = time.perf_counter()
+        try:
+            if isinstance(profiler, Sampler):
+                with profiler:
+                    return handler(event, context)
+            return profiler.runcall(handler, event, context)
+        finally:
+            elapsed = (time.perf_counter() - start) * 1000
+            _report(name=name, request_id=request_id, profiler=profiler, elapsed=elapsed)
+
+    return wrapper
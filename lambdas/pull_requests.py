@@ -9,14 +9,18 @@
 
 from aws_lambda_powertools.logging import Logger
 from aws_lambda_powertools.tracing import Tracer
-from github.Repository import Repository
 
+import json
 import os
 import re
 from datetime import datetime
-from lambdas import dynamodb, hub, sns
+from lambdas import checkpoint, dynamodb, hub, metrics, profiling, readme, sns
 from lambdas.hub import GithubEvent
-from typing import Dict, List
+from lambdas.ratelimit import Priority
+from typing import TYPE_CHECKING, Dict, Iterator, List, Optional, Tuple
+
+if TYPE_CHECKING:
+    from github.Repository import Repository
 
 #: DynamoDB table for pull requests
 PR_TABLE = os.environ.get('PULL_REQUEST_TABLE')
@@ -26,6 +30,15 @@ DATE_FORMAT = '%Y-%m-%d'
 METADATA_REPO = os.environ.get('GITHUB_METADATA_REPO')
 #: GitHub Organization to collect data from
 ORGANIZATION = os.environ.get('GITHUB_ORGANIZATION')
+#: README pull request section is rendered as a markdown table between these tags
+README_PATTERN = re.compile('<!-- PR Start -->\n?(.*?)\n?<!-- PR End -->', flags=re.DOTALL)
+README_HEADER = '| Repository | PR | Branch | User | Age (days) |\n| --- | --- | --- | --- | --- |\n'
+#: Date the README pull request section was rendered on, ages in days are only current on that date
+README_RENDERED = '<!-- PR Rendered {date} -->\n'
+#: Repository and pull request number of a README pull request row
+README_ROW_KEY = re.compile(r'^\|(?P<repository>[^|]*)\|\[#(?P<pull_request>\d+)\]\(')
+#: Pull request data a README row is rendered from
+ROW_FIELDS = ('repository', 'pull_request', 'url', 'branch', 'user', 'date')
 
 #: Tracing via X-Ray
 tracer = Tracer()
@@ -54,7 +67,7 @@ def _get_pull_request_data(payload: Dict) -> Dict:
     }
 
 
-def _get_repository_pull_requests(repo: Repository) -> List[Dict]:
+def _get_repository_pull_requests(repo: 'Repository') -> List[Dict]:
     """
     Get pull request data from repository provided.
 
@@ -62,121 +75,271 @@ def _get_repository_pull_requests(repo: Repository) -> List[Dict]:
     :returns: array of pull request data objects for given repository
     """
     repo_full_name = repo.full_name
-    prs = repo.get_pulls(state='open', sort='created')
-    return [
-        {
-            'repository': repo_full_name,
-            'pull_request': pr.number,
-            'url': pr.url,
-            'user': pr.user.login,
-            'date': pr.created_at.strftime(DATE_FORMAT),
-            'branch': pr.head.ref,
-            'mergeable': pr.mergeable,
-            'mergeable_state': pr.mergeable_state,
-        }
-        for pr in prs
-    ]
-
-
-def _update_pull_request_table(action: str, data: dict):
+
+    def payload(pr: Dict) -> Dict:
+        return {'repository': {'full_name': repo_full_name}, 'pull_request': pr}
+
+    with profiling.span('get_pulls'):
+        prs = hub.get_all_json(
+            path=f'repos/{repo_full_name}/pulls',
+            params={'state': 'open', 'sort': 'created'},
+            transform=lambda page: [_get_pull_request_data(payload=payload(pr)) for pr in page],
+        )
+
+    def mergeability(pr: Dict) -> Dict:
+        #: Mergeability is only computed on the individual pull request resource
+        return {'mergeable': pr.get('mergeable'), 'mergeable_state': pr.get('mergeable_state')}
+
+    results = []
+    for pr in prs:
+        with profiling.span('get_pull'):
+            path = f'repos/{repo_full_name}/pulls/{pr.get("pull_request")}'
+            results.append({**pr, **hub.get_json(path=path, transform=mergeability)})
+    return results
+
+
+def _render_row(data: Dict) -> str:
+    """
+    Render pull request data as a row of the README markdown table.
+
+    :param data: pull request data object
+    :returns: markdown table row
+    """
+    days = (datetime.now() - datetime.strptime(data.get('date'), DATE_FORMAT)).days
+    repo, pr = data.get('repository'), data.get('pull_request')
+    return f"|{repo}|[#{pr}]({data.get('url')})|{data.get('branch')}|{data.get('user')}|{days}|\n"
+
+
+def _pull_request_item(data: Dict) -> Dict:
+    """
+    Create pull request table item from pull request data.
+
+    :param data: pull request data object
+    :returns: table item with current age
+    """
+    age = (datetime.now() - datetime.strptime(data.get('date'), DATE_FORMAT)).days
+    return {**data, 'age': age}
+
+
+def _update_pull_request_table(action: str, data: dict) -> bool:
     """
     Update pull request dynamodb table based on action and data provided.
 
     :param action: event action type, determines table modification action
     :param data: data to add/update within table
-    :returns: None
+    :returns: boolean depicting whether the record is kept, `False` when record is removed
     """
     #: Evaluate record action - delete, update, add
     if action in {'closed'}:
         key = {'repository': data.get('repository'), 'pull_request': data.get('pull_request')}
         dynamodb.delete_item(key=key, table=PR_TABLE)
-    else:
-        age = (datetime.now() - datetime.strptime(data.get('date'), DATE_FORMAT)).days
-        dynamodb.put_item(item={**data, 'age': age}, table=PR_TABLE)
+        return False
+
+    dynamodb.put_item(item=_pull_request_item(data=data), table=PR_TABLE)
+    return True
+
+
+def _render_rows() -> str:
+    """
+    Render all pull request rows from the pull request table (full rescan).
+
+    :returns: markdown table rows for every record in table
+    """
+    rows = {
+        (data.get('repository'), data.get('pull_request')): _render_row(data=data)
+        for data in dynamodb.scan(table=PR_TABLE, attributes=list(ROW_FIELDS))
+    }
+    return ''.join(rows[key] for key in sorted(rows))
+
+
+def _render_section(rows: str) -> str:
+    """Pull request section of README holding table `rows`, stamped with the date it is rendered on"""
+    rendered = README_RENDERED.format(date=datetime.now().strftime(DATE_FORMAT))
+    return f'<!-- PR Start -->\n{rendered}{README_HEADER}{rows}\n<!-- PR End -->'
+
+
+def _patch_rows(content: str, patch: Dict) -> Optional[str]:
+    """
+    Patch the single README row affected by a pull request event, keeping rows sorted as a full render does.
+        Note: ages are computed at render, a section rendered on an earlier date requires a full render
+
+    :param content: current README content
+    :param patch: readme patch emitted by `pull_request` - repository, pull request number and its row data (row
+        data is absent when the pull request is closed)
+    :returns: patched README content, `None` when section cannot be patched and requires a full render
+    """
+    match = README_PATTERN.search(content)
+    heading = README_RENDERED.format(date=datetime.now().strftime(DATE_FORMAT)) + README_HEADER
+    if not match or not match.group(1).startswith(heading):
+        return None
+
+    rows = {}
+    for row in match.group(1)[len(heading) :].splitlines(keepends=True):
+        row_key = README_ROW_KEY.match(row)
+        if not row_key:
+            return None
+        rows[(row_key.group('repository'), int(row_key.group('pull_request')))] = row
+
+    #: Row is replaced in (or inserted at) its sorted position, or removed when the pull request is closed
+    patched = (patch.get('repository'), int(patch.get('pull_request')))
+    rows.pop(patched, None)
+    if patch.get('date'):
+        rows[patched] = _render_row(data=patch)
+
+    section = _render_section(rows=''.join(rows[key] for key in sorted(rows)))
+    return content[: match.start()] + section + content[match.end() :]
 
 
 @tracer.capture_lambda_handler
 @logger.inject_lambda_context
-def pull_request(event: Dict, _c: Dict):
+@metrics.log_metrics
+@profiling.profile
+def pull_request(event: Dict, _c: Dict) -> Dict:
     """
-    Lambda function that responds to pull request events.
+    Lambda function that responds to pull request events, delivered individually (SNS) or in batches (SQS).
 
     :param event: lambda expected event object
     :param _c: lambda expected context object (unused)
-    :returns: none
+    :returns: partial batch response
     """
-    msg = sns.get_sns_msg(event=event, msg_key=GithubEvent.pull_request.value)
-    logger.info({'operation': 'pull_request', 'sns_payload': msg})
+    patches = []
+
+    def handle(repo_full_name: str, msgs: List[Dict]):
+        logger.info({'operation': 'pull_request', 'repository': repo_full_name, 'sns_payloads': msgs})
+        #: Only the most recent event of each pull request is applied
+        latest: Dict[int, Dict] = {}
+        for msg in msgs:
+            number = msg.get('pull_request', {}).get('number')
+            updated_at = msg.get('pull_request', {}).get('updated_at') or ''
+            if number not in latest or updated_at >= (latest[number].get('pull_request', {}).get('updated_at') or ''):
+                latest[number] = msg
+
+        for msg in latest.values():
+            #: Extract data and update DynamoDB table
+            data = _get_pull_request_data(payload=msg)
+            kept = _update_pull_request_table(action=msg.get('action'), data=data)
+            #: Only the affected row is patched in the pull request section of README, rendered when it is patched
+            key = {'repository': data.get('repository'), 'pull_request': data.get('pull_request')}
+            patches.append({field: data.get(field) for field in ROW_FIELDS} if kept else key)
+
+    def finish() -> List[str]:
+        results = sns.emit_sns_msgs(messages=({'readme': patch} for patch in patches))
+        #: Repositories with patches left unpublished are redelivered, the README would miss their rows otherwise
+        return [patches[result['index']]['repository'] for result in results if 'error' in result]
+
+    return sns.process_records(
+        event=event,
+        msg_key=GithubEvent.pull_request.value,
+        group=lambda msg: msg.get('repository', {}).get('full_name'),
+        handler=handle,
+        scope='pull_request',
+        finish=finish,
+    )
 
-    #: Extract data and update DynamoDB table
-    action = msg.get('action')
-    data = _get_pull_request_data(payload=msg)
-    _update_pull_request_table(action=action, data=data)
 
-    #: No message payload, just triggering update to pull request section of README
-    sns.emit_sns_msg(message={})
+def _render_readme(patches: List[Dict], rescan: bool) -> int:
+    """
+    Render and commit pull request section of metadata repo README file.
+
+    :param patches: queued row patches, applied in order received
+    :param rescan: perform full rescan of pull request table instead of patching rows
+    :returns: number of bytes written to README
+    """
+
+    def apply(content: str) -> str:
+        patched = None if rescan else content
+        for patch in patches:
+            if patched is None:
+                break
+            patched = _patch_rows(content=patched, patch=patch)
+        if patched is not None:
+            return patched
+
+        #: Make sure target replacement tags are put back for next update
+        result = _render_section(rows=_render_rows())
+        return README_PATTERN.sub(lambda _: result, content)
+
+    return readme.commit(apply=apply, message='Pull request section updated in README')
 
 
 @tracer.capture_lambda_handler
 @logger.inject_lambda_context
-def update_readme(event: Dict, _c: Dict):
+@metrics.log_metrics
+@profiling.profile
+def update_readme(event: Dict, context: Dict) -> Dict:
     """
     Lambda function to update pull request section of metadata repo README file.
 
+    Triggers received within the coalescing window are merged into a single render and commit.
+
     :param event: lambda expected event object
-    :param _c: lambda expected context object (unused)
-    :returns: none
+    :param context: lambda expected context object
+    :returns: number of triggers absorbed and commits made
     """
     logger.info({'operation': 'update_readme'})
-    readme = 'README.md'
-    meta_repo = hub.get_github_repo(METADATA_REPO)
-    file = meta_repo.get_contents(readme)
-
-    #: Output is rendered as markdown table
-    header = '| Repository | PR | Branch | User | Age (days) |\n| --- | --- | --- | --- | --- |\n'
-    rows = ''
-
-    #: Create a row per record/pull request
-    paginator = dynamodb.CLIENT.get_paginator('scan')
-    iterator = paginator.paginate(TableName=PR_TABLE)
-    for itr in iterator:
-        items = itr.get('Items')
-        for item in items:
-            data = dynamodb.deserialize(item)
-            days = (datetime.now() - datetime.strptime(data.get('date'), '%Y-%m-%d')).days
-            repo, pr = data.get('repository'), data.get('pull_request')
-            row = f"|{repo}|[#{pr}]({data.get('url')})|{data.get('branch')}|{data.get('user')}|{days}|\n"
-            rows += row
-    final = header + rows
-
-    #: Make sure target replacement tags are put back for next update
-    result = f'<!-- PR Start -->\n{final}\n<!-- PR End -->'
-    final_content = re.sub(
-        '<!-- PR Start -->.*?<!-- PR End -->', result, file.decoded_content.decode('utf-8'), flags=re.DOTALL
-    )
-    meta_repo.update_file(
-        path=readme, message='Pull request section updated in README', content=final_content, sha=file.sha
-    )
+
+    #: Events carry a patch for their row, empty trigger (i.e. - `sync`) falls back to full rescan of table
+    message = json.loads(event['Records'][0]['Sns']['Message'])
+    return readme.coalesce(section='pull_requests', message=message, render=_render_readme, context=context)
+
+
+def _fetch_pull_requests(cursor: Optional[str]) -> Iterator[Tuple[Dict[str, List[Dict]], str]]:
+    """
+    Fetch open pull requests of organization repositories in chunks using the configured sync engine.
+
+    :param cursor: cursor of the last processed chunk, `None` to start from the first repository
+    :returns: iterator of chunks - pull request data objects by repository - paired with the chunk cursor
+    """
+    if hub.SYNC_ENGINE == 'graphql':
+        #: Bulk queries fetch many repositories per request
+        for page, after in hub.get_org_pages(org=ORGANIZATION, connections=['pullRequests'], after=cursor):
+            yield {data.get('repository'): data.get('pull_requests') for data in page}, after
+    else:
+        #: Repositories of a chunk are fetched concurrently
+        def fetch(repo: 'Repository') -> Tuple[str, List[Dict]]:
+            return repo.full_name, _get_repository_pull_requests(repo=repo)
+
+        for repos, last in checkpoint.repository_chunks(org=ORGANIZATION, cursor=cursor):
+            yield dict(hub.map_repos(func=fetch, repos=repos)), last
 
 
 @tracer.capture_lambda_handler
 @logger.inject_lambda_context
-def sync(event: Dict, _c: Dict) -> Dict:
+@metrics.log_metrics
+@profiling.profile
+@hub.GOVERNOR.prioritize(Priority.bulk)
+def sync(event: Dict, context: Dict) -> Dict:
     """
     Lambda function to sync all repository pull requests.
 
+    Repositories are synced in chunks from a persisted cursor, a run continues in a new invocation when time runs low.
+
     :param event: lambda expected event object
-    :param _c: lambda expected context object (unused)
-    :returns: none
+    :param context: lambda expected context object
+    :returns: report of how far the sync run got
     """
     logger.info({'operation': 'sync'})
-    #: Purge table first before re-populating
-    dynamodb.delete_all_items(key_ids=['repository', 'pull_request'], table=PR_TABLE)
-
-    for repo in hub.get_github_repos(org=ORGANIZATION):
-        #: Extract data and update DynamoDB table
-        for data in _get_repository_pull_requests(repo=repo):
-            _update_pull_request_table(action='sync', data=data)
-
-    #: No message payload, just triggering update to versions section of README
-    sns.emit_sns_msg(message={})
+    table = checkpoint.RepositoryTable(table=PR_TABLE, key_ids=['repository', 'pull_request'])
+
+    def process(chunk: Dict[str, List[Dict]]) -> Dict[str, int]:
+        #: Results of a chunk stream into table reconciliation (only changes are written)
+        items = (_pull_request_item(data=data) for prs in chunk.values() for data in prs)
+        return table.reconcile(items=items, repositories=chunk)
+
+    def finish() -> Dict[str, int]:
+        counts = table.prune(repositories={repo.full_name for repo in hub.get_github_repos(org=ORGANIZATION)})
+        #: No message payload, periodic trigger to fully re-render pull request section of README
+        sns.emit_sns_msg(message={})
+        return counts
+
+    report = checkpoint.run(
+        name='pull_requests',
+        event=event,
+        context=context,
+        source=hub.SYNC_ENGINE,
+        chunks=_fetch_pull_requests,
+        process=process,
+        finish=finish,
+    )
+    logger.info({'operation': 'sync', **report, 'cache': hub.cache_stats(), 'rate_limit': hub.GOVERNOR.stats()})
+    return report
@@ -0,0 +1,269 @@
+# -*- coding: utf-8 -*-
+"""
+    Rate Limit
+    ----------
+
+    Module contains the governor shared by GitHub API calls; it tracks the remaining rate limit budget,
+    adapts request concurrency to it and backs off whenever GitHub asks it to
+
+"""
+
+from aws_lambda_powertools.logging import Logger
+
+import contextlib
+import functools
+import os
+import random
+import threading
+import time
+from enum import Enum
+from typing import TYPE_CHECKING, Any, Callable, Dict, Iterator, Optional, TypeVar
+
+if TYPE_CHECKING:
+    import requests
+
+#: Fraction of each rate limit window that bulk (scheduled) work leaves untouched for webhook driven work
+RATE_LIMIT_RESERVE = float(os.environ.get('RATE_LIMIT_RESERVE', '0.2'))
+#: Maximum seconds a request waits for budget or a `Retry-After` before giving up
+RATE_LIMIT_MAX_WAIT = int(os.environ.get('RATE_LIMIT_MAX_WAIT', '60'))
+#: Attempts made per request when GitHub responds with a rate limit error
+RATE_LIMIT_ATTEMPTS = int(os.environ.get('RATE_LIMIT_ATTEMPTS', '5'))
+#: Upper bound of concurrent GitHub requests
+MAX_CONCURRENCY = int(os.environ.get('SYNC_CONCURRENCY', '16'))
+#: Base seconds of the exponential (full jitter) backoff applied to secondary rate limits
+BACKOFF_BASE = 1.0
+#: Number of requests in between budget telemetry records
+TELEMETRY_INTERVAL = 100
+
+logger = Logger()
+
+T = TypeVar('T')
+
+
+class Priority(Enum):
+    """Collection of work priorities, bulk work yields rate limit budget to webhook driven work"""
+
+    webhook = 'webhook'
+    bulk = 'bulk'
+
+
+class RateLimitExceeded(Exception):
+    """Rate limit budget is exhausted for longer than the caller is allowed to wait"""
+
+
+class Governor:
+    """
+    Gate for GitHub API requests.
+
+    Budget (`X-RateLimit-*` headers) is tracked per rate limit resource. Concurrency shrinks in proportion to the
+    budget left for the current priority and is halved on secondary rate limits, then recovers additively as
+    requests succeed. Priority is per thread, so concurrent invocations (i.e. - `lambdas/local.py`) and warm
+    containers never inherit the priority of other work; worker threads take it from their caller through `bind`.
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int = MAX_CONCURRENCY,
+        reserve: float = RATE_LIMIT_RESERVE,
+        max_wait: int = RATE_LIMIT_MAX_WAIT,
+        attempts: int = RATE_LIMIT_ATTEMPTS,
+        sleep: Callable[[float], None] = time.sleep,
+    ):
+        self.max_concurrency = max_concurrency
+        self.reserve = reserve
+        self.max_wait = max_wait
+        self.attempts = attempts
+        self._sleep = sleep
+        self._ceiling = float(max_concurrency)
+        self._in_flight = 0
+        self._budgets: Dict[str, Dict[str, int]] = {}
+        self._stats = {'requests': 0, 'throttled': 0, 'retries': 0, 'waited': 0.0}
+        self._cond = threading.Condition()
+        self._local = threading.local()
+
+    @property
+    def priority(self) -> Priority:
+        """Priority of work on the current thread, webhook unless set by `prioritize`"""
+        return getattr(self._local, 'priority', Priority.webhook)
+
+    @contextlib.contextmanager
+    def prioritize(self, priority: Priority) -> Iterator[None]:
+        """
+        Run enclosed work (or decorated function) at `priority`.
+
+        :param priority: work priority
+        :returns: context manager
+        """
+        previous, self._local.priority = self.priority, priority
+        try:
+            yield
+        finally:
+            self._local.priority = previous
+
+    def bind(self, func: Callable[..., T]) -> Callable[..., T]:
+        """
+        Bind `func` to the priority of the calling thread, for work handed over to worker threads.
+
+        :param func: function to run at the current priority
+        :returns: wrapped function
+        """
+        priority = self.priority
+
+        @functools.wraps(func)
+        def bound(*args: Any, **kwargs: Any) -> T:
+            with self.prioritize(priority):
+                return func(*args, **kwargs)
+
+        return bound
+
+    def _floor(self, budget: Dict[str, int]) -> int:
+        """Budget that must remain untouched at the current priority"""
+        return int(budget['limit'] * self.reserve) if self.priority is Priority.bulk else 0
+
+    @property
+    def concurrency(self) -> int:
+        """Number of requests currently allowed in flight"""
+        limit = self._ceiling
+        for budget in self._budgets.values():
+            usable = budget['limit'] - self._floor(budget)
+            if usable > 0:
+                limit = min(limit, self.max_concurrency * (budget['remaining'] - self._floor(budget)) / usable)
+        return max(1, int(limit))
+
+    def _wait_for_budget(self, resource: str):
+        """Block until `resource` has budget left at the current priority, raises when the wait is too long"""
+        with self._cond:
+            budget = self._budgets.get(resource)
+            if not budget or budget['remaining'] > self._floor(budget):
+                return
+            delay = budget['reset'] - time.time() + 1
+        if delay > self.max_wait:
+            raise RateLimitExceeded(
+                f'GitHub {resource} rate limit exhausted for {self.priority.value} work, resets in {int(delay)}s'
+            )
+        self._wait(delay=delay, reason='budget')
+        with self._cond:
+            #: Window has reset, assume full budget until the next response says otherwise
+            self._budgets.pop(resource, None)
+
+    def _wait(self, delay: float, reason: str):
+        """Sleep for `delay` seconds, recording telemetry"""
+        with self._cond:
+            self._stats['throttled'] += 1
+            self._stats['waited'] += max(0.0, delay)
+        logger.info({'operation': 'rate_limit', 'message': f'Throttled ({reason})', 'delay': round(delay, 2)})
+        self._sleep(max(0.0, delay))
+
+    @contextlib.contextmanager
+    def _slot(self) -> Iterator[None]:
+        """Hold one of the currently allowed concurrent request slots"""
+        with self._cond:
+            self._cond.wait_for(lambda: self._in_flight < self.concurrency)
+            self._in_flight += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._in_flight -= 1
+                self._cond.notify_all()
+
+    def _observe(self, response: 'requests.Response', resource: str):
+        """Record budget reported by `response` headers"""
+        headers = response.headers
+        if 'X-RateLimit-Remaining' not in headers:
+            return
+        with self._cond:
+            self._budgets[headers.get('X-RateLimit-Resource', resource)] = {
+                'limit': int(headers.get('X-RateLimit-Limit', 0)),
+                'remaining': int(headers['X-RateLimit-Remaining']),
+                'reset': int(headers.get('X-RateLimit-Reset', 0)),
+            }
+            self._stats['requests'] += 1
+            report = self._stats['requests'] % TELEMETRY_INTERVAL == 1
+            self._cond.notify_all()
+        if report:
+            logger.info({'operation': 'rate_limit', **self.stats()})
+
+    def _retry_delay(self, response: 'requests.Response', attempt: int) -> Optional[float]:
+        """
+        Seconds to wait before retrying `response`, `None` when it is not a rate limit error.
+
+        :param response: GitHub API response
+        :param attempt: attempt number of the request
+        :returns: seconds to wait or `None`
+        """
+        if response.status_code not in (403, 429):
+            return None
+        headers = response.headers
+        retry_after = headers.get('Retry-After')
+        if headers.get('X-RateLimit-Remaining') == '0' and retry_after is None:
+            #: Primary rate limit, budget returns once the window resets
+            return int(headers.get('X-RateLimit-Reset', 0)) - time.time() + 1
+        if response.status_code == 403 and retry_after is None:
+            #: Permission error, rate limit errors always carry an exhausted budget or `Retry-After`
+            return None
+
+        #: Secondary rate limit, slow down for everyone and retry with jitter
+        with self._cond:
+            self._ceiling = max(1.0, self._ceiling / 2)
+        backoff = random.uniform(0, BACKOFF_BASE * 2 ** attempt)
+        return int(retry_after) + backoff if retry_after and retry_after.isdigit() else backoff
+
+    def request(self, send: Callable[[], 'requests.Response'], resource: str = 'core') -> 'requests.Response':
+        """
+        Send a GitHub API request through the governor.
+
+        :param send: function sending the request and returning its response
+        :param resource: rate limit resource consumed by the request, i.e. - `core`, `graphql`
+        :returns: final response, which may still be a rate limit error once attempts or wait time run out
+        """
+        for attempt in range(1, self.attempts + 1):
+            self._wait_for_budget(resource=resource)
+            with self._slot():
+                response = send()
+            self._observe(response=response, resource=resource)
+
+            delay = self._retry_delay(response=response, attempt=attempt)
+            if delay is None:
+                with self._cond:
+                    self._ceiling = min(float(self.max_concurrency), self._ceiling + 1 / self._ceiling)
+                return response
+            if attempt == self.attempts or delay > self.max_wait:
+                break
+            with self._cond:
+                self._stats['retries'] += 1
+            self._wait(delay=delay, reason=f'status {response.status_code}')
+
+        logger.warning({'operation': 'rate_limit', 'message': 'Rate limited, giving up', **self.stats()})
+        return response
+
+    def stats(self) -> Dict:
+        """
+        Get rate limit telemetry.
+
+        :returns: current `priority`, `concurrency`, `budgets` per resource, and request/throttle counters
+        """
+        with self._cond:
+            return {
+                'priority': self.priority.value,
+                'concurrency': self.concurrency,
+                'budgets': {resource: dict(budget) for resource, budget in self._budgets.items()},
+                **self._stats,
+            }
+
+
+def github_retry():
+    """
+    Retry policy for PyGithub requests, which do not pass through the governor.
+
+    :returns: urllib3 retry honouring `Retry-After` on secondary rate limits
+    """
+    from urllib3.util.retry import Retry
+
+    return Retry(
+        total=RATE_LIMIT_ATTEMPTS,
+        backoff_factor=BACKOFF_BASE,
+        status_forcelist=(429,),
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
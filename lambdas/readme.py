@@ -0,0 +1,247 @@
+# -*- coding: utf-8 -*-
+"""
+    README
+    ------
+
+    Module contains shared functionality for coalescing and committing updates to the metadata repo README file
+
+"""
+
+from aws_lambda_powertools.logging import Logger
+from botocore.exceptions import ClientError
+
+import os
+import time
+from lambdas import dynamodb, hub, metrics, profiling, sns
+from typing import Callable, Dict, List, Optional
+
+#: DynamoDB table for watcher state (README triggers, locks, etc.)
+STATE_TABLE = os.environ.get('STATE_TABLE')
+#: Name of repository where metadata will be displayed
+METADATA_REPO = os.environ.get('GITHUB_METADATA_REPO')
+#: Seconds to wait for additional triggers before rendering and committing
+COALESCE_WINDOW = int(os.environ.get('README_COALESCE_WINDOW', '10'))
+#: Seconds before a render lock is considered abandoned; must exceed the update readme lambda timeout
+LOCK_TTL = int(os.environ.get('README_LOCK_TTL', '90'))
+#: Seconds reserved to render and commit once a coalescing window has elapsed
+RENDER_BUDGET = 20
+#: Attempts made to commit when README was modified outside of watcher (stale `sha`)
+COMMIT_ATTEMPTS = 3
+
+README = 'README.md'
+
+logger = Logger()
+
+
+def _key(section: str) -> Dict:
+    """State table key for README `section`"""
+    return {'id': f'readme#{section}'}
+
+
+def _record_trigger(section: str, patch: Optional[Dict]):
+    """
+    Mark README `section` as dirty, queueing `patch` for the next render.
+
+    :param section: README section name
+    :param patch: section specific patch to apply, `None` requests a full re-render
+    :returns: None
+    """
+    names = {'#pending': 'pending', '#patches': 'patches', '#rescan': 'rescan'}
+    if patch is None:
+        expression = 'ADD #pending :one SET #rescan = :true'
+        values = {':one': 1, ':true': True}
+    else:
+        expression = 'ADD #pending :one SET #patches = list_append(if_not_exists(#patches, :empty), :patch)'
+        values = {':one': 1, ':empty': [], ':patch': [patch]}
+    try:
+        dynamodb.update_item(
+            key=_key(section),
+            expression=expression,
+            attr_values=values,
+            table=STATE_TABLE,
+            ExpressionAttributeNames={k: v for k, v in names.items() if k in expression},
+            ReturnValues='NONE',
+        )
+    except ClientError as err:
+        if patch is None or err.response['Error']['Code'] != 'ValidationException':
+            raise
+        #: Queued patches exceeded item size limit, collapse queue into a full re-render
+        _record_trigger(section=section, patch=None)
+        dynamodb.update_item(
+            key=_key(section),
+            expression='SET #patches = :empty',
+            attr_values={':empty': []},
+            table=STATE_TABLE,
+            ExpressionAttributeNames={'#patches': 'patches'},
+            ReturnValues='NONE',
+        )
+
+
+def _acquire(section: str, owner: str) -> bool:
+    """
+    Acquire render lock for README `section`.
+
+    :param section: README section name
+    :param owner: unique id of lock owner (lambda request id)
+    :returns: boolean depicting whether lock was acquired
+    """
+    now = int(time.time())
+    try:
+        dynamodb.update_item(
+            key=_key(section),
+            expression='SET #owner = :owner, #expires = :expires',
+            attr_values={':owner': owner, ':expires': now + LOCK_TTL, ':now': now},
+            table=STATE_TABLE,
+            ConditionExpression='attribute_not_exists(#owner) OR #expires < :now',
+            ExpressionAttributeNames={'#owner': 'lock_owner', '#expires': 'lock_expires'},
+            ReturnValues='NONE',
+        )
+        return True
+    except ClientError as err:
+        if err.response['Error']['Code'] == 'ConditionalCheckFailedException':
+            return False
+        raise
+
+
+def _drain(section: str, owner: str) -> Dict:
+    """
+    Atomically take all queued triggers for README `section`, clearing the dirty flag.
+
+    :param section: README section name
+    :param owner: unique id of lock owner (lambda request id)
+    :returns: queued state - `pending` trigger count, `patches` and `rescan` flag
+    """
+    response = dynamodb.update_item(
+        key=_key(section),
+        expression='SET #pending = :zero, #patches = :empty, #rescan = :false',
+        attr_values={':zero': 0, ':empty': [], ':false': False, ':owner': owner},
+        table=STATE_TABLE,
+        ConditionExpression='#owner = :owner',
+        ExpressionAttributeNames={
+            '#pending': 'pending',
+            '#patches': 'patches',
+            '#rescan': 'rescan',
+            '#owner': 'lock_owner',
+        },
+        ReturnValues='ALL_OLD',
+    )
+    return dynamodb.replace_decimals(response.get('Attributes', {}))
+
+
+def _release(section: str, owner: str, force: bool = False) -> bool:
+    """
+    Release render lock for README `section` provided no triggers arrived since last drain.
+
+    :param section: README section name
+    :param owner: unique id of lock owner (lambda request id)
+    :param force: release lock regardless of pending triggers
+    :returns: boolean depicting whether lock was released
+    """
+    condition = '#owner = :owner' if force else '#owner = :owner AND #pending = :zero'
+    values = {':owner': owner} if force else {':owner': owner, ':zero': 0}
+    names = {'#owner': 'lock_owner', '#expires': 'lock_expires'}
+    if not force:
+        names['#pending'] = 'pending'
+    try:
+        dynamodb.update_item(
+            key=_key(section),
+            expression='REMOVE #owner, #expires',
+            attr_values=values,
+            table=STATE_TABLE,
+            ConditionExpression=condition,
+            ExpressionAttributeNames=names,
+            ReturnValues='NONE',
+        )
+        return True
+    except ClientError as err:
+        if err.response['Error']['Code'] == 'ConditionalCheckFailedException':
+            return False
+        raise
+
+
+def commit(apply: Callable[[str], str], message: str) -> int:
+    """
+    Apply a content transformation to the metadata repo README and commit the result.
+
+    :param apply: function receiving current README content and returning updated content
+    :param message: commit message
+    :returns: number of bytes written, zero when content is unchanged
+    """
+    from github import GithubException
+
+    meta_repo = hub.get_github_repo(METADATA_REPO)
+    for attempt in range(1, COMMIT_ATTEMPTS + 1):
+        with profiling.span('get_contents'):
+            file = meta_repo.get_contents(README)
+        content = file.decoded_content.decode('utf-8')
+        final_content = apply(content)
+        if final_content == content:
+            logger.info({'operation': 'commit', 'message': f'{message} - unchanged'})
+            return 0
+        try:
+            with profiling.span('update_file'):
+                meta_repo.update_file(path=README, message=message, content=final_content, sha=file.sha)
+            written = len(final_content.encode('utf-8'))
+            metrics.add(name='ReadmeBytesWritten', value=written)
+            return written
+        except GithubException as err:
+            #: README modified outside of watcher in between read and write, re-read and re-apply
+            if err.status != 409 or attempt == COMMIT_ATTEMPTS:
+                raise
+            logger.info({'operation': 'commit', 'message': 'Stale README sha, retrying', 'attempt': attempt})
+    return 0
+
+
+def coalesce(
+    section: str, message: Dict, render: Callable[[List[Dict], bool], int], context, window: int = COALESCE_WINDOW
+) -> Dict:
+    """
+    Coalesce README update triggers so that only a single invocation renders and commits at a time.
+
+    Every trigger is recorded against the section (marking it dirty) before attempting to take the render lock.
+    Invocations that fail to take the lock return immediately since the lock owner absorbs their trigger. The
+    owner renders all triggers queued within `window` and keeps going until the dirty flag stays cleared.
+
+    :param section: README section name
+    :param message: SNS message received - `{'readme': patch}`, `{}` for a full render, `{'continue': True}` to resume
+    :param render: function receiving queued patches and full re-render flag, renders and commits section
+        returning the number of bytes written
+    :param context: lambda context object
+    :param window: seconds to wait for additional triggers before rendering
+    :returns: number of `triggers` absorbed and `commits` made by this invocation
+    """
+    if not message.get('continue'):
+        _record_trigger(section=section, patch=message.get('readme'))
+
+    owner = context.aws_request_id
+    if not _acquire(section=section, owner=owner):
+        logger.info({'operation': 'coalesce', 'section': section, 'message': 'Trigger absorbed by lock owner'})
+        return {'triggers': 0, 'commits': 0}
+
+    triggers, commits = 0, 0
+    while True:
+        if context.get_remaining_time_in_millis() < (window + RENDER_BUDGET) * 1000:
+            #: Out of time, hand remaining triggers over to a fresh invocation
+            _release(section=section, owner=owner, force=True)
+            sns.emit_sns_msg(message={'continue': True})
+            break
+
+        time.sleep(window)
+        state = _drain(section=section, owner=owner)
+        pending = state.get('pending', 0)
+        if pending:
+            try:
+                written = render(state.get('patches', []), state.get('rescan', False))
+            except Exception:
+                #: Nothing is lost - queue full re-render for the next trigger and free up the lock
+                _record_trigger(section=section, patch=None)
+                _release(section=section, owner=owner, force=True)
+                raise
+            triggers += pending
+            commits += 1 if written else 0
+
+        if _release(section=section, owner=owner):
+            break
+
+    logger.info({'operation': 'coalesce', 'section': section, 'triggers': triggers, 'commits': commits})
+    return {'triggers': triggers, 'commits': commits}
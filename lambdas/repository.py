@@ -9,83 +9,197 @@
 
 from aws_lambda_powertools.logging import Logger
 from aws_lambda_powertools.tracing import Tracer
-from github.Repository import Repository
 
-import functools
-import json
 import os
-import yaml
-from itertools import filterfalse
-from lambdas import hub, sns
+from concurrent.futures import ThreadPoolExecutor
+from lambdas import checkpoint, dynamodb, hub, idempotency, metrics, profiling, sns
+from lambdas.config import get_config, get_fingerprint
 from lambdas.hub import GithubEvent
-from typing import Dict
+from lambdas.ratelimit import Priority
+from typing import TYPE_CHECKING, Dict, List, Optional
+from urllib.parse import quote
+
+if TYPE_CHECKING:
+    from github.Repository import Repository
 
 #: GitHub Organization to collect data from
 ORGANIZATION = os.environ.get('GITHUB_ORGANIZATION')
+#: DynamoDB table for watcher state, holds the config fingerprint last applied to each repository
+STATE_TABLE = os.environ.get('STATE_TABLE')
+#: Maximum number of label changes applied to a repository concurrently
+LABEL_CONCURRENCY = 4
+#: Repository settings synced from config, compared against the repository API representation
+REPO_SETTINGS = (
+    'has_issues',
+    'has_projects',
+    'has_wiki',
+    'allow_squash_merge',
+    'allow_merge_commit',
+    'allow_rebase_merge',
+    'delete_branch_on_merge',
+)
 
 #: Tracing via X-Ray
 tracer = Tracer()
 logger = Logger()
 
 
-@functools.lru_cache()
-def _load_config(repo: str) -> Dict:
-    """
-    Load GitHub configuration from `config.yml` file.
-
-    :returns: GitHub configuration
-    """
-    with open('lambdas/config.yml', 'r') as f:
-        config = yaml.load(f, Loader=yaml.FullLoader)
-    try:
-        #: Attempt to update using repo overrides in config
-        config['default'].update(config[repo])
-    except KeyError:
-        pass
-    return config['default']
+def _drift(current: Dict, desired: Dict) -> Dict:
+    """Settings in `desired` (unset values ignored) that differ from `current`, with both values"""
+    return {
+        key: {'from': current.get(key), 'to': value}
+        for key, value in desired.items()
+        if value is not None and current.get(key) != value
+    }
 
 
-def _repo_settings_sync(repo: Repository):
+def _repo_settings_sync(repo: 'Repository') -> Dict:
     """
     Sync repository settings to settings in config file.
+        Note: current settings are read first and only drifted settings are written
 
     :param repo: Github repository object to sync settings
-    :returns: None
+    :returns: drifted settings per area - `repository`, `security` and `protection`
     """
-    config = _load_config(repo=repo.name)
+    config = get_config(repo=repo.name)
     default_branch = config.get('default_branch', {})
     default_branch_name = default_branch.get('name')
+    path = f'repos/{repo.full_name}'
 
-    repo.edit(
-        has_issues=config.get('has_issues'),
-        has_projects=config.get('has_projects'),
-        has_wiki=config.get('has_wiki'),
-        default_branch=default_branch_name,
-        allow_squash_merge=config.get('allow_squash_merge'),
-        allow_merge_commit=config.get('allow_merge_commit'),
-        allow_rebase_merge=config.get('allow_rebase_merge'),
-        delete_branch_on_merge=config.get('delete_branch_on_merge'),
-    )
+    #: Read current state
+    with profiling.span('get_repo_settings'):
+        settings = hub.get_json(path=path)
+        fixes = hub.get_json_if_exists(path=f'{path}/automated-security-fixes')
+        alerts = hub.get_json_if_exists(path=f'{path}/vulnerability-alerts')
+        protection = hub.get_json_if_exists(path=f'{path}/branches/{quote(default_branch_name, safe="")}/protection')
+    security = {
+        'enable_vulnerability_alert': alerts is not None,
+        'enable_automated_security_fixes': bool(fixes is not None and fixes.get('enabled', True)),
+    }
+    reviews = (protection or {}).get('required_pull_request_reviews', {})
+
+    drift = {
+        'repository': _drift(
+            current=settings,
+            desired={
+                **{key: config.get(key) for key in REPO_SETTINGS},
+                'default_branch': default_branch_name,
+            },
+        ),
+        'security': _drift(current=security, desired={key: bool(config.get(key)) for key in security}),
+        'protection': _drift(
+            current={
+                'protected': protection is not None,
+                'require_code_owner_reviews': reviews.get('require_code_owner_reviews'),
+                'required_approving_review_count': reviews.get('required_approving_review_count'),
+            },
+            desired={
+                'protected': True,
+                'require_code_owner_reviews': default_branch.get('require_code_owner_reviews'),
+                'required_approving_review_count': default_branch.get('required_approving_review_count'),
+            },
+        ),
+    }
+    logger.info({'operation': 'settings_sync', 'repository': repo.full_name, 'drift': drift})
+
+    #: Write only what has drifted
+    if drift['repository']:
+        repo.edit(**{key: change['to'] for key, change in drift['repository'].items()})
     #: Vulnerability alerting and remediation
-    if config.get('enable_vulnerability_alert'):
-        repo.enable_vulnerability_alert()
-    else:
-        repo.disable_vulnerability_alert()
-    if config.get('enable_automated_security_fixes'):
-        repo.enable_automated_security_fixes()
-    else:
-        repo.disable_automated_security_fixes()
+    if 'enable_vulnerability_alert' in drift['security']:
+        if config.get('enable_vulnerability_alert'):
+            repo.enable_vulnerability_alert()
+        else:
+            repo.disable_vulnerability_alert()
+    if 'enable_automated_security_fixes' in drift['security']:
+        if config.get('enable_automated_security_fixes'):
+            repo.enable_automated_security_fixes()
+        else:
+            repo.disable_automated_security_fixes()
 
     #: Set branch protection on default branch
-    branch = repo.get_branch(branch=default_branch_name)
-    branch.edit_protection(
-        require_code_owner_reviews=default_branch.get('require_code_owner_reviews'),
-        required_approving_review_count=default_branch.get('required_approving_review_count'),
-    )
+    if drift['protection']:
+        branch = repo.get_branch(branch=default_branch_name)
+        branch.edit_protection(
+            require_code_owner_reviews=default_branch.get('require_code_owner_reviews'),
+            required_approving_review_count=default_branch.get('required_approving_review_count'),
+        )
+
+    if any(drift.values()):
+        hub.invalidate_repo(full_name=repo.full_name)
+    return drift
+
+
+def _is_applied(full_name: str, fingerprint: str, updated_at: Optional[str]) -> bool:
+    """
+    Check whether config with `fingerprint` was already applied to the repository as last updated at `updated_at`.
+
+    :param full_name: full name of GitHub repository
+    :param fingerprint: hash of effective config
+    :param updated_at: repository `updated_at` timestamp
+    :returns: boolean depicting whether repository can be skipped
+    """
+    if not (STATE_TABLE and updated_at):
+        return False
+    try:
+        item = dynamodb.get_item(key={'id': f'fingerprint#{full_name}'}, table=STATE_TABLE)
+    except KeyError:
+        return False
+    return item.get('config') == fingerprint and item.get('updated_at') == updated_at
+
+
+def _record_applied(full_name: str, fingerprint: str, updated_at: Optional[str]):
+    """
+    Record config with `fingerprint` as applied to the repository as last updated at `updated_at`.
+
+    :param full_name: full name of GitHub repository
+    :param fingerprint: hash of effective config
+    :param updated_at: repository `updated_at` timestamp
+    :returns: None
+    """
+    if STATE_TABLE and updated_at:
+        dynamodb.put_item(
+            item={'id': f'fingerprint#{full_name}', 'config': fingerprint, 'updated_at': updated_at},
+            table=STATE_TABLE,
+        )
+
+
+def _apply_update(msg: Dict):
+    """
+    Apply repository event, syncing repository settings unless config is known to be applied.
+
+    :param msg: repository event payload
+    :returns: None
+    """
+    if msg.get('action') != 'sync':
+        #: Repository changed on GitHub, drop cached objects (including its previous name when renamed)
+        full_name = msg.get('repository', {}).get('full_name', '')
+        previous = msg.get('changes', {}).get('repository', {}).get('name', {}).get('from')
+        for name in filter(None, [full_name, previous and f'{full_name.split("/")[0]}/{previous}']):
+            hub.invalidate_repo(full_name=name)
+
+    if msg.get('action') not in {'deleted', 'archived'}:
+        full_name = msg.get('repository', {}).get('full_name')
+        updated_at = msg.get('repository', {}).get('updated_at')
+        fingerprint = get_fingerprint(repo=full_name.split('/')[-1])
+        if not msg.get('force') and _is_applied(full_name=full_name, fingerprint=fingerprint, updated_at=updated_at):
+            logger.info({'operation': 'update', 'repository': full_name, 'message': 'Config already applied, skipped'})
+            return
+
+        #: Updates fanned out by `sync` are bulk work, leave budget for webhook driven updates
+        priority = Priority.bulk if msg.get('action') == 'sync' else Priority.webhook
+        with hub.GOVERNOR.prioritize(priority):
+            repo = hub.get_github_repo(repo=full_name)
+            drift = _repo_settings_sync(repo=repo)
+        #: Writes change `updated_at`, so the fingerprint is only recorded once a pass finds nothing drifted
+        if not any(drift.values()):
+            _record_applied(full_name=full_name, fingerprint=fingerprint, updated_at=updated_at)
 
 
 @tracer.capture_lambda_handler
-@loggerinject_lambda_context(log_event=True)
+@logger.inject_lambda_context(log_event=True)
+@metrics.log_metrics
+@profiling.profile
 def update(event: Dict, _c: Dict):
     """
     Lambda function that responds to repository events.
@@ -97,55 +211,156 @@ def update(event: Dict, _c: Dict):
     msg = sns.get_sns_msg(event=event, msg_key=GithubEvent.repository.value)
     logger.info({'operation': 'update', 'sns_payload': msg})
 
-    if msg.get('action') not in {'deleted', 'archived'}:
-        full_name = msg.get('repository', {}).get('full_name')
-        repo = hub.get_github_repo(repo=full_name)
-        _repo_settings_sync(repo=repo)
+    delivery_id = msg.get('X-GitHub-Delivery')
+    if not idempotency.claim(scope='repository_update', delivery_id=delivery_id):
+        return
+    try:
+        _apply_update(msg=msg)
+    except Exception:
+        #: Allow a retry or redelivery to apply the event
+        idempotency.release(scope='repository_update', delivery_id=delivery_id)
+        raise
+    idempotency.complete(scope='repository_update', delivery_id=delivery_id)
+
+
+def _log_fan_out(operation: str, results: List[Dict]):
+    """
+    Log fan-out publish results, raising when any message could not be published.
+
+    :param operation: name of fan-out operation
+    :param results: per message publish results
+    :returns: None
+    """
+    failed = sum(1 for result in results if 'error' in result)
+    logger.info({'operation': operation, 'published': len(results) - failed, 'failed': failed})
+    if failed:
+        raise RuntimeError(f'Failed to publish {failed} of {len(results)} {operation} messages')
 
 
 @tracer.capture_lambda_handler
-@loggerinject_lambda_context(log_event=True)
-def sync(event: Dict, _c: Dict) -> Dict:
+@logger.inject_lambda_context(log_event=True)
+@metrics.log_metrics
+@profiling.profile
+@hub.GOVERNOR.prioritize(Priority.bulk)
+def sync(event: Dict, context: Dict) -> Dict:
     """
     Lambda function to sync all repository's settings to config settings.
 
+    Repositories are fanned out in chunks from a persisted cursor, a run continues in a new invocation when time runs
+    low.
+
     :param event: lambda expected event object
-    :param _c: lambda expected context object (unused)
-    :returns: none
+    :param context: lambda expected context object
+    :returns: report of how far the sync run got
     """
     logger.info({'operation': 'sync'})
-    for repo in hub.get_github_repos(org=ORGANIZATION):
+
+    def message(repo: 'Repository') -> Dict:
         #: `sync` not a Github event but will trigger sync/update via `update()` lambda
-        sns.emit_sns_msg(
-            message={GithubEvent.repository.value: {'action': 'sync', 'repository': {'full_name': repo.full_name}}}
-        )
+        repository = {'full_name': repo.full_name, 'updated_at': repo.updated_at.strftime('%Y-%m-%dT%H:%M:%SZ')}
+        return {GithubEvent.repository.value: {'action': 'sync', 'repository': repository, 'force': event.get('force')}}
+
+    def process(repos: List['Repository']) -> Dict[str, int]:
+        results = sns.emit_sns_msgs(messages=(message(repo) for repo in repos))
+        _log_fan_out(operation='sync', results=results)
+        return {'published': len(results)}
+
+    return checkpoint.run(
+        name='repository',
+        event=event,
+        context=context,
+        source='rest',
+        chunks=lambda cursor: checkpoint.repository_chunks(org=ORGANIZATION, cursor=cursor),
+        process=process,
+        finish=dict,
+    )
+
 
+def _normalize_label(label: Dict) -> Dict:
+    """Comparable label - colors are case insensitive and a missing description is empty"""
+    return {
+        'name': label['name'],
+        'color': str(label.get('color') or '').lower(),
+        'description': label.get('description') or '',
+    }
 
-def _label_sync(repo: Repository):
+
+def _plan_labels(base_labels: List[Dict], repo_labels: List[Dict]) -> List[Dict]:
+    """
+    Plan the minimal set of label changes that make a repository's labels match config.
+        Note: labels are matched by case insensitive name, as on GitHub
+
+    :param base_labels: labels from config
+    :param repo_labels: labels currently on the repository
+    :returns: list of operations - `create`, `edit` (in place, `current` name may differ by case) and `delete`
+    """
+    current = {x['name'].casefold(): _normalize_label(x) for x in repo_labels}
+    desired = {x['name'].casefold(): _normalize_label(x) for x in base_labels}
+
+    plan = []
+    for key, label in desired.items():
+        existing = current.get(key)
+        if existing is None:
+            plan.append({'op': 'create', **label})
+        elif existing != label:
+            plan.append({'op': 'edit', 'current': existing['name'], **label})
+    plan.extend({'op': 'delete', **label} for key, label in current.items() if key not in desired)
+    return plan
+
+
+def _apply_label_op(full_name: str, op: Dict):
+    """
+    Apply a single planned label operation.
+
+    :param full_name: full name of GitHub repository
+    :param op: planned label operation
+    :returns: None
+    """
+    path = f'repos/{full_name}/labels'
+    fields = {'color': op['color'], 'description': op['description']}
+    if op['op'] == 'create':
+        hub.send_json(method='POST', path=path, payload={'name': op['name'], **fields})
+    elif op['op'] == 'edit':
+        payload = {'new_name': op['name'], **fields}
+        hub.send_json(method='PATCH', path=f'{path}/{quote(op["current"], safe="")}', payload=payload)
+    else:
+        hub.send_json(method='DELETE', path=f'{path}/{quote(op["name"], safe="")}')
+
+
+def _label_sync(repo: 'Repository', dry_run: bool = False) -> List[Dict]:
     """
     Sync labels to settings in config file.
 
     :param repo: Github repository object to sync labels
-    :returns: None
+    :param dry_run: only plan (and log) label changes without applying them
+    :returns: planned label operations
     """
-    config = _load_config(repo=repo.name)
-    base_labels = [x for x in config['labels']]
-    repo_labels = [{'name': x.name, 'color': x.color, 'description': x.description} for x in repo.get_labels()]
+    config = get_config(repo=repo.name)
+    with profiling.span('get_labels'):
+        repo_labels = hub.get_all_json(
+            path=f'repos/{repo.full_name}/labels', transform=lambda page: [_normalize_label(x) for x in page]
+        )
+
+    #: smart sync only changes that are necessary (create, edit in place or delete)
+    plan = _plan_labels(base_labels=config['labels'], repo_labels=repo_labels)
+    logger.info({'operation': 'label_sync', 'repository': repo.full_name, 'dry_run': dry_run, 'plan': plan})
+    if dry_run or not plan:
+        return plan
 
-    #: smart sync only changes that are necessary (add or delete)
-    for diff in list(filterfalse(lambda x: x in base_labels, repo_labels)) + list(
-        filterfalse(lambda x: x in repo_labels, base_labels)
-    ):
-        try:
-            repo.get_label(name=diff['name']).delete()
-        except Exception:
-            print(json.dumps(diff))
-        finally:
-            repo.create_label(name=diff['name'], color=diff['color'], description=diff['description'])
+    with ThreadPoolExecutor(max_workers=LABEL_CONCURRENCY) as executor:
+        futures = {executor.submit(hub.GOVERNOR.bind(_apply_label_op), repo.full_name, op): op for op in plan}
+    failed = [{**op, 'error': str(future.exception())} for future, op in futures.items() if future.exception()]
+    if failed:
+        logger.warning({'operation': 'label_sync', 'repository': repo.full_name, 'failed': failed})
+        raise RuntimeError(f'Failed to apply {len(failed)} of {len(plan)} label changes to {repo.full_name}')
+    return plan
 
 
 @tracer.capture_lambda_handler
-@loggerinject_lambda_context(log_event=True)
+@logger.inject_lambda_context(log_event=True)
+@metrics.log_metrics
+@profiling.profile
+@hub.GOVERNOR.prioritize(Priority.bulk)
 def update_labels(event: Dict, _c: Dict):
     """
     Lambda function to update repository labels to match config settings.
@@ -157,11 +372,14 @@ def update_labels(event: Dict, _c: Dict):
     logger.info({'operation': 'update_labels'})
     msg = sns.get_sns_msg(event=event, msg_key='label')
     repo = hub.get_github_repo(repo=msg.get('full_name'))
-    _label_sync(repo=repo)
+    _label_sync(repo=repo, dry_run=msg.get('dry_run', False))
 
 
 @tracer.capture_lambda_handler
-@loggerinject_lambda_context(log_event=True)
+@logger.inject_lambda_context(log_event=True)
+@metrics.log_metrics
+@profiling.profile
+@hub.GOVERNOR.prioritize(Priority.bulk)
 def sync_labels(event: Dict, _c: Dict) -> Dict:
     """
     Lambda function to sync all repository labels to config settings.
@@ -171,5 +389,10 @@ def sync_labels(event: Dict, _c: Dict) -> Dict:
     :returns: none
     """
     logger.info({'operation': 'sync_labels'})
-    for repo in hub.get_github_repos(org=ORGANIZATION):
-        sns.emit_sns_msg(message={'label': {'full_name': repo.full_name}})
+    results = sns.emit_sns_msgs(
+        messages=(
+            {'label': {'full_name': repo.full_name, 'dry_run': event.get('dry_run', False)}}
+            for repo in hub.get_github_repos(org=ORGANIZATION)
+        )
+    )
+    _log_fan_out(operation='sync_labels', results=results)
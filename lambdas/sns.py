@@ -7,39 +7,134 @@
 
 """
 
-import boto3
 from aws_lambda_powertools.logging import Logger
 from botocore.exceptions import ClientError
 
 import json
 import os
-from typing import Dict, Optional, Union
+from concurrent.futures import ThreadPoolExecutor
+from lambdas import claimcheck, clients, idempotency, metrics, profiling
+from typing import Any, Callable, Dict, Hashable, Iterable, Iterator, List, Optional, Tuple, Union
 
 #: Base SNS message topic ARN
 SNS_ARN_PREFIX = os.environ.get('SNS_ARN_PREFIX')
 
 #: SNS message topic ARN where messages should be published
 EMIT_MESSAGE_TOPIC = os.environ.get('EMIT_MESSAGE_TOPIC')
-REGION = os.environ.get('REGION', 'us-east-1')
-SNS_CLIENT = boto3.client('sns', region_name=REGION)
+#: Maximum number of `PublishBatch` calls in flight
+PUBLISH_CONCURRENCY = int(os.environ.get('PUBLISH_CONCURRENCY', '4'))
+#: `PublishBatch` limits - entries per call and total payload size
+BATCH_ENTRIES = 10
+BATCH_BYTES = 256 * 1024
 
 logger = Logger()
 
 
-def emit_sns_msg(message: Union[str, Dict], topic_arn: str = EMIT_MESSAGE_TOPIC, **kwargs):
+class SNSTransport:
+    """Message transport publishing to AWS SNS topics"""
+
+    @staticmethod
+    def emit_topic() -> Optional[str]:
+        """Topic ARN messages are published to when no topic is given - `EMIT_MESSAGE_TOPIC` of the function"""
+        return EMIT_MESSAGE_TOPIC
+
+    @staticmethod
+    def publish(message: str, topic_arn: str, **kwargs) -> str:
+        """Publish `message` to `topic_arn`, returning its message id"""
+        return clients.client('sns').publish(Message=message, TopicArn=topic_arn, **kwargs)['MessageId']
+
+    @staticmethod
+    def publish_batch(entries: List[Dict], topic_arn: str) -> Dict:
+        """Publish `PublishBatch` request `entries` to `topic_arn`, returning `Successful` and `Failed` entries"""
+        return clients.client('sns').publish_batch(TopicArn=topic_arn, PublishBatchRequestEntries=entries)
+
+
+#: Pluggable message transport, any object providing `emit_topic()`, `publish(...)` and `publish_batch(...)`;
+#: transports running functions in process also provide `invoke(function, event)`, used to continue checkpointed runs
+TRANSPORT: Any = SNSTransport()
+
+
+def emit_sns_msg(message: Union[str, Dict], topic_arn: Optional[str] = None, **kwargs):
     """
     Emit a message to a given SNS topic ARN.
 
     :param message: JSON serializable Python object
-    :param topic_arn: the topic arn to which to emit the message to
+    :param topic_arn: the topic arn to which to emit the message to, `EMIT_MESSAGE_TOPIC` when not provided
     :returns: None
     """
+    topic_arn = topic_arn or TRANSPORT.emit_topic()
     msg = message if isinstance(message, str) else json.dumps(message)
     try:
-        SNS_CLIENT.publish(Message=msg, TopicArn=topic_arn, **kwargs)
-    except ClientError as err:
+        TRANSPORT.publish(message=msg, topic_arn=topic_arn, **kwargs)
+    except ClientError:
         logger.exception(f'Unable to publish SNS message {message} to topic `{topic_arn}`')
         raise
+    metrics.add(name='SNSMessagesPublished')
+
+
+def _batches(messages: Iterable[str]) -> Iterator[List[Dict]]:
+    """Group serialized `messages` into `PublishBatch` entries, `Id` is the message index"""
+    batch: List[Dict] = []
+    size = 0
+    for index, msg in enumerate(messages):
+        length = len(msg.encode('utf-8'))
+        if batch and (len(batch) == BATCH_ENTRIES or size + length > BATCH_BYTES):
+            yield batch
+            batch, size = [], 0
+        batch.append({'Id': str(index), 'Message': msg})
+        size += length
+    if batch:
+        yield batch
+
+
+def _publish_batch(batch: List[Dict], topic_arn: str) -> List[Dict]:
+    """
+    Publish a batch of entries, retrying failed entries individually.
+
+    :param batch: `PublishBatch` request entries
+    :param topic_arn: the topic arn to which to emit the messages to
+    :returns: result per entry - `index` and either `message_id` or `error`
+    """
+    try:
+        with profiling.span('publish_batch'):
+            response = TRANSPORT.publish_batch(entries=batch, topic_arn=topic_arn)
+    except ClientError as err:
+        response = {'Failed': [{'Id': entry['Id'], 'Message': str(err)} for entry in batch]}
+
+    results = [{'index': int(ok['Id']), 'message_id': ok['MessageId']} for ok in response.get('Successful', [])]
+    entries = {entry['Id']: entry for entry in batch}
+    for failed in response.get('Failed', []):
+        entry = entries[failed['Id']]
+        try:
+            message_id = TRANSPORT.publish(message=entry['Message'], topic_arn=topic_arn)
+            results.append({'index': int(entry['Id']), 'message_id': message_id})
+        except ClientError as err:
+            results.append({'index': int(entry['Id']), 'error': str(err)})
+    metrics.add(name='SNSMessagesPublished', value=sum(1 for result in results if 'message_id' in result))
+    return results
+
+
+def emit_sns_msgs(
+    messages: Iterable[Union[str, Dict]], topic_arn: Optional[str] = None, concurrency: int = PUBLISH_CONCURRENCY
+) -> List[Dict]:
+    """
+    Emit many messages to a given SNS topic ARN using concurrent `PublishBatch` calls.
+
+    :param messages: JSON serializable Python objects
+    :param topic_arn: the topic arn to which to emit the messages to, `EMIT_MESSAGE_TOPIC` when not provided
+    :param concurrency: maximum number of concurrent `PublishBatch` calls
+    :returns: result per message, in order of `messages` - `index` and either `message_id` or `error`
+    """
+    topic_arn = topic_arn or TRANSPORT.emit_topic()
+    serialized = (msg if isinstance(msg, str) else json.dumps(msg) for msg in messages)
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = [executor.submit(_publish_batch, batch, topic_arn) for batch in _batches(serialized)]
+    results = sorted((result for future in futures for result in future.result()), key=lambda r: r['index'])
+
+    failed = [result for result in results if 'error' in result]
+    if failed:
+        logger.warning({'operation': 'emit_sns_msgs', 'topic': topic_arn, 'failed': failed})
+    return results
 
 
 def get_sns_msg(event: Dict, msg_key: str) -> Optional[Dict]:
@@ -50,9 +145,170 @@ def get_sns_msg(event: Dict, msg_key: str) -> Optional[Dict]:
     :returns: JSON serialized SNS message object
     """
 
-    event_msg = json.loads(event['Records'][0]['Sns']['Message'])
+    event_msg = claimcheck.resolve(message=json.loads(event['Records'][0]['Sns']['Message']))
     try:
         return event_msg[msg_key]
     except KeyError:
         logger.exception({'operation': 'get_sns_msg', 'event_message': event_msg})
         raise
+
+
+def _record_message(record: Dict) -> Tuple[str, Dict]:
+    """
+    Extract identifier and message object from an SNS record or an SQS record of an SNS subscription.
+        Note: claim checks are resolved to the message they stand in for
+
+    :param record: AWS event record
+    :returns: record identifier (used to report partial batch failures) and message object
+    """
+    if 'Sns' in record:
+        return record['Sns']['MessageId'], claimcheck.resolve(message=json.loads(record['Sns']['Message']))
+    message = json.loads(record['body'])
+    if 'TopicArn' in message and 'Message' in message:
+        #: SNS envelope, subscription without raw message delivery
+        message = json.loads(message['Message'])
+    return record['messageId'], claimcheck.resolve(message=message)
+
+
+def _settle(scope: Optional[str], deliveries: Dict[str, Optional[str]], record_ids: Iterable[str], completed: bool):
+    """
+    Complete or release the delivery claims of `record_ids`.
+
+    :param scope: name of the consumer, nothing is claimed when `None`
+    :param deliveries: delivery id by record identifier
+    :param record_ids: identifiers of claimed records
+    :param completed: whether records were processed, claims of failed records are released for redelivery
+    :returns: None
+    """
+    if not scope:
+        return
+    settle = idempotency.complete if completed else idempotency.release
+    for record_id in record_ids:
+        settle(scope=scope, delivery_id=deliveries[record_id])
+
+
+def _group_records(
+    records: List[Dict], msg_key: str, group: Callable[[Dict], Hashable], scope: Optional[str]
+) -> Tuple[Dict[Hashable, List[Tuple[str, Dict]]], Dict[str, Optional[str]], List[str], List[Exception]]:
+    """
+    Group message objects of `records`, dropping duplicate deliveries when `scope` is set.
+        Note: records of deliveries being processed by another invocation are failed, to be redelivered later
+
+    :param records: AWS event records
+    :param msg_key: key of message object within each record message
+    :param group: function returning the group key of a message object
+    :param scope: name of the consumer claiming each delivery, `None` to keep duplicates
+    :returns: record identifiers and message objects by group key, delivery id by record identifier, identifiers of
+        records that could not be read and their errors
+    """
+    groups: Dict[Hashable, List[Tuple[str, Dict]]] = {}
+    deliveries: Dict[str, Optional[str]] = {}
+    failures: List[str] = []
+    errors: List[Exception] = []
+    try:
+        for record in records:
+            try:
+                record_id, message = _record_message(record=record)
+                msg = message[msg_key]
+                if scope:
+                    deliveries[record_id] = msg.get('X-GitHub-Delivery') or record_id
+                    if not idempotency.claim(scope=scope, delivery_id=deliveries[record_id]):
+                        continue
+                groups.setdefault(group(msg), []).append((record_id, msg))
+            except (KeyError, ValueError, ClientError, idempotency.InProgress) as err:
+                logger.exception({'operation': 'process_records', 'record': record})
+                failures.append(record.get('messageId') or record.get('Sns', {}).get('MessageId'))
+                errors.append(err)
+    except BaseException:
+        claimed = [record_id for items in groups.values() for record_id, _ in items]
+        _settle(scope=scope, deliveries=deliveries, record_ids=claimed, completed=False)
+        raise
+    return groups, deliveries, failures, errors
+
+
+def _handle_groups(
+    groups: Dict[Hashable, List[Tuple[str, Dict]]],
+    handler: Callable[[Hashable, List[Dict]], None],
+    finish: Optional[Callable[[], Iterable[Hashable]]],
+) -> Dict[Hashable, Exception]:
+    """
+    Handle every group, then `finish` the groups handled.
+
+    :param groups: record identifiers and message objects by group key
+    :param handler: function receiving a group key and its message objects, in order received
+    :param finish: function called once every group has been handled, returning keys of groups that failed
+    :returns: error by key of each group that failed
+    """
+    failed: Dict[Hashable, Exception] = {}
+    for key, items in groups.items():
+        try:
+            handler(key, [message for _, message in items])
+        except Exception as err:
+            logger.exception({'operation': 'process_records', 'group': key, 'records': len(items)})
+            failed[key] = err
+    if not finish:
+        return failed
+
+    handled = [key for key in groups if key not in failed]
+    try:
+        for key in finish():
+            failed[key] = RuntimeError(f'Failed to finish group `{key}`')
+    except Exception as err:
+        logger.exception({'operation': 'process_records', 'groups': len(handled), 'message': 'Failed to finish'})
+        failed.update(dict.fromkeys(handled, err))
+    return failed
+
+
+def process_records(
+    event: Dict,
+    msg_key: str,
+    group: Callable[[Dict], Hashable],
+    handler: Callable[[Hashable, List[Dict]], None],
+    scope: Optional[str] = None,
+    finish: Optional[Callable[[], Iterable[Hashable]]] = None,
+) -> Dict:
+    """
+    Process every record of an AWS SNS or SQS event, messages sharing a `group` key are handled together.
+        Note: failed records of SQS events are reported for redelivery (partial batch failure), failures in SNS
+        events are raised once all groups have been attempted (and finished)
+
+    :param event: AWS event object
+    :param msg_key: key of message object within each record message
+    :param group: function returning the group key of a message object, i.e. - repository full name
+    :param handler: function receiving a group key and its message objects, in order received
+    :param scope: name of the consumer, when set duplicate deliveries (by `X-GitHub-Delivery`, else record
+        identifier) are dropped before being grouped; claims are completed once every group has been handled and
+        released for records that failed (or were not handled)
+    :param finish: function called once every group has been handled (i.e. - publishing results), returning keys of
+        groups that failed to finish; when it raises every handled group fails
+    :returns: partial batch response - `batchItemFailures` with identifiers of records to redeliver
+    """
+    records = event.get('Records', [])
+    groups, deliveries, failures, errors = _group_records(records=records, msg_key=msg_key, group=group, scope=scope)
+    #: Claimed records neither completed nor released yet
+    pending = [record_id for items in groups.values() for record_id, _ in items]
+
+    try:
+        failed = _handle_groups(groups=groups, handler=handler, finish=finish)
+        for key, items in groups.items():
+            record_ids = [record_id for record_id, _ in items]
+            if key in failed:
+                failures.extend(record_ids)
+                errors.append(failed[key])
+            #: Redelivered records must not be dropped as duplicates
+            _settle(scope=scope, deliveries=deliveries, record_ids=record_ids, completed=key not in failed)
+            pending = [record_id for record_id in pending if record_id not in record_ids]
+    finally:
+        _settle(scope=scope, deliveries=deliveries, record_ids=pending, completed=False)
+
+    logger.info(
+        {
+            'operation': 'process_records',
+            'records': len(records),
+            'groups': len(groups),
+            'idempotency': idempotency.stats(),
+        }
+    )
+    if errors and any('Sns' in record for record in records):
+        raise errors[0]
+    return {'batchItemFailures': [{'itemIdentifier': record_id} for record_id in failures]}
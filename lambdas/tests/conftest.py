@@ -1,44 +1,76 @@
 # -*- coding: utf-8 -*-
 
 import boto3
+import yaml
 
-import json
 import moto
 import os
+import pytest
+import re
 import sys
-from _pytest.monkeypatch import MonkeyPatch
-from typing import Dict
+from typing import Iterator
 
-sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+sys.path.insert(0, ROOT)
 
 REGION = 'us-east-1'
-SECRET_NAME = os.environ.get('SLACK_SECRET_NAME', 'slack-security-bot')
-SECRET_PAYLOAD = {
-    'client_id': 123,
-    'client_secret': 'xyz',
-    'signing_secret': 'abc',
-    'verification_token': 999,
-    'oauth_access_token': '123abc',
-    'bot_user_oauth_access_token': 'abc123',
-    'elevate_access_channel_webhook': 'http://127.0.0.1:9000',
+ACCOUNT_ID = '123456789012'
+SNS_ARN_PREFIX = f'arn:aws:sns:{REGION}:{ACCOUNT_ID}'
+#: Function environment under test, set before any `lambdas` module reads it
+ENVIRONMENT = {
+    'AWS_ACCESS_KEY_ID': 'testing',
+    'AWS_SECRET_ACCESS_KEY': 'testing',
+    'AWS_DEFAULT_REGION': REGION,
+    'REGION': REGION,
+    'SNS_ARN_PREFIX': SNS_ARN_PREFIX,
+    'EMIT_MESSAGE_TOPIC': f'{SNS_ARN_PREFIX}:Watcher-Emit',
+    'PULL_REQUEST_TABLE': 'watcher-pull-requests',
+    'VERSION_TABLE': 'watcher-versions',
+    'STATE_TABLE': 'watcher-state',
+    'GITHUB_ORGANIZATION': 'watcher-org',
+    'GITHUB_METADATA_REPO': 'watcher-org/metadata',
+    'POWERTOOLS_TRACE_DISABLED': 'true',
 }
+#: Topics published to by watcher functions
+TOPICS = ('Watcher-PullRequest', 'Watcher-Tag', 'Watcher-Repository', 'Watcher-Emit')
+PARAMETERS = {'/watcher/github_user_token': 'github-token', '/watcher/github_webhook_secret': 'webhook-secret'}
 
+for key, value in ENVIRONMENT.items():
+    os.environ.setdefault(key, value)
 
-def secret_client():
-    with moto.mock_secretsmanager():
-        session = boto3.session.Session(region_name=REGION)
-        return session.client(
-            service_name='secretsmanager', endpoint_url=f'https://secretsmanager.{REGION}.amazonaws.com'
+
+def create_resources():
+    """Create watcher tables (as defined in `serverless.yml`), topics and parameters within an active moto mock"""
+    with open(os.path.join(ROOT, 'serverless.yml'), 'r') as f:
+        resources = yaml.safe_load(f)['resources']['Resources']
+
+    dynamodb = boto3.client('dynamodb', region_name=REGION)
+    for resource in resources.values():
+        if resource['Type'] != 'AWS::DynamoDB::Table':
+            continue
+        props = resource['Properties']
+        table = os.environ[re.search(r'environment\.(\w+)', props['TableName']).group(1)]
+        dynamodb.create_table(
+            TableName=table,
+            BillingMode=props['BillingMode'],
+            AttributeDefinitions=props['AttributeDefinitions'],
+            KeySchema=props['KeySchema'],
         )
+        if 'TimeToLiveSpecification' in props:
+            dynamodb.update_time_to_live(TableName=table, TimeToLiveSpecification=props['TimeToLiveSpecification'])
 
+    sns = boto3.client('sns', region_name=REGION)
+    for topic in TOPICS:
+        sns.create_topic(Name=topic)
 
-def create_secret(name: str = SECRET_NAME, payload: Dict = SECRET_PAYLOAD):
-    with moto.mock_secretsmanager():
-        client = secret_client()
-        client.create_secret(Name=name, Description='My cool test secret', SecretString=json.dumps(payload))
+    ssm = boto3.client('ssm', region_name=REGION)
+    for name, value in PARAMETERS.items():
+        ssm.put_parameter(Name=name, Value=value, Type='SecureString')
 
 
-def pytest_generate_tests(metafunc):
-    monkeypatch = MonkeyPatch()
-    monkeypatch.setitem(os.environ, 'SLACK_SECRET_NAME', 'slack-security-bot')
-    create_secret()
+@pytest.fixture
+def aws() -> Iterator[None]:
+    """Mocked AWS account holding watcher resources"""
+    with moto.mock_aws():
+        create_resources()
+        yield
@@ -0,0 +1,216 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+from lambdas import checkpoint, clients, dynamodb, sns
+from lambdas.tests.conftest import ENVIRONMENT
+
+pytestmark = pytest.mark.usefixtures('aws')
+
+PR_TABLE = ENVIRONMENT['PULL_REQUEST_TABLE']
+PR_KEYS = ['repository', 'pull_request']
+
+
+class Context:
+    """Lambda context object with `remaining` seconds left"""
+
+    invoked_function_arn = 'arn:aws:lambda:us-east-1:123456789012:function:watcher-test'
+
+    def __init__(self, remaining: float = 900):
+        self.remaining = remaining
+
+    def get_remaining_time_in_millis(self) -> int:
+        return int(self.remaining * 1000)
+
+
+def _state(name: str = 'test') -> dict:
+    return dynamodb.get_item(key={'id': f'sync#{name}'}, table=ENVIRONMENT['STATE_TABLE'])
+
+
+def _chunks(names: list, size: int = 2):
+    def chunks(cursor):
+        remaining = [name for name in names if cursor is None or name > cursor]
+        for i in range(0, len(remaining), size):
+            yield remaining[i : i + size], remaining[i : i + size][-1]
+
+    return chunks
+
+
+def _run(event: dict, context: Context, processed: list, names: list = None, source: str = 'rest', **kwargs) -> dict:
+    return checkpoint.run(
+        name='test',
+        event=event,
+        context=context,
+        source=source,
+        chunks=_chunks(names or ['a', 'b', 'c', 'd', 'e']),
+        process=kwargs.get('process', lambda chunk: processed.extend(chunk) or {'synced': len(chunk)}),
+        finish=kwargs.get('finish', lambda: {'pruned': 0}),
+    )
+
+
+def test_claim_start_continue_and_superseded():
+    first, how = checkpoint.Checkpoint.claim(name='test', source='rest', resume=None)
+    assert how == 'started' and first.invocation == 1
+
+    #: Scheduled trigger while the run holds its lease
+    assert checkpoint.Checkpoint.claim(name='test', source='rest', resume=None) == (None, 'running')
+    #: Continuation of another run
+    assert checkpoint.Checkpoint.claim(name='test', source='rest', resume='other') == (None, 'superseded')
+
+    second, how = checkpoint.Checkpoint.claim(name='test', source='rest', resume=first.run)
+    assert how == 'continued' and second.run == first.run and second.invocation == 2
+
+
+def test_claim_resumes_after_lease_expires(monkeypatch):
+    first, _ = checkpoint.Checkpoint.claim(name='test', source='rest', resume=None)
+    first.advance(cursor='b', processed=2, counts={'synced': 2})
+
+    monkeypatch.setattr(checkpoint, 'SYNC_LEASE', -1)
+    resumed, how = checkpoint.Checkpoint.claim(name='test', source='rest', resume=None)
+    assert how == 'resumed'
+    assert (resumed.run, resumed.invocation, resumed.cursor, resumed.counts) == (first.run, 2, 'b', {'synced': 2})
+
+
+def test_claim_restarts_run_of_another_source():
+    first, _ = checkpoint.Checkpoint.claim(name='test', source='rest', resume=None)
+    first.advance(cursor='b', processed=2, counts={})
+
+    restarted, how = checkpoint.Checkpoint.claim(name='test', source='graphql', resume=None)
+    assert how == 'started'
+    assert restarted.run != first.run and restarted.cursor is None
+    assert checkpoint.Checkpoint.claim(name='test', source='rest', resume=first.run) == (None, 'superseded')
+
+
+def test_claim_race_supersedes_stale_invocation():
+    first, _ = checkpoint.Checkpoint.claim(name='test', source='rest', resume=None)
+    second, _ = checkpoint.Checkpoint.claim(name='test', source='rest', resume=first.run)
+    with pytest.raises(checkpoint.Superseded):
+        first.advance(cursor='b', processed=2, counts={})
+    second.advance(cursor='b', processed=2, counts={})
+    assert _state()['cursor'] == 'b'
+
+
+def test_run_completes_in_one_invocation():
+    processed = []
+    report = _run(event={}, context=Context(), processed=processed)
+    assert processed == ['a', 'b', 'c', 'd', 'e']
+    assert report['status'] == 'complete'
+    assert (report['processed'], report['synced'], report['pruned']) == (5, 5, 0)
+    assert _state()['status'] == 'complete'
+
+    #: Next trigger starts a new run
+    assert _run(event={}, context=Context(), processed=[])['run'] != report['run']
+
+
+def test_run_continues_across_invocations(monkeypatch):
+    invoked = []
+    monkeypatch.setattr(checkpoint, '_reinvoke', lambda event, context, run: invoked.append(run))
+    processed = []
+
+    report = _run(event={}, context=Context(remaining=1), processed=processed)
+    assert report['status'] == 'continuing' and invoked == [report['run']]
+    assert processed == ['a', 'b']
+
+    while report['status'] == 'continuing':
+        report = _run(event={'checkpoint': report['run']}, context=Context(remaining=1), processed=processed)
+    assert report['status'] == 'complete'
+    assert processed == ['a', 'b', 'c', 'd', 'e']
+    #: Time runs low after the last chunk as well, the run is completed by one more (empty) invocation
+    assert (report['invocation'], report['processed'], report['synced']) == (4, 5, 5)
+
+
+def test_run_failure_is_resumed_by_next_trigger():
+    processed = []
+
+    def process(chunk):
+        if 'c' in chunk:
+            raise RuntimeError('GitHub unavailable')
+        processed.extend(chunk)
+        return {'synced': len(chunk)}
+
+    with pytest.raises(RuntimeError):
+        _run(event={}, context=Context(), processed=processed, process=process)
+    assert (_state()['status'], _state()['cursor']) == ('failed', 'b')
+
+    #: Retry within the lease resumes from the cursor rather than being skipped as `running`
+    report = _run(event={}, context=Context(), processed=processed)
+    assert report['status'] == 'complete' and report['invocation'] == 2
+    assert processed == ['a', 'b', 'c', 'd', 'e']
+
+
+def test_run_superseded_mid_run():
+    def process(chunk):
+        #: Another invocation takes over the run
+        state = _state()
+        checkpoint.Checkpoint.claim(name='test', source='rest', resume=state['run'])
+        return {}
+
+    report = _run(event={}, context=Context(), processed=[], process=process)
+    assert report == {'sync': 'test', 'status': 'superseded'}
+
+
+def _pull_requests(repository: str, *numbers: int, title: str = 'x') -> list:
+    return [{'repository': repository, 'pull_request': number, 'title': title} for number in numbers]
+
+
+def _table() -> set:
+    return {(item['repository'], int(item['pull_request'])) for item in dynamodb.scan(table=PR_TABLE)}
+
+
+def test_repository_table_reconciles_chunks_and_prunes_across_invocations():
+    existing = _pull_requests('a', 1, 2) + _pull_requests('b', 1) + _pull_requests('stale', 1, 2)
+    dynamodb.reconcile(items=existing, key_ids=PR_KEYS, table=PR_TABLE)
+
+    #: Invocation one - `a` closed #2 and opened #3
+    table = checkpoint.RepositoryTable(table=PR_TABLE, key_ids=PR_KEYS)
+    counts = table.reconcile(items=_pull_requests('a', 1, 3), repositories=['a'])
+    assert counts == {'inserted': 1, 'updated': 0, 'deleted': 1, 'unchanged': 1}
+
+    #: Invocation two (fresh scan) - `b` changed #1 and `c` is new
+    table = checkpoint.RepositoryTable(table=PR_TABLE, key_ids=PR_KEYS)
+    items = _pull_requests('b', 1, title='y') + _pull_requests('c', 1)
+    counts = table.reconcile(items=items, repositories=['b', 'c'])
+    assert counts == {'inserted': 1, 'updated': 1, 'deleted': 0, 'unchanged': 0}
+
+    #: Repositories of earlier invocations are kept, those gone from the organization are deleted
+    counts = table.prune(repositories={'a', 'b', 'c'})
+    assert counts == {'inserted': 0, 'updated': 0, 'deleted': 2, 'unchanged': 0}
+    assert _table() == {('a', 1), ('a', 3), ('b', 1), ('c', 1)}
+
+
+class Transport:
+    """In process transport, recording the functions invoked"""
+
+    def __init__(self):
+        self.invoked = []
+
+    def invoke(self, function: str, event: dict):
+        self.invoked.append((function, event))
+
+
+def test_reinvoke_goes_through_in_process_transport(monkeypatch):
+    transport = Transport()
+    monkeypatch.setattr(sns, 'TRANSPORT', transport)
+    monkeypatch.setattr(clients, 'client', lambda service: pytest.fail('AWS Lambda invoked'))
+    context = Context()
+    context.function_name = 'pullRequestsSync'
+
+    checkpoint._reinvoke(event={'source': 'graphql'}, context=context, run='run-1')
+    assert transport.invoked == [('pullRequestsSync', {'source': 'graphql', 'checkpoint': 'run-1'})]
+
+
+def test_reinvoke_invokes_lambda_asynchronously(monkeypatch):
+    invoked = []
+
+    class Lambda:
+        def invoke(self, **kwargs):
+            invoked.append(kwargs)
+
+    monkeypatch.setattr(clients, 'client', lambda service: Lambda())
+    checkpoint._reinvoke(event={'source': 'graphql'}, context=Context(), run='run-1')
+    assert invoked == [
+        {
+            'FunctionName': Context.invoked_function_arn,
+            'InvocationType': 'Event',
+            'Payload': b'{"source": "graphql", "checkpoint": "run-1"}',
+        }
+    ]
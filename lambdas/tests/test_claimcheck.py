@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+
+import boto3
+import json
+import os
+import pytest
+from lambdas import claimcheck
+from lambdas.tests.conftest import REGION
+
+pytestmark = pytest.mark.usefixtures('aws')
+
+BUCKET = 'watcher-claim-check'
+
+
+@pytest.fixture
+def small(monkeypatch):
+    """Claim check threshold low enough to offload test messages"""
+    monkeypatch.setattr(claimcheck, 'CLAIM_CHECK_THRESHOLD', 64)
+    monkeypatch.setattr(claimcheck, 'CLAIM_CHECK_BUCKET', None)
+    monkeypatch.setattr(claimcheck, 'CLAIM_CHECK_DIR', None)
+
+
+def _message() -> dict:
+    #: Random content does not compress below the threshold
+    return {'pull_request': {'body': os.urandom(256).hex(), 'number': 1}}
+
+
+def test_project_keeps_requested_fields():
+    payload = {'action': 'opened', 'sender': {'login': 'x'}, 'repository': {'full_name': 'org/a', 'size': 1}}
+    fields = {'action': True, 'repository': {'full_name': True}, 'missing': True}
+    assert claimcheck.project(payload=payload, fields=fields) == {
+        'action': 'opened',
+        'repository': {'full_name': 'org/a'},
+    }
+
+
+def test_small_messages_are_sent_as_is():
+    message = {'tag': {'ref': 'v1.0.0'}}
+    checked = claimcheck.check(message=message)
+    assert json.loads(checked) == message
+    assert claimcheck.resolve(json.loads(checked)) == message
+
+
+@pytest.mark.usefixtures('small')
+def test_oversized_messages_round_trip_inline_without_store():
+    message = _message()
+    claim = json.loads(claimcheck.check(message=message))
+    assert 'data' in claim[claimcheck.CLAIM_KEY]
+    assert claimcheck.resolve(claim) == message
+
+
+@pytest.mark.usefixtures('small')
+def test_oversized_messages_round_trip_through_s3(monkeypatch):
+    boto3.client('s3', region_name=REGION).create_bucket(Bucket=BUCKET)
+    monkeypatch.setattr(claimcheck, 'CLAIM_CHECK_BUCKET', BUCKET)
+
+    message = _message()
+    claim = json.loads(claimcheck.check(message=message))
+    assert claim[claimcheck.CLAIM_KEY]['uri'].startswith(f's3://{BUCKET}/claim-check/')
+    assert claimcheck.resolve(claim) == message
+
+
+@pytest.mark.usefixtures('small')
+def test_oversized_messages_round_trip_through_directory(monkeypatch, tmp_path):
+    monkeypatch.setattr(claimcheck, 'CLAIM_CHECK_DIR', str(tmp_path))
+
+    message = _message()
+    claim = json.loads(claimcheck.check(message=message))
+    assert claim[claimcheck.CLAIM_KEY]['uri'].startswith(f'file://{tmp_path}')
+    assert claimcheck.resolve(claim) == message
+
+
+@pytest.mark.parametrize(
+    'uri', ['file:///etc/passwd', 'file://{dir}/../outside.json.zz', 's3://other-bucket/claim-check/x.json.zz']
+)
+def test_claim_checks_outside_the_store_are_rejected(monkeypatch, tmp_path, uri):
+    store = tmp_path / 'store'
+    store.mkdir()
+    (tmp_path / 'outside.json.zz').write_bytes(b'secret')
+    monkeypatch.setattr(claimcheck, 'CLAIM_CHECK_DIR', str(store))
+    monkeypatch.setattr(claimcheck, 'CLAIM_CHECK_BUCKET', BUCKET)
+
+    with pytest.raises(ValueError):
+        claimcheck.resolve({claimcheck.CLAIM_KEY: {'encoding': 'zlib', 'uri': uri.format(dir=store)}})
+
+
+def test_file_claim_checks_are_rejected_without_directory(monkeypatch, tmp_path):
+    monkeypatch.setattr(claimcheck, 'CLAIM_CHECK_DIR', None)
+    path = tmp_path / 'message.json.zz'
+    path.write_bytes(b'')
+    with pytest.raises(ValueError):
+        claimcheck.resolve({claimcheck.CLAIM_KEY: {'encoding': 'zlib', 'uri': f'file://{path}'}})
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+import re
+from lambdas.config import ConfigError, ConfigIndex, validate
+
+LABEL = {'name': 'bug', 'color': 'd73a4a'}
+
+
+def _config(**overrides: dict) -> dict:
+    return {
+        'default': {'has_wiki': False, 'has_issues': True, 'labels': [LABEL], 'default_branch': {'name': 'main'}},
+        **overrides,
+    }
+
+
+def test_first_matching_pattern_in_file_order_applies():
+    index = ConfigIndex(
+        config=_config(
+            **{
+                'terraform-aws-*': {'has_wiki': True},
+                're:^terraform-.+$': {'has_issues': False},
+                're:(?i)^infra-': {'has_issues': False},
+            }
+        )
+    )
+    assert (index.get('terraform-aws-vpc')['has_wiki'], index.get('terraform-aws-vpc')['has_issues']) == (True, True)
+    assert (index.get('terraform-gcp')['has_wiki'], index.get('terraform-gcp')['has_issues']) == (False, False)
+    assert index.get('other')['has_issues'] is True
+
+
+def test_inline_flags_and_backreferences_apply_per_pattern():
+    index = ConfigIndex(
+        config=_config(**{'re:(?i)infra-.+': {'has_wiki': True}, 're:(\\w+)-\\1': {'has_issues': False}})
+    )
+    assert index.get('INFRA-network')['has_wiki'] is True
+    assert index.get('api-api')['has_issues'] is False
+    assert index.get('api-web')['has_issues'] is True
+
+
+def test_exact_name_is_layered_over_pattern():
+    index = ConfigIndex(
+        config=_config(**{'service-*': {'has_wiki': True, 'has_issues': False}, 'service-api': {'has_issues': True}})
+    )
+    view = index.get('service-api')
+    assert (view['has_wiki'], view['has_issues']) == (True, True)
+    #: Updates are shallow, nested sections are replaced whole
+    index = ConfigIndex(config=_config(**{'service-api': {'default_branch': {'required_approving_review_count': 2}}}))
+    assert dict(index.get('service-api')['default_branch']) == {'required_approving_review_count': 2}
+
+
+def test_views_are_immutable():
+    view = ConfigIndex(config=_config()).get('any')
+    with pytest.raises(TypeError):
+        view['has_wiki'] = True
+    with pytest.raises(TypeError):
+        view['default_branch']['name'] = 'master'
+    assert isinstance(view['labels'], tuple)
+
+
+def test_fingerprint_excludes_labels():
+    index = ConfigIndex(
+        config=_config(**{'labelled': {'labels': [{'name': 'other', 'color': '000000'}]}, 'wiki': {'has_wiki': True}})
+    )
+    assert index.fingerprint('labelled') == index.fingerprint('any')
+    assert index.fingerprint('wiki') != index.fingerprint('any')
+
+
+@pytest.mark.parametrize(
+    'config, error',
+    [
+        ([], 'config must be a mapping with a `default` section'),
+        ({'repo': {}}, 'config must be a mapping with a `default` section'),
+        (_config(repo=[]), 'repo: section must be a mapping'),
+        (_config(repo={'has_pages': True}), 'repo.has_pages: unknown setting'),
+        (_config(repo={'has_wiki': 'yes'}), 'repo.has_wiki: expected bool, got str'),
+        (_config(repo={'default_branch': 'main'}), 'repo.default_branch: expected dict, got str'),
+        (
+            _config(repo={'default_branch': {'required_approving_review_count': True}}),
+            'repo.default_branch.required_approving_review_count: expected int, got bool',
+        ),
+        (_config(repo={'labels': ['bug']}), 'repo.labels[0]: label must be a mapping with a `name`'),
+        (
+            _config(repo={'labels': [{'name': 'bug', 'color': 'red'}]}),
+            'repo.labels[0]: color `red` is not a 6 digit hex value',
+        ),
+        (_config(repo={'labels': [LABEL, {**LABEL, 'name': 'BUG'}]}), 'repo.labels[1]: duplicate label `BUG`'),
+    ],
+)
+def test_validation_errors(config, error):
+    assert validate(config) == [error]
+    with pytest.raises(ConfigError, match=re.escape(error)):
+        ConfigIndex(config=config)
+
+
+def test_invalid_pattern_is_reported():
+    [error] = validate(_config(**{'re:(unclosed': {}}))
+    assert error.startswith('re:(unclosed: invalid pattern - ')
@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+
+import decimal
+import pytest
+from lambdas import dynamodb
+from lambdas.tests.conftest import ENVIRONMENT
+
+pytestmark = pytest.mark.usefixtures('aws')
+
+PR_TABLE = ENVIRONMENT['PULL_REQUEST_TABLE']
+PR_KEYS = ['repository', 'pull_request']
+
+
+def _pull_request(repository: str, number: int, **fields) -> dict:
+    return {'repository': repository, 'pull_request': number, 'title': 'x', 'age': 3, **fields}
+
+
+def _table() -> dict:
+    return {(item['repository'], int(item['pull_request'])): item['title'] for item in dynamodb.scan(table=PR_TABLE)}
+
+
+def test_reconcile_counts_inserted_updated_deleted_and_unchanged():
+    items = [_pull_request('a', 1), _pull_request('a', 2), _pull_request('b', 1)]
+    counts = dynamodb.reconcile(items=items, key_ids=PR_KEYS, table=PR_TABLE)
+    assert counts == {'inserted': 3, 'updated': 0, 'deleted': 0, 'unchanged': 0}
+
+    #: Items read back (numbers as Decimals) digest the same as those written
+    counts = dynamodb.reconcile(items=iter(items), key_ids=PR_KEYS, table=PR_TABLE)
+    assert counts == {'inserted': 0, 'updated': 0, 'deleted': 0, 'unchanged': 3}
+
+    items = [_pull_request('a', 1), _pull_request('b', 1, title='y'), _pull_request('c', 1)]
+    counts = dynamodb.reconcile(items=items, key_ids=PR_KEYS, table=PR_TABLE)
+    assert counts == {'inserted': 1, 'updated': 1, 'deleted': 1, 'unchanged': 1}
+    assert _table() == {('a', 1): 'x', ('b', 1): 'y', ('c', 1): 'x'}
+
+
+def test_reconcile_only_replaces_existing_given():
+    dynamodb.reconcile(items=[_pull_request('a', 1), _pull_request('b', 1)], key_ids=PR_KEYS, table=PR_TABLE)
+
+    digests = dynamodb.digests(table=PR_TABLE, key_ids=PR_KEYS)
+    existing = {key: digest for key, digest in digests.items() if key[0] == 'a'}
+    counts = dynamodb.reconcile(items=[_pull_request('a', 2)], key_ids=PR_KEYS, table=PR_TABLE, existing=existing)
+    assert counts == {'inserted': 1, 'updated': 0, 'deleted': 1, 'unchanged': 0}
+    assert _table() == {('a', 2): 'x', ('b', 1): 'x'}
+
+
+@pytest.mark.parametrize(
+    'value, expected',
+    [('42', 42), ('-7', -7), ('1E+2', 100), ('2.50', 2.5), ('12345678901234567890123', 12345678901234567890123)],
+)
+def test_deserialized_numbers_match_replace_decimals(value, expected):
+    number = dynamodb._number(value)
+    assert number == expected and type(number) is type(expected)
+    assert number == dynamodb.replace_decimals(decimal.Decimal(value))
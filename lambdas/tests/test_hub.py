@@ -0,0 +1,357 @@
+# -*- coding: utf-8 -*-
+
+import base64
+import hashlib
+import hmac
+import json
+import os
+import pytest
+import requests
+import time
+import uuid
+from lambdas import hub
+from lambdas.tests.conftest import PARAMETERS
+from typing import Iterator
+
+
+def _http_error(status: int) -> requests.HTTPError:
+    response = requests.Response()
+    response.status_code = status
+    return requests.HTTPError(f'{status} error', response=response)
+
+
+def _connection(*nodes: dict) -> dict:
+    return {'pageInfo': {'hasNextPage': False, 'endCursor': None}, 'nodes': list(nodes)}
+
+
+def _page(*names: str, has_next: bool = False) -> dict:
+    nodes = [
+        {'nameWithOwner': f'org/{name}', 'refs': _connection({'name': 'v1.1.0'}, {'name': 'v1.0.0'})} for name in names
+    ]
+    return {
+        'rateLimit': {'cost': 1, 'remaining': 4999, 'resetAt': '2021-02-15T10:00:00Z'},
+        'organization': {
+            'repositories': {'pageInfo': {'hasNextPage': has_next, 'endCursor': names[-1]}, 'nodes': nodes}
+        },
+    }
+
+
+def test_get_org_pages_fetches_requested_connections(monkeypatch):
+    queries = []
+    responses = iter([_page('a', 'b', has_next=True), _page('c')])
+    monkeypatch.setattr(hub, '_graphql', lambda query, variables: queries.append(query) or next(responses))
+
+    pages = list(hub.get_org_pages(org='org', connections=['refs']))
+    assert [cursor for _, cursor in pages] == ['b', 'c']
+    assert pages[0][0][0] == {
+        'repository': 'org/a',
+        'versions': {'repository': 'org/a', 'versions': ['v1.1.0', 'v1.0.0']},
+    }
+    assert 'refs(' in queries[0] and 'pullRequests(' not in queries[0] and 'labels(' not in queries[0]
+
+
+@pytest.mark.parametrize(
+    'error',
+    [requests.Timeout(), _http_error(502), hub.GraphQLError(errors=[{'type': 'MAX_NODE_LIMIT_EXCEEDED'}])],
+)
+def test_get_org_pages_halves_page_on_timeouts_and_limits(monkeypatch, error):
+    sizes = []
+
+    def graphql(query, variables):
+        sizes.append(variables['first'])
+        if len(sizes) == 1:
+            raise error
+        return _page('a')
+
+    monkeypatch.setattr(hub, '_graphql', graphql)
+    assert len(list(hub.get_org_pages(org='org', connections=['refs']))) == 1
+    assert sizes[1] == sizes[0] // 2
+
+
+@pytest.mark.parametrize(
+    'error', [_http_error(401), _http_error(403), hub.GraphQLError(errors=[{'type': 'NOT_FOUND'}])]
+)
+def test_get_org_pages_raises_other_errors(monkeypatch, error):
+    sizes = []
+
+    def graphql(query, variables):
+        sizes.append(variables['first'])
+        raise error
+
+    monkeypatch.setattr(hub, '_graphql', graphql)
+    with pytest.raises(type(error)):
+        list(hub.get_org_pages(org='org', connections=['refs']))
+    assert len(sizes) == 1
+
+
+class Context:
+    """Lambda context object of a single invocation"""
+
+    function_name = 'watcher-test'
+    memory_limit_in_mb = 128
+    invoked_function_arn = 'arn:aws:lambda:us-east-1:123456789012:function:watcher-test'
+
+    def __init__(self):
+        self.aws_request_id = str(uuid.uuid4())
+
+
+class Event(dict):
+    """Webhook event recording the keys read from it"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.read = set()
+
+    def get(self, key, default=None):
+        self.read.add(key)
+        return super().get(key, default)
+
+    def __getitem__(self, key):
+        self.read.add(key)
+        return super().__getitem__(key)
+
+
+def _sign(body: bytes, digest: str = 'sha256', secret: str = PARAMETERS['/watcher/github_webhook_secret']) -> str:
+    return f'{digest}=' + hmac.new(secret.encode('utf-8'), body, getattr(hashlib, digest)).hexdigest()
+
+
+def _webhook(body: bytes, encode: bool = False, **headers: str) -> Event:
+    headers = {'X-GitHub-Event': 'pull_request', 'X-GitHub-Delivery': str(uuid.uuid4()), **headers}
+    raw = base64.b64encode(body).decode('utf-8') if encode else body.decode('utf-8')
+    return Event(headers=headers, body=raw, isBase64Encoded=encode)
+
+
+BODY = json.dumps({'action': 'opened', 'number': 1, 'pull_request': {'number': 1}}).encode('utf-8')
+
+
+@pytest.mark.parametrize(
+    'headers',
+    [
+        {'X-Hub-Signature-256': _sign(BODY)},
+        {'X-Hub-Signature': _sign(BODY, digest='sha1')},
+        {'x-hub-signature-256': _sign(BODY), 'X-HUB-SIGNATURE': 'sha1=invalid'},
+    ],
+    ids=['sha256', 'sha1-fallback', 'mixed-case'],
+)
+def test_valid_signature(aws, headers):
+    headers = {name.lower(): value for name, value in headers.items()}
+    assert hub._valid_signature(headers=headers, body=BODY)
+
+
+@pytest.mark.parametrize(
+    'headers',
+    [
+        {},
+        {'x-hub-signature-256': _sign(BODY, secret='other')},
+        {'x-hub-signature-256': _sign(BODY, digest='sha1')},
+        {'x-hub-signature-256': 'invalid'},
+    ],
+    ids=['missing', 'other-secret', 'wrong-digest', 'malformed'],
+)
+def test_invalid_signature(aws, headers):
+    assert not hub._valid_signature(headers=headers, body=BODY)
+
+
+@pytest.mark.parametrize('encode', [False, True], ids=['text', 'base64'])
+def test_receive_distributes_signed_webhook(aws, monkeypatch, encode):
+    emitted = []
+    monkeypatch.setattr(hub.sns, 'emit_sns_msg', lambda message, topic_arn: emitted.append(topic_arn))
+
+    event = _webhook(BODY, encode=encode, **{'x-HUB-signature-256': _sign(BODY)})
+    assert hub.receive(event, Context())['statusCode'] == 202
+    assert emitted == [hub.GithubEvent.pull_request.topic_arn]
+
+
+@pytest.mark.parametrize(
+    'headers',
+    [{}, {'X-Hub-Signature-256': _sign(BODY, secret='other')}, {'X-Hub-Signature': 'sha1'}],
+    ids=['missing', 'bad', 'malformed'],
+)
+def test_receive_rejects_unsigned_webhook(aws, monkeypatch, headers):
+    monkeypatch.setattr(hub.sns, 'emit_sns_msg', lambda message, topic_arn: pytest.fail('distributed'))
+    assert hub.receive(_webhook(BODY, **headers), Context())['statusCode'] == 403
+
+
+def test_receive_skips_unhandled_event_without_reading_body():
+    event = _webhook(BODY, **{'X-GitHub-Event': 'star', 'X-Hub-Signature-256': _sign(BODY)})
+    assert hub.receive(event, Context())['statusCode'] == 202
+    assert 'body' not in event.read and 'isBase64Encoded' not in event.read
+
+
+class Monotonic:
+    """Fake `time.monotonic`, advanced by tests"""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_ttl_cache_expires_entries(monkeypatch):
+    clock = Monotonic()
+    monkeypatch.setattr(hub.time, 'monotonic', clock)
+    calls = []
+
+    @hub.ttl_cache(maxsize=10, ttl=60)
+    def get(name: str) -> int:
+        calls.append(name)
+        return len(calls)
+
+    assert (get('a'), get(name='a')) == (1, 1)
+    clock.now = 59
+    assert get('a') == 1
+    clock.now = 60
+    assert get('a') == 2
+    assert calls == ['a', 'a']
+
+
+def test_ttl_cache_evicts_least_recently_used():
+    cache = hub.TTLCache(maxsize=2, ttl=60)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    assert cache.get('a') == 1
+    cache.put('c', 3)
+    assert (len(cache), cache.get('a'), cache.get('b'), cache.get('c')) == (2, 1, None, 3)
+
+
+@pytest.fixture
+def github_cache() -> Iterator[None]:
+    """Empty GitHub object caches, cleared again after the test"""
+    cached = (hub.get_github_repo, hub.get_github_repos, hub.get_github_org)
+    for func in cached:
+        func.cache_clear()
+    yield
+    for func in cached:
+        func.cache_clear()
+
+
+@pytest.mark.usefixtures('github_cache')
+def test_invalidate_repo_evicts_repo_and_org_listing(monkeypatch):
+    calls = []
+
+    class GitHub:
+        def get_repo(self, repo):
+            calls.append(repo)
+            return repo
+
+        def get_organization(self, org):
+            return self
+
+        def get_repos(self, **kwargs):
+            calls.append('listing')
+            return ['org/a']
+
+    monkeypatch.setattr(hub, '_github', GitHub)
+
+    for _ in range(2):
+        hub.get_github_repo(repo='org/a')
+        hub.get_github_repo(repo='org/b')
+        hub.get_github_repos(org='org')
+    assert calls == ['org/a', 'org/b', 'listing']
+
+    hub.invalidate_repo(full_name='org/a')
+    hub.get_github_repo(repo='org/a')
+    hub.get_github_repo(repo='org/b')
+    hub.get_github_repos(org='org')
+    assert calls == ['org/a', 'org/b', 'listing', 'org/a', 'listing']
+
+
+def _json_response(status: int, data=None, **headers: str) -> requests.Response:
+    response = requests.Response()
+    response.status_code = status
+    response.headers.update(headers)
+    response._content = json.dumps(data).encode('utf-8') if data is not None else b''
+    return response
+
+
+class GitHubPages:
+    """GitHub API serving `pages` of a listing by url, answering 304 when the request's ETag matches"""
+
+    def __init__(self, pages: dict):
+        self.pages = pages
+        self.requests = []
+
+    def __call__(self, method: str, url: str, headers: dict, **kwargs) -> requests.Response:
+        self.requests.append((url, headers.get('If-None-Match')))
+        etag, data, next_url = self.pages[url]
+        if headers.get('If-None-Match') == etag:
+            return _json_response(304)
+        link = {'Link': f'<{next_url}>; rel="next"'} if next_url else {}
+        return _json_response(200, data, ETag=etag, **link)
+
+
+@pytest.fixture
+def response_cache(monkeypatch) -> hub.MemoryCache:
+    cache = hub.MemoryCache(maxsize=10)
+    monkeypatch.setattr(hub, 'RESPONSE_CACHE', cache)
+    return cache
+
+
+def test_conditional_get_reuses_cached_pages(monkeypatch, response_cache):
+    first, second = hub._api_url(path='repos/org/a/tags', params={'per_page': 100}), f'{hub.GITHUB_API_URL}/page2'
+    github = GitHubPages({first: ('"1"', [{'name': 'v2'}], second), second: ('"2"', [{'name': 'v1'}], None)})
+    monkeypatch.setattr(hub, '_request', github)
+    transformed = []
+
+    def names(page):
+        transformed.append(page)
+        return [tag['name'] for tag in page]
+
+    assert hub.get_all_json(path='repos/org/a/tags', transform=names) == ['v2', 'v1']
+    assert response_cache.get(first) == {'etag': '"1"', 'last_modified': None, 'next': second, 'data': ['v2']}
+
+    #: Unchanged pages are answered by 304s, the cached (transformed) data and next links are reused
+    stats = hub.cache_stats()
+    assert hub.get_all_json(path='repos/org/a/tags', transform=names) == ['v2', 'v1']
+    assert github.requests[2:] == [(first, '"1"'), (second, '"2"')]
+    assert len(transformed) == 2
+    assert hub.cache_stats()['hits'] == stats['hits'] + 2
+
+
+def test_memory_cache_is_bounded():
+    cache = hub.MemoryCache(maxsize=2)
+    for i in range(3):
+        cache.put(f'url{i}', {'data': i})
+    assert (len(cache), cache.get('url0'), cache.get('url2')) == (2, None, {'data': 2})
+
+
+def test_dynamodb_cache_round_trip(aws):
+    cache = hub.DynamoDBCache(table=os.environ['STATE_TABLE'])
+    assert cache.get('url') is None
+
+    data = [{'name': 'v1.0.0', 'commit': {'sha': 'a' * 40}}] * 50
+    cache.put('url', {'etag': '"1"', 'last_modified': None, 'next': 'url2', 'data': data})
+    entry = cache.get('url')
+    assert (entry['etag'], entry['next'], entry['data']) == ('"1"', 'url2', data)
+    assert 'last_modified' not in entry
+
+
+def test_map_repos_bounds_repositories_in_flight():
+    pulled, results, in_flight = [], [], []
+
+    def repos():
+        for i in range(50):
+            pulled.append(i)
+            in_flight.append(len(pulled) - len(results))
+            yield i
+
+    def slow(repo: int) -> int:
+        time.sleep(0.005)
+        return repo * 2
+
+    for result in hub.map_repos(func=slow, repos=repos(), concurrency=4):
+        results.append(result)
+    assert sorted(results) == [i * 2 for i in range(50)]
+    assert max(in_flight) == 2 * 4
+
+
+def test_map_repos_raises_function_errors():
+    def fail(repo: int) -> int:
+        time.sleep(0.005)
+        if repo == 7:
+            raise RuntimeError(f'failed {repo}')
+        return repo
+
+    with pytest.raises(RuntimeError, match='failed 7'):
+        list(hub.map_repos(func=fail, repos=range(20), concurrency=4))
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+
+import json
+import pytest
+from lambdas import dynamodb, idempotency, sns
+from lambdas.tests.conftest import ENVIRONMENT
+
+pytestmark = pytest.mark.usefixtures('aws')
+
+
+def _status(scope: str, delivery_id: str) -> str:
+    key = {'id': f'delivery#{scope}#{delivery_id}'}
+    return dynamodb.get_item(key=key, table=ENVIRONMENT['STATE_TABLE'])['status']
+
+
+def _sqs_event(*deliveries: str) -> dict:
+    records = []
+    for delivery in deliveries:
+        msg = {'X-GitHub-Delivery': delivery, 'repository': {'full_name': f'org/{delivery.split("-")[0]}'}}
+        records.append({'messageId': f'msg-{delivery}', 'body': json.dumps({'tag': msg})})
+    return {'Records': records}
+
+
+def test_claim_in_progress_then_completed():
+    assert idempotency.claim(scope='test', delivery_id='a')
+    assert _status(scope='test', delivery_id='a') == idempotency.INPROGRESS
+    with pytest.raises(idempotency.InProgress):
+        idempotency.claim(scope='test', delivery_id='a')
+
+    idempotency.complete(scope='test', delivery_id='a')
+    assert _status(scope='test', delivery_id='a') == idempotency.COMPLETED
+    assert not idempotency.claim(scope='test', delivery_id='a')
+
+
+def test_released_claim_is_reclaimed():
+    assert idempotency.claim(scope='test', delivery_id='b')
+    idempotency.release(scope='test', delivery_id='b')
+    assert idempotency.claim(scope='test', delivery_id='b')
+
+
+def test_expired_lease_is_reclaimed(monkeypatch):
+    #: Invocation crashed or timed out without completing or releasing its claim
+    monkeypatch.setattr(idempotency, 'IDEMPOTENCY_LEASE', -1)
+    assert idempotency.claim(scope='test', delivery_id='c')
+    monkeypatch.setattr(idempotency, 'IDEMPOTENCY_LEASE', 60)
+    assert idempotency.claim(scope='test', delivery_id='c')
+
+
+def test_scopes_are_independent():
+    assert idempotency.claim(scope='one', delivery_id='d')
+    assert idempotency.claim(scope='two', delivery_id='d')
+
+
+def test_process_records_completes_handled_and_releases_failed():
+    def handle(key, msgs):
+        if key == 'org/bad':
+            raise RuntimeError('handler failed')
+
+    response = sns.process_records(
+        event=_sqs_event('good-1', 'bad-1'),
+        msg_key='tag',
+        group=lambda m: m['repository']['full_name'],
+        handler=handle,
+        scope='test',
+    )
+    assert response == {'batchItemFailures': [{'itemIdentifier': 'msg-bad-1'}]}
+    assert _status(scope='test', delivery_id='good-1') == idempotency.COMPLETED
+    #: Failed delivery is released, so its redelivery is processed rather than dropped
+    assert idempotency.claim(scope='test', delivery_id='bad-1')
+
+
+def test_process_records_fails_deliveries_in_progress():
+    handled = []
+    assert idempotency.claim(scope='test', delivery_id='busy-1')
+    response = sns.process_records(
+        event=_sqs_event('busy-1', 'free-1'),
+        msg_key='tag',
+        group=lambda m: m['repository']['full_name'],
+        handler=lambda key, msgs: handled.append(key),
+        scope='test',
+    )
+    assert response == {'batchItemFailures': [{'itemIdentifier': 'msg-busy-1'}]}
+    assert handled == ['org/free']
+
+
+def test_process_records_releases_claims_when_interrupted(monkeypatch):
+    def complete(scope, delivery_id):
+        raise RuntimeError('state table unavailable')
+
+    monkeypatch.setattr(idempotency, 'complete', complete)
+    with pytest.raises(RuntimeError):
+        sns.process_records(
+            event=_sqs_event('lost-1'),
+            msg_key='tag',
+            group=lambda m: m['repository']['full_name'],
+            handler=lambda key, msgs: None,
+            scope='test',
+        )
+    assert idempotency.claim(scope='test', delivery_id='lost-1')
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+
+import boto3
+import os
+import pytest
+from lambdas import metrics
+from lambdas.tests.conftest import REGION
+
+
+@pytest.fixture
+def sink(monkeypatch) -> metrics.MemorySink:
+    sink = metrics.MemorySink()
+    monkeypatch.setattr(metrics, 'SINK', sink)
+    return sink
+
+
+def test_log_metrics_flushes_counts_per_handler(sink):
+    @metrics.log_metrics
+    def handler(event, context):
+        metrics.add(name='GitHubRequests')
+        metrics.add(name='GitHubRequests', value=2)
+        metrics.add(name='ReadmeBytesWritten', value=event['bytes'])
+        return 'done'
+
+    assert handler({'bytes': 512}, None) == 'done'
+    [record] = sink.records
+    assert record['dimensions'] == {'handler': 'test_metrics.handler'}
+    assert set(record['metrics']) == set(metrics.UNITS)
+    assert (record['metrics']['GitHubRequests'], record['metrics']['ReadmeBytesWritten']) == (3, 512)
+    assert record['metrics']['SNSMessagesPublished'] == 0
+
+
+def test_log_metrics_flushes_when_handler_raises_and_keeps_outer_counts(sink):
+    @metrics.log_metrics
+    def inner(event, context):
+        metrics.add(name='GitHubRequests')
+        raise RuntimeError('failed')
+
+    @metrics.log_metrics
+    def outer(event, context):
+        metrics.add(name='GitHubRequests', value=5)
+        with pytest.raises(RuntimeError):
+            inner(event, context)
+        metrics.add(name='GitHubRequests')
+
+    outer({}, None)
+    assert [record['metrics']['GitHubRequests'] for record in sink.records] == [1, 6]
+    assert [record['dimensions']['handler'] for record in sink.records] == ['test_metrics.inner', 'test_metrics.outer']
+
+
+def test_unknown_metric_is_dropped(sink):
+    @metrics.log_metrics
+    def handler(event, context):
+        metrics.add(name='Unknown')
+        return 'done'
+
+    assert handler({}, None) == 'done'
+    assert 'Unknown' not in sink.records[0]['metrics']
+
+
+@pytest.mark.usefixtures('aws')
+def test_dynamodb_requests_record_consumed_capacity(sink):
+    client = boto3.client('dynamodb', region_name=REGION)
+    metrics.instrument_dynamodb(client=client)
+    table = os.environ['STATE_TABLE']
+
+    @metrics.log_metrics
+    def handler(event, context):
+        for key in ('a', 'b'):
+            client.put_item(TableName=table, Item={'id': {'S': key}})
+        client.scan(TableName=table)
+
+    handler({}, None)
+    recorded = sink.records[0]['metrics']
+    assert (recorded['DynamoDBRequests'], recorded['DynamoDBItemsScanned']) == (3, 2)
+    assert recorded['DynamoDBConsumedCapacity'] > 0
@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+
+import os
+import pstats
+import pytest
+import time
+from lambdas import profiling
+
+
+class Context:
+    aws_request_id = 'request-1'
+
+
+def _busy(event, context):
+    with profiling.span('external_call'):
+        time.sleep(0.05)
+    return event
+
+
+@pytest.mark.parametrize('mode, suffix', [('cprofile', '.pstats'), ('sample', '.collapsed')])
+def test_profile_writes_output_to_profile_dir(monkeypatch, tmp_path, mode, suffix):
+    monkeypatch.setattr(profiling, 'PROFILE_MODE', mode)
+    monkeypatch.setattr(profiling, 'PROFILE_DIR', str(tmp_path / 'profiles'))
+    reports = []
+    monkeypatch.setattr(profiling.logger, 'info', reports.append)
+
+    assert profiling.profile(_busy)({'key': 'value'}, Context()) == {'key': 'value'}
+    path = tmp_path / 'profiles' / f'test_profiling._busy-request-1{suffix}'
+    assert os.listdir(tmp_path / 'profiles') == [path.name]
+    if mode == 'cprofile':
+        assert any(func[2] == '_busy' for func in pstats.Stats(str(path)).stats)
+    else:
+        assert 'test_profiling._busy' in path.read_text()
+
+    [report] = reports
+    assert (report['mode'], report['path']) == (mode, str(path))
+    assert report['spans']['external_call']['calls'] == 1
+    assert profiling._SPANS == {}
+
+
+def test_profile_is_off_by_default(monkeypatch):
+    monkeypatch.setattr(profiling, 'PROFILE_MODE', '')
+    assert profiling.profile(_busy) is _busy
+    monkeypatch.setattr(profiling, 'PROFILE_MODE', 'unknown')
+    assert profiling.profile(_busy) is _busy
+
+
+def test_span_is_noop_when_profiling_is_off(monkeypatch):
+    monkeypatch.setattr(profiling, 'PROFILE_MODE', '')
+    monkeypatch.setattr(profiling.tracer.provider, 'in_subsegment', lambda name: pytest.fail('traced'))
+
+    with profiling.span('external_call'):
+        pass
+    assert profiling._SPANS == {}
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+
+import datetime
+import pytest
+from lambdas import pull_requests
+
+
+class FrozenDatetime(datetime.datetime):
+    """Datetime whose `now()` is `frozen`"""
+
+    frozen = datetime.datetime(2021, 3, 1, 12)
+
+    @classmethod
+    def now(cls, tz=None):
+        return cls.frozen
+
+
+@pytest.fixture(autouse=True)
+def frozen(monkeypatch):
+    monkeypatch.setattr(pull_requests, 'datetime', FrozenDatetime)
+
+
+def _data(repository: str, number: int, date: str = '2021-02-15') -> dict:
+    return {
+        'repository': repository,
+        'pull_request': number,
+        'url': f'https://github.com/{repository}/pull/{number}',
+        'branch': f'feature/{number}',
+        'user': 'octocat',
+        'date': date,
+    }
+
+
+def _readme(*data: dict) -> str:
+    rows = ''.join(pull_requests._render_row(data=x) for x in data)
+    return f'# Metadata\n\n{pull_requests._render_section(rows=rows)}\n\nfooter\n'
+
+
+def _keys(content: str) -> list:
+    section = pull_requests.README_PATTERN.search(content).group(1)
+    return [
+        (m.group('repository'), int(m.group('pull_request')))
+        for m in map(pull_requests.README_ROW_KEY.match, section.splitlines())
+        if m
+    ]
+
+
+def test_patch_rows_inserts_in_sorted_position():
+    content = _readme(_data('org/a', 2), _data('org/c', 1))
+    patched = pull_requests._patch_rows(content=content, patch=_data('org/b', 1))
+    patched = pull_requests._patch_rows(content=patched, patch=_data('org/a', 10))
+    assert _keys(patched) == [('org/a', 2), ('org/a', 10), ('org/b', 1), ('org/c', 1)]
+    assert patched.startswith('# Metadata\n\n') and patched.endswith('\n\nfooter\n')
+
+
+def test_patch_rows_matches_full_render():
+    data = [_data('org/b', 3), _data('org/a', 1, date='2021-01-01'), _data('org/b', 12)]
+    patched = _readme()
+    for x in data:
+        patched = pull_requests._patch_rows(content=patched, patch=x)
+    assert patched == _readme(*sorted(data, key=lambda x: (x['repository'], x['pull_request'])))
+
+
+def test_patch_rows_replaces_and_removes_rows():
+    content = _readme(_data('org/a', 1), _data('org/a', 2))
+    patched = pull_requests._patch_rows(content=content, patch=_data('org/a', 1, date='2021-02-28'))
+    assert '|org/a|[#1](https://github.com/org/a/pull/1)|feature/1|octocat|1|' in patched
+    assert _keys(patched) == [('org/a', 1), ('org/a', 2)]
+
+    patched = pull_requests._patch_rows(content=patched, patch={'repository': 'org/a', 'pull_request': 2})
+    assert _keys(patched) == [('org/a', 1)]
+
+
+def test_patch_rows_requires_full_render_once_ages_are_stale(monkeypatch):
+    content = _readme(_data('org/a', 1))
+    #: Ages of the rows rendered yesterday are a day off
+    monkeypatch.setattr(FrozenDatetime, 'frozen', FrozenDatetime.frozen + datetime.timedelta(days=1))
+    assert pull_requests._patch_rows(content=content, patch=_data('org/b', 1)) is None
+
+    #: Sections rendered without a date stamp are rendered in full as well
+    legacy = f'<!-- PR Start -->\n{pull_requests.README_HEADER}\n<!-- PR End -->'
+    assert pull_requests._patch_rows(content=legacy, patch=_data('org/b', 1)) is None
+
+
+@pytest.mark.usefixtures('aws')
+def test_full_render_computes_ages_at_render(monkeypatch):
+    assert pull_requests._update_pull_request_table(action='opened', data=_data('org/b', 1))
+    assert pull_requests._update_pull_request_table(action='opened', data=_data('org/a', 1))
+    assert '|org/a|[#1](https://github.com/org/a/pull/1)|feature/1|octocat|14|\n|org/b' in pull_requests._render_rows()
+
+    monkeypatch.setattr(FrozenDatetime, 'frozen', FrozenDatetime.frozen + datetime.timedelta(days=1))
+    assert pull_requests._render_rows().startswith('|org/a|[#1](https://github.com/org/a/pull/1)|feature/1|octocat|15|')
+    assert not pull_requests._update_pull_request_table(action='closed', data=_data('org/a', 1))
+    assert pull_requests._render_rows().startswith('|org/b|')
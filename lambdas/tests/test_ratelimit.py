@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+import requests
+import threading
+from lambdas import ratelimit
+from lambdas.ratelimit import Governor, Priority, RateLimitExceeded
+
+
+def _response(status: int = 200, text: str = '', **headers: str) -> requests.Response:
+    response = requests.Response()
+    response.status_code = status
+    response.headers.update(headers)
+    response._content = text.encode('utf-8')
+    return response
+
+
+def _budget(remaining: int, reset: float, limit: int = 5000) -> dict:
+    return {'X-RateLimit-Limit': str(limit), 'X-RateLimit-Remaining': str(remaining), 'X-RateLimit-Reset': str(reset)}
+
+
+class Sender:
+    """Send function returning `responses` in turn"""
+
+    def __init__(self, *responses: requests.Response):
+        self.responses = list(responses)
+        self.calls = 0
+
+    def __call__(self) -> requests.Response:
+        self.calls += 1
+        return self.responses.pop(0)
+
+
+class Clock:
+    """Fake `time` module advanced by the governor's sleeps"""
+
+    def __init__(self):
+        self.now = 1613383200.0
+
+    def time(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch) -> Clock:
+    clock = Clock()
+    monkeypatch.setattr(ratelimit, 'time', clock)
+    return clock
+
+
+@pytest.fixture
+def slept(clock) -> list:
+    return []
+
+
+@pytest.fixture
+def governor(clock, slept) -> Governor:
+    def sleep(seconds: float):
+        slept.append(seconds)
+        clock.now += seconds
+
+    return Governor(max_concurrency=16, reserve=0.2, max_wait=60, attempts=3, sleep=sleep)
+
+
+def test_primary_limit_waits_until_reset(governor, clock, slept):
+    reset = int(clock.now) + 30
+    send = Sender(_response(403, **_budget(remaining=0, reset=reset)), _response(200, **_budget(4999, reset=reset)))
+
+    assert governor.request(send=send).status_code == 200
+    assert send.calls == 2
+    assert slept[0] == 31 and sum(slept) == 31
+
+
+def test_retry_after_is_honoured(governor, slept, monkeypatch):
+    monkeypatch.setattr('random.uniform', lambda a, b: 0)
+    send = Sender(_response(429, **{'Retry-After': '7'}), _response(200))
+
+    assert governor.request(send=send).status_code == 200
+    assert slept == [7]
+
+
+def test_permission_error_is_not_retried(governor, slept):
+    send = Sender(_response(403, text='Resource not accessible by integration, rate limit ok', **_budget(4999, 0)))
+    assert governor.request(send=send).status_code == 403
+    assert (send.calls, slept) == (1, [])
+
+
+def test_gives_up_after_attempts(governor, slept):
+    send = Sender(*[_response(429, **{'Retry-After': '1'}) for _ in range(3)])
+    assert governor.request(send=send).status_code == 429
+    assert (send.calls, len(slept)) == (3, 2)
+
+
+def test_secondary_limit_halves_concurrency_and_recovers(governor):
+    assert governor.concurrency == 16
+    governor.request(send=Sender(_response(403, **{'Retry-After': '0'}), _response(200)))
+    assert governor.concurrency == 8
+
+    for _ in range(100):
+        governor.request(send=Sender(_response(200)))
+    assert governor.concurrency == 16
+
+
+def test_bulk_priority_stops_at_reserve(governor, clock):
+    reset = int(clock.now) + 3600
+    governor.request(send=Sender(_response(200, **_budget(remaining=1000, reset=reset))))
+
+    with governor.prioritize(Priority.bulk):
+        with pytest.raises(RateLimitExceeded):
+            governor.request(send=Sender(_response(200)))
+    #: Webhook driven work may spend the reserve
+    assert governor.request(send=Sender(_response(200))).status_code == 200
+
+
+def test_priority_is_restored_and_per_thread(governor):
+    @governor.prioritize(Priority.bulk)
+    def fail():
+        assert governor.priority is Priority.bulk
+        raise RuntimeError('failed')
+
+    with pytest.raises(RuntimeError):
+        fail()
+    assert governor.priority is Priority.webhook
+
+    seen = {}
+    with governor.prioritize(Priority.bulk):
+        threads = [
+            threading.Thread(target=lambda: seen.setdefault('thread', governor.priority)),
+            threading.Thread(target=governor.bind(lambda: seen.setdefault('bound', governor.priority))),
+        ]
+        for thread in threads:
+            thread.start()
+            thread.join()
+    assert seen == {'thread': Priority.webhook, 'bound': Priority.bulk}
@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+from lambdas import readme, sns
+
+pytestmark = pytest.mark.usefixtures('aws')
+
+
+class Context:
+    """Lambda context object of request `aws_request_id` with `remaining` seconds left"""
+
+    def __init__(self, aws_request_id: str = 'owner', remaining: float = 900):
+        self.aws_request_id = aws_request_id
+        self.remaining = remaining
+
+    def get_remaining_time_in_millis(self) -> int:
+        return int(self.remaining * 1000)
+
+
+def test_lock_is_exclusive_until_released_or_expired(monkeypatch):
+    assert readme._acquire(section='test', owner='a')
+    assert not readme._acquire(section='test', owner='b')
+    readme._drain(section='test', owner='a')
+    assert readme._release(section='test', owner='a')
+    assert readme._acquire(section='test', owner='b')
+
+    #: Abandoned lock (owner timed out) is taken over once expired
+    monkeypatch.setattr(readme, 'LOCK_TTL', -1)
+    assert readme._acquire(section='other', owner='a')
+    assert readme._acquire(section='other', owner='b')
+
+
+def test_drain_takes_queued_triggers():
+    readme._record_trigger(section='test', patch={'row': 1})
+    readme._record_trigger(section='test', patch={'row': 2})
+    assert readme._acquire(section='test', owner='a')
+
+    state = readme._drain(section='test', owner='a')
+    assert (state['pending'], state['patches'], state.get('rescan', False)) == (2, [{'row': 1}, {'row': 2}], False)
+    state = readme._drain(section='test', owner='a')
+    assert (state['pending'], state['patches']) == (0, [])
+
+
+def test_full_render_trigger_requests_rescan():
+    readme._record_trigger(section='test', patch={'row': 1})
+    readme._record_trigger(section='test', patch=None)
+    assert readme._acquire(section='test', owner='a')
+    state = readme._drain(section='test', owner='a')
+    assert (state['pending'], state['rescan']) == (2, True)
+
+
+def test_release_waits_for_triggers_after_drain():
+    assert readme._acquire(section='test', owner='a')
+    readme._drain(section='test', owner='a')
+    readme._record_trigger(section='test', patch={'row': 1})
+
+    assert not readme._release(section='test', owner='a')
+    assert not readme._release(section='test', owner='b', force=True)
+    assert readme._release(section='test', owner='a', force=True)
+
+
+def test_coalesce_renders_queued_triggers():
+    rendered = []
+
+    def render(patches, rescan):
+        rendered.append((patches, rescan))
+        return 10
+
+    result = readme.coalesce(section='test', message={'readme': {'row': 1}}, render=render, context=Context(), window=0)
+    assert result == {'triggers': 1, 'commits': 1}
+    assert rendered == [([{'row': 1}], False)]
+    #: Lock is free for the next trigger
+    assert readme._acquire(section='test', owner='next')
+
+
+def test_coalesce_triggers_during_render_are_absorbed_by_owner():
+    rendered = []
+
+    def render(patches, rescan):
+        rendered.append(patches)
+        if len(rendered) == 1:
+            #: Trigger of another invocation while the owner renders, absorbed as the lock is held
+            absorbed = readme.coalesce(
+                section='test', message={'readme': {'row': 2}}, render=render, context=Context('other'), window=0
+            )
+            assert absorbed == {'triggers': 0, 'commits': 0}
+        return 10
+
+    result = readme.coalesce(section='test', message={'readme': {'row': 1}}, render=render, context=Context(), window=0)
+    assert result == {'triggers': 2, 'commits': 2}
+    assert rendered == [[{'row': 1}], [{'row': 2}]]
+
+
+def test_coalesce_failed_render_queues_rescan_and_releases_lock():
+    def render(patches, rescan):
+        raise RuntimeError('GitHub unavailable')
+
+    with pytest.raises(RuntimeError):
+        readme.coalesce(section='test', message={'readme': {'row': 1}}, render=render, context=Context(), window=0)
+    assert readme._acquire(section='test', owner='next')
+    state = readme._drain(section='test', owner='next')
+    assert (state['pending'], state['rescan']) == (1, True)
+
+
+def test_coalesce_hands_over_when_out_of_time(monkeypatch):
+    emitted = []
+    monkeypatch.setattr(sns, 'emit_sns_msg', lambda message: emitted.append(message))
+
+    result = readme.coalesce(
+        section='test', message={}, render=lambda patches, rescan: 10, context=Context(remaining=1), window=0
+    )
+    assert result == {'triggers': 0, 'commits': 0}
+    assert emitted == [{'continue': True}]
+
+    #: Continuation takes the lock and renders the trigger left behind
+    rendered = []
+    result = readme.coalesce(
+        section='test',
+        message=emitted[0],
+        render=lambda patches, rescan: rendered.append(rescan) or 10,
+        context=Context(),
+        window=0,
+    )
+    assert result == {'triggers': 1, 'commits': 1}
+    assert rendered == [True]
@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+from lambdas import hub, repository
+
+
+def _label(name: str, color: str = 'ffffff', description: str = None) -> dict:
+    return {'name': name, 'color': color, 'description': description}
+
+
+def test_plan_labels_orders_changes_and_deletes_last():
+    base_labels = [
+        _label('Bug', color='d73a4a', description='Something is not working'),
+        _label('feature'),
+        _label('docs', color='0075ca', description='Documentation'),
+        _label('question'),
+    ]
+    repo_labels = [
+        _label('stale'),
+        _label('bug', color='D73A4A', description='Something is not working'),
+        _label('docs', color='0075ca'),
+        _label('question', description=''),
+    ]
+
+    plan = repository._plan_labels(base_labels=base_labels, repo_labels=repo_labels)
+    assert [(op['op'], op.get('current'), op['name']) for op in plan] == [
+        #: Case only rename is edited in place rather than deleted and re-created
+        ('edit', 'bug', 'Bug'),
+        ('create', None, 'feature'),
+        ('edit', 'docs', 'docs'),
+        ('delete', None, 'stale'),
+    ]
+    assert plan[0]['color'] == 'd73a4a'
+    assert plan[2]['description'] == 'Documentation'
+
+
+def test_plan_labels_matching_config_is_empty():
+    labels = [_label('bug', color='D73A4A'), _label('docs', description='Documentation')]
+    matching = [_label('bug', color='d73a4a', description=''), _label('docs', description='Documentation')]
+    assert repository._plan_labels(base_labels=labels, repo_labels=matching) == []
+
+
+def test_apply_label_ops(monkeypatch):
+    sent = []
+    monkeypatch.setattr(hub, 'send_json', lambda method, path, payload=None: sent.append((method, path, payload)))
+
+    plan = repository._plan_labels(
+        base_labels=[_label('good first issue', color='7057ff'), _label('Bug')],
+        repo_labels=[_label('bug'), _label('wontfix')],
+    )
+    for op in plan:
+        repository._apply_label_op(full_name='org/repo', op=op)
+    fields = {'color': 'ffffff', 'description': ''}
+    assert sent == [
+        ('POST', 'repos/org/repo/labels', {'name': 'good first issue', 'color': '7057ff', 'description': ''}),
+        ('PATCH', 'repos/org/repo/labels/bug', {'new_name': 'Bug', **fields}),
+        ('DELETE', 'repos/org/repo/labels/wontfix', None),
+    ]
+
+
+class Applier:
+    """Stubs GitHub for `_apply_update`, recording the repositories synced and returning `drift`"""
+
+    def __init__(self, monkeypatch, fingerprint: str = 'config-1', drift: dict = None):
+        self.fingerprint = fingerprint
+        self.drift = drift or {}
+        self.synced = []
+        monkeypatch.setattr(repository, 'get_fingerprint', lambda repo: self.fingerprint)
+        monkeypatch.setattr(hub, 'get_github_repo', lambda repo: repo)
+        monkeypatch.setattr(repository, '_repo_settings_sync', self.sync)
+
+    def sync(self, repo: str) -> dict:
+        self.synced.append(repo)
+        return self.drift
+
+    def apply(self, updated_at: str = '2021-02-15T10:00:00Z', **msg) -> list:
+        synced = len(self.synced)
+        repository._apply_update(
+            msg={'action': 'sync', 'repository': {'full_name': 'org/a', 'updated_at': updated_at}, **msg}
+        )
+        return self.synced[synced:]
+
+
+@pytest.mark.usefixtures('aws')
+def test_unchanged_fingerprint_skips_before_any_github_call(monkeypatch):
+    applier = Applier(monkeypatch)
+    assert applier.apply() == ['org/a']
+
+    monkeypatch.setattr(hub, 'get_github_repo', lambda repo: pytest.fail('GitHub called'))
+    assert applier.apply() == []
+
+
+@pytest.mark.usefixtures('aws')
+def test_changed_config_or_repository_is_reapplied(monkeypatch):
+    applier = Applier(monkeypatch)
+    assert applier.apply() == ['org/a']
+
+    applier.fingerprint = 'config-2'
+    assert applier.apply() == ['org/a']
+    assert applier.apply(updated_at='2021-02-16T10:00:00Z') == ['org/a']
+    assert applier.apply(updated_at='2021-02-16T10:00:00Z') == []
+
+
+@pytest.mark.usefixtures('aws')
+def test_force_bypasses_fingerprint(monkeypatch):
+    applier = Applier(monkeypatch)
+    assert applier.apply() == ['org/a']
+    assert applier.apply(force=True) == ['org/a']
+
+
+@pytest.mark.usefixtures('aws')
+def test_fingerprint_is_recorded_only_after_drift_free_pass(monkeypatch):
+    applier = Applier(monkeypatch, drift={'repository': {'has_wiki': {'from': True, 'to': False}}})
+    assert applier.apply() == ['org/a']
+    assert not repository._is_applied(full_name='org/a', fingerprint='config-1', updated_at='2021-02-15T10:00:00Z')
+
+    #: Writes changed `updated_at`, the next pass verifies nothing drifted before recording
+    applier.drift = {'repository': {}, 'security': {}, 'protection': {}}
+    assert applier.apply() == ['org/a']
+    assert repository._is_applied(full_name='org/a', fingerprint='config-1', updated_at='2021-02-15T10:00:00Z')
+
+
+CONFIG = {
+    'has_issues': True,
+    'has_wiki': False,
+    'enable_vulnerability_alert': True,
+    'enable_automated_security_fixes': True,
+    'default_branch': {'name': 'release/v1', 'require_code_owner_reviews': True, 'required_approving_review_count': 1},
+}
+
+
+class Repo:
+    """GitHub repository object recording the write calls made on it"""
+
+    name = 'a'
+    full_name = 'org/a'
+
+    def __init__(self):
+        self.writes = []
+
+    def __getattr__(self, method: str):
+        def write(**kwargs):
+            self.writes.append((method, kwargs))
+            return self
+
+        return write
+
+
+@pytest.fixture
+def github(monkeypatch) -> dict:
+    """GitHub API resources read by settings sync, by path"""
+    resources = {
+        'repos/org/a': {'has_issues': True, 'has_wiki': False, 'default_branch': 'release/v1'},
+        'repos/org/a/automated-security-fixes': {'enabled': True},
+        'repos/org/a/vulnerability-alerts': {},
+        'repos/org/a/branches/release%2Fv1/protection': {
+            'required_pull_request_reviews': {'require_code_owner_reviews': True, 'required_approving_review_count': 1}
+        },
+    }
+    monkeypatch.setattr(repository, 'get_config', lambda repo: CONFIG)
+    monkeypatch.setattr(hub, 'get_json', lambda path: resources[path])
+    monkeypatch.setattr(hub, 'get_json_if_exists', lambda path: resources.get(path))
+    monkeypatch.setattr(hub, 'invalidate_repo', lambda full_name: None)
+    return resources
+
+
+def test_settings_sync_without_drift_only_reads(github):
+    repo = Repo()
+    drift = repository._repo_settings_sync(repo=repo)
+    assert drift == {'repository': {}, 'security': {}, 'protection': {}}
+    assert repo.writes == []
+
+
+def test_settings_sync_writes_only_drifted_settings(github):
+    github['repos/org/a'].update({'has_wiki': True, 'default_branch': 'main'})
+    del github['repos/org/a/vulnerability-alerts']
+    github['repos/org/a/branches/release%2Fv1/protection']['required_pull_request_reviews'].update(
+        {'required_approving_review_count': 2}
+    )
+
+    repo = Repo()
+    drift = repository._repo_settings_sync(repo=repo)
+    assert drift['repository'] == {
+        'has_wiki': {'from': True, 'to': False},
+        'default_branch': {'from': 'main', 'to': 'release/v1'},
+    }
+    assert repo.writes == [
+        ('edit', {'has_wiki': False, 'default_branch': 'release/v1'}),
+        ('enable_vulnerability_alert', {}),
+        ('get_branch', {'branch': 'release/v1'}),
+        ('edit_protection', {'require_code_owner_reviews': True, 'required_approving_review_count': 1}),
+    ]
@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+
+import json
+import pytest
+from botocore.exceptions import ClientError
+from lambdas import idempotency, sns
+
+pytestmark = pytest.mark.usefixtures('aws')
+
+
+def _records(*deliveries: str, source: str = 'sqs') -> list:
+    records = []
+    for delivery in deliveries:
+        msg = json.dumps({'tag': {'X-GitHub-Delivery': delivery, 'repository': {'full_name': delivery.split('-')[0]}}})
+        if source == 'sns':
+            records.append({'Sns': {'MessageId': f'msg-{delivery}', 'Message': msg}})
+        else:
+            records.append({'messageId': f'msg-{delivery}', 'body': msg})
+    return records
+
+
+def _process(records: list, handler=lambda key, msgs: None, finish=None) -> dict:
+    return sns.process_records(
+        event={'Records': records},
+        msg_key='tag',
+        group=lambda msg: msg['repository']['full_name'],
+        handler=handler,
+        scope='test',
+        finish=finish,
+    )
+
+
+def test_groups_are_handled_together_in_order():
+    handled = {}
+    _process(_records('a-1', 'b-1', 'a-2'), handler=lambda key, msgs: handled.update({key: msgs}))
+    assert list(handled) == ['a', 'b']
+    assert [msg['X-GitHub-Delivery'] for msg in handled['a']] == ['a-1', 'a-2']
+
+
+def test_duplicate_deliveries_are_dropped():
+    handled = []
+    _process(_records('a-1'), handler=lambda key, msgs: handled.append(key))
+    _process(_records('a-1'), handler=lambda key, msgs: handled.append(key))
+    assert handled == ['a']
+
+
+def test_groups_failing_to_finish_are_redelivered():
+    response = _process(_records('a-1', 'b-1', 'c-1'), finish=lambda: ['b'])
+    assert response == {'batchItemFailures': [{'itemIdentifier': 'msg-b-1'}]}
+    assert not idempotency.claim(scope='test', delivery_id='a-1')
+    assert idempotency.claim(scope='test', delivery_id='b-1')
+
+
+def test_finish_raising_fails_every_handled_group():
+    def finish():
+        raise RuntimeError('publish failed')
+
+    response = _process(_records('a-1', 'b-1'), finish=finish)
+    assert response == {'batchItemFailures': [{'itemIdentifier': 'msg-a-1'}, {'itemIdentifier': 'msg-b-1'}]}
+    assert idempotency.claim(scope='test', delivery_id='a-1')
+    assert idempotency.claim(scope='test', delivery_id='b-1')
+
+
+def test_sns_failures_are_raised_once_handled_groups_are_finished():
+    finished = []
+
+    def handle(key, msgs):
+        if key == 'b':
+            raise RuntimeError('handler failed')
+
+    with pytest.raises(RuntimeError, match='handler failed'):
+        _process(_records('a-1', 'b-1', source='sns'), handler=handle, finish=lambda: finished.append(True) or [])
+    assert finished == [True]
+    assert not idempotency.claim(scope='test', delivery_id='a-1')
+    assert idempotency.claim(scope='test', delivery_id='b-1')
+
+
+def _client_error(operation: str) -> ClientError:
+    return ClientError({'Error': {'Code': 'InternalError', 'Message': 'failed'}}, operation)
+
+
+class Transport:
+    """Message transport failing the batch entries and messages in `failing`"""
+
+    def __init__(self, failing=()):
+        self.failing = set(failing)
+        self.batches = []
+        self.published = []
+
+    def emit_topic(self) -> str:
+        return 'topic'
+
+    def publish(self, message: str, topic_arn: str, **kwargs) -> str:
+        self.published.append(message)
+        if f'retry-{message}' in self.failing:
+            raise _client_error('Publish')
+        return f'single-{message}'
+
+    def publish_batch(self, entries: list, topic_arn: str) -> dict:
+        self.batches.append([entry['Message'] for entry in entries])
+        if 'batch' in self.failing:
+            raise _client_error('PublishBatch')
+        ok = [entry for entry in entries if entry['Message'] not in self.failing]
+        return {
+            'Successful': [{'Id': entry['Id'], 'MessageId': f'batch-{entry["Message"]}'} for entry in ok],
+            'Failed': [{'Id': entry['Id'], 'Code': 'InternalError'} for entry in entries if entry not in ok],
+        }
+
+
+def test_batches_split_at_entries_and_bytes():
+    assert [len(batch) for batch in sns._batches(str(i) for i in range(25))] == [10, 10, 5]
+    assert [batch[0]['Id'] for batch in sns._batches(str(i) for i in range(25))] == ['0', '10', '20']
+
+    large = 'x' * (100 * 1024)
+    assert [len(batch) for batch in sns._batches([large, large, large, 'small'])] == [2, 2]
+    #: A batch may reach the byte limit exactly
+    exact = 'x' * (sns.BATCH_BYTES // 2)
+    assert [len(batch) for batch in sns._batches([exact, exact, 'small'])] == [2, 1]
+
+
+def test_partially_failed_batch_is_retried_individually(monkeypatch):
+    transport = Transport(failing={'1', '2', 'retry-2'})
+    monkeypatch.setattr(sns, 'TRANSPORT', transport)
+
+    results = sns._publish_batch(batch=[{'Id': str(i), 'Message': str(i)} for i in range(3)], topic_arn='topic')
+    assert sorted(results, key=lambda result: result['index']) == [
+        {'index': 0, 'message_id': 'batch-0'},
+        {'index': 1, 'message_id': 'single-1'},
+        {'index': 2, 'error': str(_client_error('Publish'))},
+    ]
+    assert transport.published == ['1', '2']
+
+
+def test_failed_batch_call_is_retried_individually(monkeypatch):
+    transport = Transport(failing={'batch'})
+    monkeypatch.setattr(sns, 'TRANSPORT', transport)
+
+    results = sns._publish_batch(batch=[{'Id': str(i), 'Message': str(i)} for i in range(2)], topic_arn='topic')
+    assert [result['message_id'] for result in results] == ['single-0', 'single-1']
+
+
+def test_emit_sns_msgs_returns_results_in_input_order(monkeypatch):
+    transport = Transport(failing={'5', '17'})
+    monkeypatch.setattr(sns, 'TRANSPORT', transport)
+
+    results = sns.emit_sns_msgs(messages=[str(i) for i in range(25)], concurrency=3)
+    assert [result['index'] for result in results] == list(range(25))
+    assert [result['message_id'] for result in results if result['message_id'].startswith('single')] == [
+        'single-5',
+        'single-17',
+    ]
+    assert [len(batch) for batch in transport.batches] == [10, 10, 5]
@@ -10,13 +10,17 @@
 from aws_lambda_powertools.logging import Logger
 from aws_lambda_powertools.tracing import Tracer
 from botocore.exceptions import ClientError
-from github.Repository import Repository
 
+import json
 import os
 import re
-from lambdas import dynamodb, hub, sns
+from lambdas import checkpoint, dynamodb, hub, idempotency, metrics, profiling, readme, sns
 from lambdas.hub import GithubEvent
-from typing import Dict, Optional
+from lambdas.ratelimit import Priority
+from typing import TYPE_CHECKING, Dict, Iterator, List, Optional, Tuple
+
+if TYPE_CHECKING:
+    from github.Repository import Repository
 
 #: DynamoDB table for versions
 VERSION_TABLE = os.environ.get('VERSION_TABLE')
@@ -30,7 +34,7 @@ tracer = Tracer()
 logger = Logger()
 
 
-def _get_tag_data(payload: Dict, repo: Optional[Repository] = None) -> Dict:
+def _get_tag_data(payload: Dict, repo: Optional['Repository'] = None) -> Dict:
     """
     Extract tag data from triggered event.
 
@@ -41,13 +45,15 @@ def _get_tag_data(payload: Dict, repo: Optional[Repository] = None) -> Dict:
     if not repo:
         #: used for version events
         repo_full_name = payload.get('repository', {}).get('full_name')
-        repo = hub.get_github_repo(repo_full_name)
     else:
         #: used for out of band syncing repository versions
         repo_full_name = repo.full_name
-    tags = repo.get_tags()
+    with profiling.span('get_tags'):
+        versions = hub.get_all_json(
+            path=f'repos/{repo_full_name}/tags', transform=lambda page: [t['name'] for t in page]
+        )
 
-    return {'repository': repo_full_name, 'versions': [t.name for t in tags]}
+    return {'repository': repo_full_name, 'versions': versions}
 
 
 def _update_version_table(data: dict):
@@ -72,28 +78,46 @@ def _update_version_table(data: dict):
 
 
 @tracer.capture_lambda_handler
-@loggerinject_lambda_context(log_event=True)
+@logger.inject_lambda_context(log_event=True)
+@metrics.log_metrics
+@profiling.profile
 def new_tag(event: Dict, _c: Dict) -> Dict:
     """
-    Lambda function that responds to new tag events.
+    Lambda function that responds to new tag events, delivered individually (SNS) or in batches (SQS).
 
     :param event: lambda expected event object
     :param _c: lambda expected context object (unused)
-    :returns: none
+    :returns: partial batch response
     """
-    msg = sns.get_sns_msg(event=event, msg_key=GithubEvent.tag.value)
-    logger.info({'operation': 'new_tag', 'sns_payload': msg})
-
-    #: Extract data and update DynamoDB table
-    data = _get_tag_data(payload=msg)
-    _update_version_table(data=data)
+    updated = []
 
-    #: No message payload, just triggering update to versions section of README
-    sns.emit_sns_msg(message={})
+    def handle(repo_full_name: str, msgs: List[Dict]):
+        logger.info({'operation': 'new_tag', 'repository': repo_full_name, 'sns_payloads': msgs})
+        #: Extract data and update DynamoDB table, repeated events for a repository share a single tag listing
+        data = _get_tag_data(payload=msgs[-1])
+        _update_version_table(data=data)
+        updated.append(repo_full_name)
+
+    def finish() -> List[str]:
+        if updated:
+            #: No message payload, just triggering update to versions section of README
+            sns.emit_sns_msg(message={})
+        return []
+
+    return sns.process_records(
+        event=event,
+        msg_key=GithubEvent.tag.value,
+        group=lambda msg: msg.get('repository', {}).get('full_name'),
+        handler=handle,
+        scope='new_tag',
+        finish=finish,
+    )
 
 
 @tracer.capture_lambda_handler
-@loggerinject_lambda_context(log_event=True)
+@logger.inject_lambda_context(log_event=True)
+@metrics.log_metrics
+@profiling.profile
 def create_release(event: Dict, _c: Dict) -> Dict:
     """
     Lambda function that responds to new tag events to create a release.
@@ -105,7 +129,10 @@ def create_release(event: Dict, _c: Dict) -> Dict:
     msg = sns.get_sns_msg(event=event, msg_key=GithubEvent.tag.value)
     logger.info({'operation': 'create_release', 'sns_payload': msg})
 
-    if msg.get('X-GitHub-Event') == 'create':
+    delivery_id = msg.get('X-GitHub-Delivery')
+    if msg.get('X-GitHub-Event') != 'create' or not idempotency.claim(scope='create_release', delivery_id=delivery_id):
+        return
+    try:
         updated_repo = hub.get_github_repo(msg.get('repository', {}).get('full_name'))
         main = updated_repo.get_branch('main')
         tag_name = msg.get('ref')
@@ -116,38 +143,37 @@ def create_release(event: Dict, _c: Dict) -> Dict:
         updated_repo.create_git_release(
             tag=tag_name, name=tag_name, message=message, draft=False, prerelease=False, target_commitish=main
         )
+    except Exception:
+        #: Allow a retry or redelivery to create the release
+        idempotency.release(scope='create_release', delivery_id=delivery_id)
+        raise
+    idempotency.complete(scope='create_release', delivery_id=delivery_id)
 
 
-@tracer.capture_lambda_handler
-@loggerinject_lambda_context(log_event=True)
-def update_readme(event: Dict, _c: Dict) -> Dict:
+def _release_url(repo: str, version: str) -> str:
+    """GitHub release page of `version` of repository `repo`"""
+    return f'https://github.com/{repo}/releases/tag/{version}'
+
+
+def _render_readme(patches: List[Dict], rescan: bool) -> int:
     """
-    Lambda function to update versions section of metadata repo README file.
+    Render and commit versions section of metadata repo README file.
 
-    :param event: lambda expected event object
-    :param _c: lambda expected context object (unused)
-    :returns: none
+    :param patches: queued patches (unused, versions section is always fully rendered)
+    :param rescan: full re-render requested (unused, versions section is always fully rendered)
+    :returns: number of bytes written to README
     """
-    logger.info({'operation': 'update_readme'})
-    readme = 'README.md'
-    meta_repo = hub.get_github_repo(METADATA_REPO)
-    file = meta_repo.get_contents(readme)
     result = ''
 
-    #: Iterate over all records
-    paginator = dynamodb.CLIENT.get_paginator('scan')
-    iterator = paginator.paginate(TableName=VERSION_TABLE)
-    for itr in iterator:
-        items = itr.get('Items')
-        for item in items:
-            data = dynamodb.deserialize(item)
-            repo, versions = data.get('repository'), data.get('versions')
-
-            #: Create a section per repository with all versions listed under dropdown
-            url = lambda v: f'https://github.com/{repo}/releases/tag/{v}'
-            lis = '\n\t'.join([f'<li><a href="{url(v)}">{v}</a></li>' for v in versions])
-            content = f'''
-#### `{repo.split("/")[1]}` : [{versions[0]}]({url(versions[0])})
+    #: Iterate over all records, ordered by repository name
+    records = dynamodb.scan(table=VERSION_TABLE, attributes=['repository', 'versions'])
+    for data in sorted(records, key=lambda d: d.get('repository')):
+        repo, versions = data.get('repository'), data.get('versions')
+
+        #: Create a section per repository with all versions listed under dropdown
+        lis = '\n\t'.join([f'<li><a href="{_release_url(repo=repo, version=v)}">{v}</a></li>' for v in versions])
+        content = f'''
+#### `{repo.split("/")[1]}` : [{versions[0]}]({_release_url(repo=repo, version=versions[0])})
 
 <details>
 <summary>All Versions</summary>
@@ -156,33 +182,91 @@ def update_readme(event: Dict, _c: Dict) -> Dict:
     </ul>
 </details>
     '''
-            result += content
+        result += content
     #: Make sure tags are put back for next update
     result = f'<!-- Tag Start -->\n{result}\n<!-- Tag End -->'
-    final_content = re.sub(
-        '<!-- Tag Start -->.*?<!-- Tag End -->', result, file.decoded_content.decode('utf-8'), flags=re.DOTALL
+    pattern = re.compile('<!-- Tag Start -->.*?<!-- Tag End -->', flags=re.DOTALL)
+    return readme.commit(
+        apply=lambda content: pattern.sub(lambda _: result, content), message='Tag section updated in README'
     )
-    meta_repo.update_file(path=readme, message='Tag section updated in README', content=final_content, sha=file.sha)
 
 
 @tracer.capture_lambda_handler
-@loggerinject_lambda_context(log_event=True)
-def sync(event: Dict, _c: Dict) -> Dict:
+@logger.inject_lambda_context(log_event=True)
+@metrics.log_metrics
+@profiling.profile
+def update_readme(event: Dict, context: Dict) -> Dict:
     """
-    Lambda function to sync all repository versions.
+    Lambda function to update versions section of metadata repo README file.
+
+    Triggers received within the coalescing window are merged into a single render and commit.
 
     :param event: lambda expected event object
-    :param _c: lambda expected context object (unused)
-    :returns: none
+    :param context: lambda expected context object
+    :returns: number of triggers absorbed and commits made
     """
-    logger.info({'operation': 'sync'})
-    #: Purge table first before re-populating
-    dynamodb.delete_all_items(key_ids=['repository'], table=VERSION_TABLE)
+    logger.info({'operation': 'update_readme'})
+    message = json.loads(event['Records'][0]['Sns']['Message'])
+    return readme.coalesce(section='versions', message=message, render=_render_readme, context=context)
 
-    for repo in hub.get_github_repos(org=ORGANIZATION):
-        #: Extract data and update DynamoDB table
-        data = _get_tag_data(payload={}, repo=repo)
-        _update_version_table(data=data)
 
-    #: No message payload, just triggering update to versions section of README
-    sns.emit_sns_msg(message={})
+def _fetch_versions(cursor: Optional[str]) -> Iterator[Tuple[Dict[str, Dict], str]]:
+    """
+    Fetch tag data of organization repositories in chunks using the configured sync engine.
+
+    :param cursor: cursor of the last processed chunk, `None` to start from the first repository
+    :returns: iterator of chunks - tag data objects by repository - paired with the chunk cursor
+    """
+    if hub.SYNC_ENGINE == 'graphql':
+        #: Bulk queries fetch many repositories per request
+        for page, after in hub.get_org_pages(org=ORGANIZATION, connections=['refs'], after=cursor):
+            yield {data.get('repository'): data.get('versions') for data in page}, after
+    else:
+        #: Repositories of a chunk are fetched concurrently
+        def fetch(repo: 'Repository') -> Tuple[str, Dict]:
+            return repo.full_name, _get_tag_data(payload={}, repo=repo)
+
+        for repos, last in checkpoint.repository_chunks(org=ORGANIZATION, cursor=cursor):
+            yield dict(hub.map_repos(func=fetch, repos=repos)), last
+
+
+@tracer.capture_lambda_handler
+@logger.inject_lambda_context(log_event=True)
+@metrics.log_metrics
+@profiling.profile
+@hub.GOVERNOR.prioritize(Priority.bulk)
+def sync(event: Dict, context: Dict) -> Dict:
+    """
+    Lambda function to sync all repository versions.
+
+    Repositories are synced in chunks from a persisted cursor, a run continues in a new invocation when time runs low.
+
+    :param event: lambda expected event object
+    :param context: lambda expected context object
+    :returns: report of how far the sync run got
+    """
+    logger.info({'operation': 'sync'})
+    table = checkpoint.RepositoryTable(table=VERSION_TABLE, key_ids=['repository'])
+
+    def process(chunk: Dict[str, Dict]) -> Dict[str, int]:
+        #: Results of a chunk stream into table reconciliation (only changes are written)
+        items = (data for data in chunk.values() if data.get('versions'))
+        return table.reconcile(items=items, repositories=chunk)
+
+    def finish() -> Dict[str, int]:
+        counts = table.prune(repositories={repo.full_name for repo in hub.get_github_repos(org=ORGANIZATION)})
+        #: No message payload, just triggering update to versions section of README
+        sns.emit_sns_msg(message={})
+        return counts
+
+    report = checkpoint.run(
+        name='versions',
+        event=event,
+        context=context,
+        source=hub.SYNC_ENGINE,
+        chunks=_fetch_versions,
+        process=process,
+        finish=finish,
+    )
+    logger.info({'operation': 'sync', **report, 'cache': hub.cache_stats(), 'rate_limit': hub.GOVERNOR.stats()})
+    return report